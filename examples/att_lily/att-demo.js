@@ -726,6 +726,7 @@ async function startMainAvatar() {
     state.mainTranscript = [];
     clearTranscriptUI('main');
     ui.mainDownloadBtn.disabled = true;
+    warmAnalysisAPI();
 
     try {
         await state.mainSDK.start();
@@ -786,6 +787,7 @@ async function openCheck(checkId) {
     }
 
     state.activeCheck = check;
+    warmAnalysisAPI();
 
     // Load DPP JSON
     try {
@@ -934,11 +936,24 @@ function formatTranscriptForAPI(transcript) {
  * Send an analysis request to the shared Lambda API.
  * Stores the report in state for later download.
  *
+ * When the user is logged in, the request is sent as `analyze_and_deliver`:
+ * the Lambda returns the report and emails it in the background, so the
+ * browser never re-uploads the report for a separate email request.
+ *
  * @param {Object} payload - Request body (must include analysis_mode + transcript)
  * @param {string} productLabel - Label stored alongside the report for download naming
  * @returns {Promise<Object|null>} Analysis report or null on failure
  */
 async function callAnalysisAPI(payload, productLabel) {
+    if (state.userEmail) {
+        payload = {
+            ...payload,
+            analysis_mode: 'analyze_and_deliver',
+            report_mode: payload.analysis_mode,
+            deliver: { to_email: state.userEmail, title: productLabel }
+        };
+    }
+
     try {
         const response = await fetch(CONFIG.ANALYSIS_API_URL, {
             method: 'POST',
@@ -948,6 +963,11 @@ async function callAnalysisAPI(payload, productLabel) {
 
         const result = await response.json();
         if (result.success) {
+            if (result.delivery?.status === 'failed') {
+                console.warn('[Email] Report email failed for', result.delivery.to_email);
+            } else if (result.delivery?.status === 'skipped') {
+                console.warn('[Email] Report email skipped:', result.delivery.reason, result.delivery.to_email);
+            }
             state.lastReport = result.summary;
             state.lastReportProduct = productLabel;
             return result.summary;
@@ -961,6 +981,18 @@ async function callAnalysisAPI(payload, productLabel) {
     }
 }
 
+/**
+ * Prime an analysis Lambda container while the session runs (fire-and-forget),
+ * so the end-of-session report skips client setup and TLS handshakes.
+ */
+function warmAnalysisAPI() {
+    fetch(CONFIG.ANALYSIS_API_URL, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ analysis_mode: 'warmup' })
+    }).catch(err => console.warn('[Analysis] Warmup failed:', err.message));
+}
+
 /**
  * Analyze a knowledge check session.
  * @param {Array} transcript - Transcript entries
@@ -1074,9 +1106,6 @@ function hideReportLoading() {
 function showReport(report, title) {
     ui.reportModalTitle.textContent = title;
 
-    // Fire-and-forget: email the report to the user
-    emailReport(report, title);
-
     const score = Number(report.overall_score ?? report.score) || 0;
     const grade = report.grade || '';
     const summary = report.summary || report.summary_text || '';
@@ -1147,30 +1176,6 @@ function showReport(report, title) {
     ui.reportModal.classList.add('active');
 }
 
-/**
- * Email the report to the logged-in user (fire-and-forget).
- * @param {Object} report - Report data
- * @param {string} title - Report title
- */
-async function emailReport(report, title) {
-    if (!state.userEmail || !report) return;
-
-    try {
-        await fetch(CONFIG.ANALYSIS_API_URL, {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-                analysis_mode: 'send_report_email',
-                to_email: state.userEmail,
-                report,
-                title
-            })
-        });
-    } catch (err) {
-        console.warn('[Email] Report email failed:', err.message);
-    }
-}
-
 /**
  * Close the report modal.
  */
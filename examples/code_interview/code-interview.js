@@ -10,7 +10,7 @@
  *   Phase 3: Client-side assembly of final v1.5 summary
  *
  * @see analyzeSessionWithData — orchestrates the 3-phase analysis
- * @see callAnalysisAPI — HTTP helper with retry logic (503/429 → 3s backoff)
+ * @see callAnalysisAPI — HTTP helper with retry logic (503/429 → Retry-After or 3s backoff)
  */
 
 // =============================================================================
@@ -27,6 +27,9 @@ const CONFIG = Object.freeze({
     // Call analysis API endpoint (same as HR demo)
     ANALYSIS_API_URL: 'https://30vsmo8j0l.execute-api.us-west-2.amazonaws.com',
 
+    // Send per-problem content as store_content refs (needs CONTENT_STORE=s3://... on the Lambda)
+    CONTENT_REFS: false,
+
     // Summary prompt file path (legacy — not used by iterative analysis flow)
     SUMMARY_PROMPT_PATH: 'summary_prompt.txt',
 
@@ -301,6 +304,9 @@ const state = {
     // Analysis results
     lastSessionSummary: null,
 
+    // Server answered store_content with 404 (refs off); not retried until reload
+    contentRefsOff: false,
+
     // Custom summary prompt (loaded from file)
     summaryPrompt: null,
 
@@ -1058,13 +1064,15 @@ async function analyzeSessionWithData(transcript, dpp) {
         // --- Phase 1: Analyze each problem in parallel ---
         updateAnalysisProgress('Analyzing problems...', 0, problemsAttemptedList.length);
 
-        const perProblemPromises = problemsAttemptedList.map(problem =>
-            callAnalysisAPI({
-                analysis_mode: 'per_problem',
-                transcript: formattedTranscript,
-                problem_focus: problem,
-                dpp: leanDpp
-            })
+        // Upload the transcript + DPP once and send refs, instead of the full transcript per problem.
+        // The first problem goes inline alongside the upload; the rest follow on the refs.
+        const useRefs = CONFIG.CONTENT_REFS && !state.contentRefsOff && problemsAttemptedList.length > 1;
+        const refsPromise = useRefs ? storeSessionContent(formattedTranscript, leanDpp) : Promise.resolve(null);
+
+        const perProblemPromises = problemsAttemptedList.map((problem, idx) =>
+            idx === 0 && useRefs
+                ? analyzeProblem(problem, formattedTranscript, leanDpp, null)
+                : refsPromise.then(refs => analyzeProblem(problem, formattedTranscript, leanDpp, refs))
         );
 
         const perProblemResults = await Promise.allSettled(perProblemPromises);
@@ -1162,16 +1170,69 @@ async function analyzeSessionWithData(transcript, dpp) {
     }
 }
 
+/**
+ * Upload the session's transcript and DPP once (store_content).
+ * Returns { transcript, dpp } refs, or null when the server has refs off (404) or the upload fails.
+ */
+async function storeSessionContent(transcript, dpp) {
+    const result = await callAnalysisAPI({ analysis_mode: 'store_content', transcript, dpp });
+    if (result.success && result.refs?.transcript && result.refs?.dpp) {
+        return result.refs;
+    }
+    if (result.status === 404) {
+        state.contentRefsOff = true;
+    }
+    console.log('[Analysis] Content refs unavailable, sending content inline:', result.error);
+    return null;
+}
+
+/**
+ * Run one per_problem analysis, by content refs when available.
+ * A ref the server no longer knows (409 UNKNOWN_REF) falls back to the inline content.
+ */
+async function analyzeProblem(problem, transcript, dpp, refs) {
+    if (refs) {
+        const result = await callAnalysisAPI({
+            analysis_mode: 'per_problem',
+            transcript_ref: refs.transcript,
+            dpp_ref: refs.dpp,
+            problem_focus: problem
+        });
+        if (result.success || result.code !== 'UNKNOWN_REF') {
+            return result;
+        }
+    }
+    return callAnalysisAPI({
+        analysis_mode: 'per_problem',
+        transcript,
+        problem_focus: problem,
+        dpp
+    });
+}
+
+/**
+ * Ask the analysis Lambda to prime a container (clients, Bedrock/SES connections).
+ */
+function warmAnalysisAPI() {
+    fetch(CONFIG.ANALYSIS_API_URL, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ analysis_mode: 'warmup' })
+    }).catch(err => console.warn('[Analysis] Warmup failed:', err.message));
+}
+
 /**
  * Call the analysis API with retry logic.
- * Returns { success, summary, usage } or { success: false, error }.
+ * Returns { success, summary, usage } or { success: false, error, status, code }
+ * (status and code — the server's error code, e.g. UNKNOWN_REF — only for HTTP errors).
  */
 async function callAnalysisAPI(payload) {
     const MAX_RETRIES = 2;
+    let retryDelayMs = 3000;
     for (let attempt = 1; attempt <= MAX_RETRIES; attempt++) {
         try {
             if (attempt > 1) {
-                await new Promise(r => setTimeout(r, 3000));
+                await new Promise(r => setTimeout(r, retryDelayMs));
             }
             const response = await fetch(CONFIG.ANALYSIS_API_URL, {
                 method: 'POST',
@@ -1179,11 +1240,15 @@ async function callAnalysisAPI(payload) {
                 body: JSON.stringify(payload)
             });
             if ((response.status === 503 || response.status === 429) && attempt < MAX_RETRIES) {
-                console.warn(`API returned ${response.status}, retrying...`);
+                // Honor the server's Retry-After hint (admission control), capped to keep the UI responsive
+                const retryAfter = Number(response.headers.get('Retry-After'));
+                retryDelayMs = retryAfter > 0 ? Math.min(retryAfter * 1000, 10000) : 3000;
+                console.warn(`API returned ${response.status}, retrying in ${retryDelayMs / 1000}s...`);
                 continue;
             }
             if (!response.ok) {
-                return { success: false, error: `HTTP ${response.status}` };
+                const body = await response.json().catch(() => ({}));
+                return { success: false, error: `HTTP ${response.status}`, status: response.status, code: body.code };
             }
             return await response.json();
         } catch (err) {
@@ -1899,6 +1964,9 @@ async function startInterview() {
     // Switch to interview screen
     switchScreen('interview');
 
+    // Prime an analysis container while the interview runs (fire-and-forget)
+    warmAnalysisAPI();
+
     // Update user badge
     if (ui.userBadge) {
         ui.userBadge.textContent = `${state.user.firstName} ${state.user.lastName}`;
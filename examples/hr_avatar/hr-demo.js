@@ -31,6 +31,10 @@ const CONFIG = Object.freeze({
     // Call analysis API endpoint (AWS Lambda + API Gateway)
     ANALYSIS_API_URL: 'https://30vsmo8j0l.execute-api.us-west-2.amazonaws.com',
 
+    // Progressive analysis: a draft summary shows first, the full one is polled for
+    RESULT_POLL_INTERVAL_MS: 2000,
+    RESULT_POLL_TIMEOUT_MS: 90000,
+
     // Delay (ms) after SHOWING_AGENT before injecting DPP
     // This ensures the avatar is fully ready to receive context
     DPP_INJECTION_DELAY_MS: 500,
@@ -1254,23 +1258,67 @@ async function analyzeCall() {
         const response = await fetch(CONFIG.ANALYSIS_API_URL, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ transcript: formattedTranscript, dpp })
+            body: JSON.stringify({ transcript: formattedTranscript, dpp, progressive: true })
         });
 
         const result = await response.json();
 
-        if (result.success) {
-            state.lastCallSummary = result.summary;
-            console.log('Call analysis complete:', state.lastCallSummary);
-            showCallSummary(result.summary);
-        } else {
+        if (!result.success) {
             console.error('Analysis failed:', result.error);
+            return;
         }
+
+        // Older deployments ignore `progressive` and return the full summary directly
+        const isDraft = Boolean(result.result_id);
+        state.lastCallSummary = result.summary;
+        console.log(isDraft ? 'Draft analysis ready:' : 'Call analysis complete:', result.summary);
+        showCallSummary(result.summary, { draft: isDraft });
+        if (!isDraft) return;
+
+        const full = await pollAnalysisResult(result.result_id);
+        if (!full) return;
+        state.lastCallSummary = full;
+        console.log('Call analysis complete:', full);
+
+        // Replace the draft in place; don't reopen the modal if the user closed it
+        const modal = document.getElementById('summary-modal');
+        if (modal?.style.display !== 'none') showCallSummary(full);
     } catch (error) {
         console.error('Failed to analyze call:', error);
     }
 }
 
+/**
+ * Poll the analysis API for the full summary behind a progressive draft.
+ * @param {string} resultId - result_id returned with the draft
+ * @returns {Promise<Object|null>} Full summary, or null on failure/timeout
+ */
+async function pollAnalysisResult(resultId) {
+    const deadline = Date.now() + CONFIG.RESULT_POLL_TIMEOUT_MS;
+
+    while (Date.now() < deadline) {
+        await new Promise(resolve => setTimeout(resolve, CONFIG.RESULT_POLL_INTERVAL_MS));
+        try {
+            const response = await fetch(CONFIG.ANALYSIS_API_URL, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ analysis_mode: 'result', result_id: resultId })
+            });
+            const record = await response.json();
+            if (record.status === 'complete') return record.summary;
+            if (record.status === 'failed' || response.status === 404) {
+                console.error('Full analysis failed:', record.error);
+                return null;
+            }
+        } catch (error) {
+            console.warn('Result poll failed, retrying:', error);
+        }
+    }
+
+    console.error('Full analysis not ready after', CONFIG.RESULT_POLL_TIMEOUT_MS / 1000, 's');
+    return null;
+}
+
 /**
  * Build DPP object for analysis API.
  * Ensures CV context is threaded through for consistent evaluation.
@@ -1303,9 +1351,11 @@ function buildDPPForAnalysis() {
 
 /**
  * Display call summary modal.
- * @param {Object} summary - Analysis result
+ * @param {Object} summary - Analysis result (full summary or progressive draft)
+ * @param {Object} [options]
+ * @param {boolean} [options.draft=false] - Summary is a draft; the full one is on its way
  */
-function showCallSummary(summary) {
+function showCallSummary(summary, { draft = false } = {}) {
     let modal = document.getElementById('summary-modal');
     if (!modal) {
         modal = document.createElement('div');
@@ -1320,13 +1370,14 @@ function showCallSummary(summary) {
     modal.innerHTML = `
         <div class="summary-modal-content">
             <div class="summary-header">
-                <h3>Call Summary</h3>
+                <h3>Call Summary${draft ? ' (draft)' : ''}</h3>
                 <button class="summary-close-btn" onclick="closeSummaryModal()">&times;</button>
             </div>
             <div class="summary-body">
                 <div class="summary-section">
                     <h4>Overview</h4>
                     <p>${escapeHtml(summary.overview || 'No overview available')}</p>
+                    ${draft ? '<p class="summary-draft-note">Preparing the full report&hellip;</p>' : ''}
                 </div>
 
                 ${fitScore != null ? `
@@ -1349,6 +1400,15 @@ function showCallSummary(summary) {
                 </div>
                 ` : ''}
 
+                ${summary.strengths?.length ? `
+                <div class="summary-section">
+                    <h4>Strengths</h4>
+                    <ul class="next-steps-list">
+                        ${summary.strengths.map(s => `<li>${escapeHtml(s)}</li>`).join('')}
+                    </ul>
+                </div>
+                ` : ''}
+
                 ${summary.gaps?.length ? `
                 <div class="summary-section">
                     <h4>Gaps & Follow-ups</h4>
@@ -1367,6 +1427,7 @@ function showCallSummary(summary) {
                 </div>
                 ` : ''}
 
+                ${draft ? '' : `
                 <div class="summary-section">
                     <h4>Call Quality</h4>
                     <div class="cq-badges">
@@ -1375,6 +1436,7 @@ function showCallSummary(summary) {
                         <span class="badge">Engagement: ${escapeHtml(summary.cq?.eng || 'unknown')}</span>
                     </div>
                 </div>
+                `}
             </div>
             <div class="summary-footer">
                 <button class="btn btn-secondary" onclick="downloadCallSummary()">Download JSON</button>
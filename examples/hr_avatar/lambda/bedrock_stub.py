@@ -0,0 +1,221 @@
+"""
+Recorded-response stubs for the Bedrock and SES clients used by lambda_function.
+
+Lets lambda_handler run in-process without AWS: every invoke_model call is
+answered from recorded_responses.json (keyed by analysis mode, and by problem id
+for per_problem; multi_problem answers are assembled from the per_problem
+recordings of the listed problems), and every send_email call is accepted and logged. Each call
+records its entry/exit timestamps so callers can split handler time into
+"before the model" (prompt build) and "after the model" (parse + serialize).
+
+Like the model, the stub honors the request's max_tokens: a recording longer
+than that is cut off mid-JSON with stop_reason "max_tokens". For parameter
+sweeps it can also model other models (relative latency and verbosity per
+model id) and temperature (output length spread grows with temperature).
+
+Usage:
+    import lambda_function as lf
+    from bedrock_stub import stub_clients, installed
+
+    bedrock, ses = stub_clients(lf)
+    with installed(lf, bedrock, ses):
+        lf.lambda_handler({'body': json.dumps(payload)}, None)
+"""
+
+import io
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+RECORDED_RESPONSES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recorded_responses.json')
+
+_PROBLEM_ID_RE = re.compile(r'\(id: ([^,]+),')
+
+
+def load_recorded_responses(path=RECORDED_RESPONSES_PATH):
+    with open(path) as f:
+        return json.load(f)
+
+
+def system_prompt_modes(lf):
+    """Map each built-in system prompt in lambda_function to its analysis mode."""
+    return {
+        lf.PER_PROBLEM_SYSTEM_PROMPT: 'per_problem',
+        lf.MULTI_PROBLEM_SYSTEM_PROMPT: 'multi_problem',
+        lf.SYNTHESIS_SYSTEM_PROMPT: 'synthesis',
+        lf.SYNTHESIS_PROSE_SYSTEM_PROMPT: 'synthesis_prose',
+        lf.KNOWLEDGE_CHECK_SYSTEM_PROMPT: 'knowledge_check',
+        lf.TRAINING_SUMMARY_SYSTEM_PROMPT: 'training_summary',
+        lf.GENERAL_ANALYSIS_SYSTEM_PROMPT: 'general',
+        lf.HR_SYSTEM_PROMPT: 'full',
+        lf.HR_DRAFT_SYSTEM_PROMPT: 'full_draft',
+    }
+
+
+def truncate_message(message, max_tokens):
+    """Cut a Bedrock message whose output exceeds max_tokens, as the model would: text cut, stop_reason set."""
+    produced = message['usage']['output_tokens']
+    if not max_tokens or produced <= max_tokens:
+        return message
+    text = message['content'][0]['text']
+    return dict(message, content=[{'type': 'text', 'text': text[:len(text) * max_tokens // produced]}],
+                stop_reason='max_tokens', usage=dict(message['usage'], output_tokens=max_tokens))
+
+
+class BedrockExceptions:
+    """Mirror of the botocore modeled exceptions that lambda_handler catches."""
+
+    class ThrottlingException(Exception):
+        pass
+
+    class ModelTimeoutException(Exception):
+        pass
+
+
+class StubBedrock:
+    """Drop-in for boto3's bedrock-runtime client that replays recorded responses."""
+
+    exceptions = BedrockExceptions
+
+    def __init__(self, prompt_modes, responses=None, latency_s=0.0, token_latency_s=0.0, max_concurrency=None,
+                 model_profiles=None, length_spread=0.0, seed=0):
+        self.prompt_modes = prompt_modes
+        self.responses = responses or load_recorded_responses()
+        self.latency_s = latency_s
+        self.token_latency_s = token_latency_s  # per output token, so shorter answers return sooner
+        self.max_concurrency = max_concurrency  # calls beyond this many in flight are throttled
+        # {model_id: {"latency": x, "verbosity": y}} relative to the recordings; unlisted models are 1.0
+        self.model_profiles = model_profiles or {}
+        self.length_spread = length_spread  # log-normal sigma of output length per unit of temperature
+        self._rng = random.Random(seed)
+        self.calls = []
+        self.throttled = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.throttled = 0
+
+    def _select(self, mode, request):
+        if mode == 'multi_problem':
+            return self._select_multi(request)
+        recorded = self.responses.get(mode) or self.responses['full']
+        if mode != 'per_problem':
+            return recorded
+        match = _PROBLEM_ID_RE.search(request['messages'][0]['content'])
+        return self._per_problem(match.group(1) if match else '')
+
+    def _per_problem(self, problem_id):
+        recorded = self.responses['per_problem']
+        if problem_id in recorded:
+            return recorded[problem_id]
+        fallback = next(iter(recorded.values()))
+        return dict(fallback, content=dict(fallback['content'], problem_id=problem_id))
+
+    def _select_multi(self, request):
+        # One generation: the prompt (transcript) is read once, every problem's JSON is written
+        parts = [self._per_problem(problem_id)
+                 for problem_id in _PROBLEM_ID_RE.findall(request['messages'][0]['content'])]
+        return {
+            'content': {'problems': [part['content'] for part in parts]},
+            'usage': {'input_tokens': max(part['usage']['input_tokens'] for part in parts) + 40 * len(parts),
+                      'output_tokens': sum(part['usage']['output_tokens'] for part in parts) + 10},
+            'stop_reason': 'end_turn',
+        }
+
+    def _output_tokens(self, recorded, request, profile):
+        """Tokens this request would generate: the recording's, scaled by model verbosity and temperature."""
+        tokens = recorded['usage']['output_tokens'] * profile.get('verbosity', 1.0)
+        spread = self.length_spread * request.get('temperature', 0.0)
+        if spread:
+            with self._lock:
+                tokens *= math.exp(self._rng.gauss(0.0, spread))
+        return max(1, round(tokens))
+
+    def invoke_model(self, modelId, body, contentType=None, accept=None):
+        t_enter = time.perf_counter()
+        request = json.loads(body)
+        mode = self.prompt_modes.get(request.get('system'), 'full')
+        recorded = self._select(mode, request)
+        profile = self.model_profiles.get(modelId, {})
+        message = truncate_message({
+            'id': 'msg_stub',
+            'type': 'message',
+            'role': 'assistant',
+            'model': modelId,
+            'content': [{'type': 'text', 'text': json.dumps(recorded['content'])}],
+            'stop_reason': recorded.get('stop_reason', 'end_turn'),
+            'usage': dict(recorded['usage'], output_tokens=self._output_tokens(recorded, request, profile)),
+        }, request.get('max_tokens'))
+
+        with self._lock:
+            if self.max_concurrency and self._in_flight >= self.max_concurrency:
+                self.throttled += 1
+                raise BedrockExceptions.ThrottlingException('Too many requests, please wait before trying again.')
+            self._in_flight += 1
+        try:
+            delay_s = (self.latency_s + self.token_latency_s * message['usage']['output_tokens']) \
+                * profile.get('latency', 1.0)
+            if delay_s:
+                time.sleep(delay_s)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+        raw = json.dumps(message).encode()
+        with self._lock:
+            self.calls.append({'mode': mode, 'max_tokens': request.get('max_tokens'),
+                               'stop_reason': message['stop_reason'],
+                               't_enter': t_enter, 't_exit': time.perf_counter()})
+        return {'body': io.BytesIO(raw), 'contentType': 'application/json'}
+
+
+class StubSES:
+    """Drop-in for boto3's SES client that accepts and logs every message."""
+
+    def __init__(self, latency_s=0.0):
+        self.latency_s = latency_s
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+
+    def send_email(self, **kwargs):
+        t_enter = time.perf_counter()
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        with self._lock:
+            self.calls.append({'to': kwargs['Destination']['ToAddresses'],
+                               'bytes': len(kwargs['Message']['Body']['Html']['Data']),
+                               't_enter': t_enter, 't_exit': time.perf_counter()})
+            return {'MessageId': f'stub-{len(self.calls)}'}
+
+
+def stub_clients(lf, responses=None, latency_s=0.0, token_latency_s=0.0, max_concurrency=None, **model_options):
+    """Build a (bedrock, ses) stub pair wired to lambda_function's system prompts.
+
+    `model_options` (model_profiles, length_spread, seed) go to StubBedrock.
+    """
+    return (StubBedrock(system_prompt_modes(lf), responses, latency_s, token_latency_s, max_concurrency,
+                        **model_options),
+            StubSES(latency_s))
+
+
+@contextmanager
+def installed(lf, bedrock, ses):
+    """Temporarily swap lambda_function's module-level clients."""
+    saved = lf.bedrock, lf.ses
+    lf.bedrock, lf.ses = bedrock, ses
+    try:
+        yield
+    finally:
+        lf.bedrock, lf.ses = saved
@@ -5,15 +5,36 @@ Benchmark: Iterative Analysis Pipeline (4 problems + synthesis)
 Simulates the real browser flow: 4 parallel per-problem calls followed by
 1 synthesis call.  Repeats N times and reports timing stats.
 
+By default calls go over HTTPS to the deployed API.  The in-process backends
+call lambda_handler directly instead (requires boto3 locally):
+    --stub          recorded responses, no model latency (bedrock_stub.py);
+                    add --model-latency for a time-to-first-token + per-token delay
+    --replay LOG    recorded traffic with its real latencies (traffic_replay.py)
+    --record LOG    real Bedrock/SES calls, captured to LOG for later replay
+
+Wire options (any backend) — measure request bytes with and without them:
+    --compress      gzip request bodies (Content-Encoding: gzip)
+    --refs          upload transcript + DPP once per run (store_content) and
+                    send transcript_ref / dpp_ref in every later request
+
 Usage:
     python3 benchmark.py                  # 10 iterations, default API URL
     python3 benchmark.py --runs 5         # 5 iterations
     python3 benchmark.py --url <url>      # custom API Gateway URL
     python3 benchmark.py --threshold 12   # custom pass/fail threshold (seconds)
+    python3 benchmark.py --record traffic.jsonl.gz
+    python3 benchmark.py --replay traffic.jsonl.gz --latency-scale 0.5
+    python3 benchmark.py --stub --compress --refs
+    python3 benchmark.py --stub --profile profiles/   # + per-mode profiles (profiler.py)
+    python3 benchmark.py --stub --model-latency --compare-synthesis   # Phase 2 per synthesis engine
+    python3 benchmark.py --stub --model-latency --stub-concurrency 2 --compare-strategies   # Phase 1
 """
 
 import argparse
+import base64
+import gzip
 import json
+import os
 import statistics
 import sys
 import time
@@ -107,79 +128,171 @@ DPP = {
 
 MAX_RETRIES = 2
 RETRY_BACKOFF_S = 3
+STACKS_PASS_MIN_S = 3.0
+MAX_RETRY_AFTER_S = 10
+
+# --stub --model-latency: rough Haiku timing (first token, then per output token)
+STUB_FIRST_TOKEN_S = 0.4
+STUB_TOKEN_S = 0.007
+
+SYNTHESIS_ENGINES = ("llm", "hybrid", "local")
 
-def api_call(url: str, payload: dict) -> dict:
-    """POST JSON to URL with retry logic matching the client (2 retries, 3s backoff, retry on 503/429)."""
+
+def retry_delay(retry_after, default_s: float = RETRY_BACKOFF_S) -> float:
+    """Client backoff: the server's Retry-After hint (capped), else the fixed backoff."""
+    try:
+        seconds = float(retry_after)
+    except (TypeError, ValueError):
+        return default_s
+    return min(seconds, MAX_RETRY_AFTER_S) if seconds > 0 else default_s
+
+def encode_payload(payload: dict, compress: bool = False):
+    """Request body bytes + headers, optionally gzip-compressed."""
     data = json.dumps(payload).encode()
+    headers = {"Content-Type": "application/json"}
+    if compress:
+        data = gzip.compress(data)
+        headers["Content-Encoding"] = "gzip"
+    return data, headers
+
+
+def api_call(url: str, payload: dict, compress: bool = False) -> dict:
+    """POST JSON to URL with retry logic matching the client (2 retries, Retry-After or 3s backoff, retry on 503/429)."""
+    data, headers = encode_payload(payload, compress)
     t0 = time.perf_counter()
     last_error = None
+    delay_s = RETRY_BACKOFF_S
 
     for attempt in range(1, MAX_RETRIES + 1):
         if attempt > 1:
-            time.sleep(RETRY_BACKOFF_S)
+            time.sleep(delay_s)
 
-        req = Request(url, data=data, headers={"Content-Type": "application/json"}, method="POST")
+        req = Request(url, data=data, headers=headers, method="POST")
         try:
             with urlopen(req, timeout=25) as resp:
                 body = json.loads(resp.read())
                 elapsed = time.perf_counter() - t0
                 return {"ok": True, "status": resp.status, "elapsed": elapsed, "body": body,
-                        "attempts": attempt}
+                        "attempts": attempt, "bytes_sent": len(data) * attempt}
         except HTTPError as e:
             last_error = str(e)
             if e.code in (503, 429) and attempt < MAX_RETRIES:
+                delay_s = retry_delay(e.headers.get("Retry-After"))
                 continue
             elapsed = time.perf_counter() - t0
             return {"ok": False, "status": e.code, "elapsed": elapsed, "body": None,
-                    "error": last_error, "attempts": attempt}
+                    "error": last_error, "attempts": attempt, "bytes_sent": len(data) * attempt}
         except (URLError, TimeoutError, Exception) as e:
             last_error = str(e)
             if attempt < MAX_RETRIES:
                 continue
             elapsed = time.perf_counter() - t0
             return {"ok": False, "status": 0, "elapsed": elapsed, "body": None,
-                    "error": last_error, "attempts": attempt}
+                    "error": last_error, "attempts": attempt, "bytes_sent": len(data) * attempt}
 
     elapsed = time.perf_counter() - t0
     return {"ok": False, "status": 0, "elapsed": elapsed, "body": None,
-            "error": last_error or "Max retries exceeded", "attempts": MAX_RETRIES}
+            "error": last_error or "Max retries exceeded", "attempts": MAX_RETRIES,
+            "bytes_sent": len(data) * MAX_RETRIES}
+
+def make_local_call(backend: str, log_path: str = None, latency_scale: float = 1.0, compress: bool = False,
+                    profiler=None, model_latency: bool = False, max_concurrency: int = None):
+    """Build an in-process transport that calls lambda_handler directly.
+
+    backend: "stub" (recorded responses, optionally with modeled latency and a
+    concurrency limit),
+    "replay" (recorded traffic log) or "record" (real AWS clients, traffic
+    captured to log_path).  Returned
+    callable has the same result shape and retry behavior as api_call.
+    While a profiler session is open, each handler call is profiled under its mode.
+    """
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-west-2")
+    import lambda_function as lf
+
+    backoff_s = RETRY_BACKOFF_S
+    if backend == "stub":
+        from bedrock_stub import stub_clients
+        if model_latency:
+            lf.bedrock, lf.ses = stub_clients(lf, latency_s=STUB_FIRST_TOKEN_S, token_latency_s=STUB_TOKEN_S,
+                                              max_concurrency=max_concurrency)
+        else:
+            lf.bedrock, lf.ses = stub_clients(lf, max_concurrency=max_concurrency)
+    elif backend == "replay":
+        from traffic_replay import load_traffic_log, replay_clients
+        lf.bedrock, lf.ses = replay_clients(load_traffic_log(log_path), latency_scale)
+        backoff_s *= latency_scale
+    elif backend == "record":
+        lf.TRAFFIC_LOG_PATH = log_path
+
+    def local_call(payload: dict) -> dict:
+        data, headers = encode_payload(payload, compress)
+        event = {"body": base64.b64encode(data).decode() if compress else data.decode(),
+                 "isBase64Encoded": compress, "headers": headers,
+                 "requestContext": {"http": {"method": "POST"}}}
+        mode = payload.get("analysis_mode") or "full"
+        t0 = time.perf_counter()
+        delay_s = backoff_s
+        for attempt in range(1, MAX_RETRIES + 1):
+            if attempt > 1:
+                time.sleep(delay_s)
+            if profiler and profiler.pass_name:
+                response = profiler.call(mode, lf.lambda_handler, event, None)
+            else:
+                response = lf.lambda_handler(event, None)
+            status = response["statusCode"]
+            body = json.loads(response["body"])
+            if status == 200:
+                return {"ok": True, "status": status, "elapsed": time.perf_counter() - t0, "body": body,
+                        "attempts": attempt, "bytes_sent": len(data) * attempt}
+            if status in (503, 429) and attempt < MAX_RETRIES:
+                delay_s = retry_delay(response["headers"].get("Retry-After"), backoff_s)
+                continue
+            return {"ok": False, "status": status, "elapsed": time.perf_counter() - t0, "body": None,
+                    "error": body.get("error", "unknown"), "attempts": attempt,
+                    "bytes_sent": len(data) * attempt}
+
+    return local_call
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Single run: 4 parallel per-problem + 1 synthesis
 # ─────────────────────────────────────────────────────────────────────────────
 
-def run_pipeline(url: str) -> dict:
-    """Execute one full iterative pipeline. Returns timing breakdown."""
-    run_start = time.perf_counter()
-
-    # ── Phase 1: per-problem (parallel) ──────────────────────────────────
-    phase1_start = time.perf_counter()
-    per_problem_results = []
-
-    def call_per_problem(problem):
-        payload = {
-            "analysis_mode": "per_problem",
-            "transcript": TRANSCRIPT,
-            "problem_focus": problem,
-            "dpp": DPP,
-        }
-        return problem["id"], api_call(url, payload)
-
-    with ThreadPoolExecutor(max_workers=4) as pool:
-        futures = {pool.submit(call_per_problem, p): p for p in PROBLEMS}
-        for future in as_completed(futures):
-            pid, result = future.result()
-            per_problem_results.append({"problem_id": pid, **result})
-
-    phase1_elapsed = time.perf_counter() - phase1_start
-
-    # Collect per-problem analyses for synthesis input
-    problem_analyses = []
-    per_problem_details = []
-    for r in per_problem_results:
-        pid = r["problem_id"]
+def run_phase1(call, content: dict, strategy: str = "client") -> dict:
+    """Per-problem analyses for PROBLEMS.
+
+    strategy "client" fires one per_problem request per problem in parallel (the
+    Code Interview client's flow); the others send one multi_problem request and
+    let the function analyze in one combined generation, in parallel, or decide.
+    """
+    start = time.perf_counter()
+    if strategy == "client":
+        def call_per_problem(problem):
+            return problem["id"], call({"analysis_mode": "per_problem", "problem_focus": problem, **content})
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = dict(pool.map(call_per_problem, PROBLEMS))
+        calls = [results[p["id"]] for p in PROBLEMS]
+        inline_bytes = sum(len(json.dumps({"analysis_mode": "per_problem", "transcript": TRANSCRIPT,
+                                           "problem_focus": p, "dpp": DPP}).encode()) for p in PROBLEMS)
+    else:
+        result = call({"analysis_mode": "multi_problem", "strategy": strategy, **content})
+        if result["ok"] and result["body"] and result["body"].get("success"):
+            summaries = {s["problem_id"]: s for s in result["body"]["summary"]["problems"]}
+            results = {p["id"]: dict(result, body={"success": True, "summary": summaries.get(p["id"]), "usage": {}})
+                       for p in PROBLEMS}
+        else:
+            results = {p["id"]: result for p in PROBLEMS}
+        calls = [result]
+        inline_bytes = len(json.dumps({"analysis_mode": "multi_problem", "strategy": strategy,
+                                       "transcript": TRANSCRIPT, "dpp": DPP}).encode())
+    elapsed = time.perf_counter() - start
+
+    analyses, details = [], []
+    for problem in PROBLEMS:
+        r = results[problem["id"]]
         detail = {
-            "problem_id": pid,
+            "problem_id": problem["id"],
             "ok": r["ok"],
             "status": r["status"],
             "elapsed_s": round(r["elapsed"], 3),
@@ -187,14 +300,55 @@ def run_pipeline(url: str) -> dict:
             "tokens_in": None,
             "tokens_out": None,
         }
-        if r["ok"] and r["body"] and r["body"].get("success"):
-            problem_analyses.append(r["body"]["summary"])
+        if r["ok"] and r["body"] and r["body"].get("success") and r["body"].get("summary"):
+            analyses.append(r["body"]["summary"])
             usage = r["body"].get("usage", {})
             detail["tokens_in"] = usage.get("input_tokens")
             detail["tokens_out"] = usage.get("output_tokens")
         else:
-            detail["error"] = r.get("error", "unknown")
-        per_problem_details.append(detail)
+            detail["ok"] = False
+            detail["error"] = r.get("error", "missing from response")
+        details.append(detail)
+
+    ok_calls = [r for r in calls if r["ok"] and r["body"]]
+    used = strategy
+    if strategy != "client" and ok_calls:
+        used = ok_calls[0]["body"].get("strategy", strategy)  # what auto picked
+    return {
+        "elapsed": elapsed,
+        "analyses": analyses,
+        "details": details,
+        "strategy": used,
+        "tokens_in": sum(r["body"].get("usage", {}).get("input_tokens", 0) for r in ok_calls),
+        "tokens_out": sum(r["body"].get("usage", {}).get("output_tokens", 0) for r in ok_calls),
+        "requests": len(calls),
+        "retries": sum(r.get("attempts", 1) - 1 for r in calls),
+        "bytes_sent": sum(r.get("bytes_sent", 0) for r in calls),
+        "inline_bytes": inline_bytes,
+    }
+
+
+def run_pipeline(call, use_refs: bool = False, synthesis_engine: str = None, strategy: str = "client") -> dict:
+    """Execute one full iterative pipeline. Returns timing breakdown."""
+    run_start = time.perf_counter()
+    bytes_sent = 0
+    inline_bytes = 0
+
+    # ── Optional upload: transcript + DPP stored once, referenced by hash ─
+    content = {"transcript": TRANSCRIPT, "dpp": DPP}
+    if use_refs:
+        upload = call({"analysis_mode": "store_content", **content})
+        bytes_sent += upload.get("bytes_sent", 0)
+        if upload["ok"]:
+            content = {f"{field}_ref": ref for field, ref in upload["body"]["refs"].items()}
+
+    # ── Phase 1: per-problem ─────────────────────────────────────────────
+    phase1 = run_phase1(call, content, strategy)
+    bytes_sent += phase1["bytes_sent"]
+    inline_bytes += phase1["inline_bytes"]
+    problem_analyses = phase1["analyses"]
+    per_problem_details = phase1["details"]
+    phase1_elapsed = phase1["elapsed"]
 
     # ── Phase 2: synthesis ───────────────────────────────────────────────
     phase2_start = time.perf_counter()
@@ -203,7 +357,14 @@ def run_pipeline(url: str) -> dict:
         "problem_results": problem_analyses,
         "dpp": DPP,
     }
-    synth_result = api_call(url, synth_payload)
+    if synthesis_engine:
+        synth_payload["synthesis_engine"] = synthesis_engine
+    inline_bytes += len(json.dumps(synth_payload).encode())
+    if "dpp_ref" in content:
+        synth_payload = {k: v for k, v in synth_payload.items() if k != "dpp"}
+        synth_payload["dpp_ref"] = content["dpp_ref"]
+    synth_result = call(synth_payload)
+    bytes_sent += synth_result.get("bytes_sent", 0)
     phase2_elapsed = time.perf_counter() - phase2_start
 
     synth_detail = {
@@ -228,10 +389,93 @@ def run_pipeline(url: str) -> dict:
         "phase1_s": round(phase1_elapsed, 3),
         "phase2_s": round(phase2_elapsed, 3),
         "per_problem": per_problem_details,
+        "phase1_strategy": phase1["strategy"],
+        "phase1_tokens_in": phase1["tokens_in"],
+        "phase1_tokens_out": phase1["tokens_out"],
         "synthesis": synth_detail,
         "all_ok": all(d["ok"] for d in per_problem_details) and synth_detail["ok"],
+        "bytes_sent": bytes_sent,
+        "inline_bytes": inline_bytes,
     }
 
+def compare_strategies(call, runs: int) -> list:
+    """Phase 1 alone, `runs` times per strategy. auto runs first, before the others can throttle."""
+    content = {"transcript": TRANSCRIPT, "dpp": DPP}
+    rows = []
+    for strategy in ("auto", "client", "parallel", "combined"):
+        results = [run_phase1(call, content, strategy) for _ in range(runs)]
+        rows.append({"strategy": strategy, "results": results})
+    return rows
+
+
+def print_strategy_comparison(rows: list):
+    W = 78
+    print(f"{'─' * W}")
+    print(f"  PHASE 1 BY STRATEGY ({len(PROBLEMS)} problems; tokens per run)")
+    print(f"{'─' * W}")
+    print(f"  {'Strategy':<9} {'med':>9}  {'p95':>9}  {'in tok':>7}  {'out tok':>7}  {'failed':>6}  {'retries':>7}  used")
+    for row in rows:
+        results = row["results"]
+        times = sorted(r["elapsed"] for r in results)
+        p95 = times[int(len(times) * 0.95)] if len(times) >= 5 else times[-1]
+        ok = [r for r in results if all(d["ok"] for d in r["details"])]
+        used = {}
+        for r in results:
+            used[r["strategy"]] = used.get(r["strategy"], 0) + 1
+        tokens_in = statistics.mean(r["tokens_in"] for r in ok) if ok else 0
+        tokens_out = statistics.mean(r["tokens_out"] for r in ok) if ok else 0
+        print(f"  {row['strategy']:<9} {fmt(statistics.median(times))}  {fmt(p95)}  {tokens_in:>7.0f}  {tokens_out:>7.0f}  "
+              f"{len(results) - len(ok):>3}/{len(results):<2}  {sum(r['retries'] for r in results):>7}  "
+              f"{', '.join(f'{k}x{v}' for k, v in used.items())}")
+    print()
+
+
+def compare_synthesis(call, runs: int) -> list:
+    """Phase 2 alone, once per synthesis engine, on the same per-problem results."""
+    problem_results = []
+    for problem in PROBLEMS:
+        result = call({"analysis_mode": "per_problem", "transcript": TRANSCRIPT,
+                       "problem_focus": problem, "dpp": DPP})
+        if result["ok"]:
+            problem_results.append(result["body"]["summary"])
+
+    rows = []
+    for engine in SYNTHESIS_ENGINES:
+        payload = {"analysis_mode": "synthesis", "synthesis_engine": engine,
+                   "problem_results": problem_results, "dpp": DPP}
+        times, tokens_out, fit = [], [], None
+        for _ in range(runs):
+            result = call(payload)
+            if not result["ok"]:
+                continue
+            times.append(result["elapsed"])
+            tokens_out.append(result["body"]["usage"]["output_tokens"])
+            fit = result["body"]["summary"]["fit"]
+        rows.append({"engine": engine, "times": times, "tokens_out": tokens_out, "fit": fit})
+    return rows
+
+
+def print_synthesis_comparison(rows: list):
+    W = 78
+    print(f"{'─' * W}")
+    print(f"  PHASE 2 BY SYNTHESIS ENGINE (same per-problem results)")
+    print(f"{'─' * W}")
+    print(f"  {'Engine':<8}  {'med':>9}  {'p95':>9}  {'max':>9}  {'out tok':>7}  fit")
+    baseline = None
+    for row in rows:
+        times = sorted(row["times"])
+        if not times:
+            print(f"  {row['engine']:<8}  all calls failed")
+            continue
+        med = statistics.median(times)
+        p95 = times[int(len(times) * 0.95)] if len(times) >= 5 else times[-1]
+        baseline = baseline or med
+        fit = row["fit"] or {}
+        speedup = f"  ({med - baseline:+.2f}s vs llm)" if med != baseline else ""
+        print(f"  {row['engine']:<8}  {fmt(med)}  {fmt(p95)}  {fmt(times[-1])}  "
+              f"{statistics.mean(row['tokens_out']):>7.0f}  {fit.get('score_0_100')} {fit.get('rec')}{speedup}")
+    print()
+
 # ─────────────────────────────────────────────────────────────────────────────
 # Report formatting
 # ─────────────────────────────────────────────────────────────────────────────
@@ -302,7 +546,17 @@ def print_report(runs: list, threshold: float):
     all_sy_in  = [r["synthesis"]["tokens_in"]  for r in runs if r["synthesis"]["tokens_in"]]
     all_sy_out = [r["synthesis"]["tokens_out"] for r in runs if r["synthesis"]["tokens_out"]]
 
+    sent = statistics.mean(r["bytes_sent"] for r in runs)
+    inline = statistics.mean(r["inline_bytes"] for r in runs)
+    print(f"\n  Request bytes on the wire (avg per run):")
+    print(f"    Sent         {sent:>9,.0f} B")
+    print(f"    Inline JSON  {inline:>9,.0f} B  (uncompressed, no refs)  →  {100 * (1 - sent / inline):.0f}% saved")
+
     print(f"\n  Token usage (avg):")
+    p1_in = [r["phase1_tokens_in"] for r in runs if r["phase1_tokens_in"]]
+    if p1_in:
+        p1_out = [r["phase1_tokens_out"] for r in runs if r["phase1_tokens_in"]]
+        print(f"    Phase 1      in={statistics.mean(p1_in):.0f}  out={statistics.mean(p1_out):.0f}  (all problems)")
     if all_pp_in:
         print(f"    Per-problem  in={statistics.mean(all_pp_in):.0f}  out={statistics.mean(all_pp_out):.0f}")
     if all_sy_in:
@@ -358,18 +612,74 @@ def main():
     parser.add_argument("--runs", type=int, default=DEFAULT_RUNS, help="Number of iterations")
     parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD_S, help="Pass/fail threshold in seconds")
     parser.add_argument("--json", action="store_true", help="Also write raw results to benchmark_results.json")
+    backend = parser.add_mutually_exclusive_group()
+    backend.add_argument("--stub", action="store_true", help="Run in-process against recorded stub responses")
+    backend.add_argument("--replay", metavar="LOG", help="Run in-process, replaying a recorded traffic log")
+    backend.add_argument("--record", metavar="LOG", help="Run in-process against AWS, recording traffic to LOG")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Scale replayed latencies (with --replay)")
+    parser.add_argument("--compress", action="store_true", help="gzip request bodies")
+    parser.add_argument("--refs", action="store_true", help="Upload transcript/DPP once per run and send refs")
+    parser.add_argument("--model-latency", action="store_true",
+                        help="With --stub: delay each model call by first-token + per-output-token time")
+    parser.add_argument("--strategy", choices=("client", "auto", "combined", "parallel"), default="client",
+                        help="Phase 1: per_problem fan-out from the client (default) or one multi_problem request")
+    parser.add_argument("--compare-strategies", action="store_true",
+                        help="After the runs, time Phase 1 alone for each strategy")
+    parser.add_argument("--stub-concurrency", type=int, metavar="N",
+                        help="With --stub: throttle model calls beyond N in flight (Bedrock concurrency quota)")
+    parser.add_argument("--synthesis-engine", choices=SYNTHESIS_ENGINES,
+                        help="Send synthesis_engine in the Phase 2 request (default: the function's setting)")
+    parser.add_argument("--compare-synthesis", action="store_true",
+                        help="After the runs, time Phase 2 alone for each synthesis engine")
+    parser.add_argument("--prime", action="store_true",
+                        help="Send a warmup-mode request before the warmup call and print its steps")
+    parser.add_argument("--profile", metavar="DIR", help="In-process only: profile each mode after the timed runs")
+    parser.add_argument("--profile-runs", type=int, default=3, help="Pipeline runs per profiling pass")
     args = parser.parse_args()
 
+    profiler = None
+    if args.profile:
+        if not (args.stub or args.replay or args.record):
+            parser.error("--profile needs an in-process backend (--stub, --replay or --record)")
+        from profiler import ModeProfiler
+        profiler = ModeProfiler(args.profile)
+
+    if args.stub:
+        call = make_local_call("stub", compress=args.compress, profiler=profiler, model_latency=args.model_latency,
+                               max_concurrency=args.stub_concurrency)
+        target = (f"in-process (stub{', modeled latency' if args.model_latency else ''}"
+                  f"{f', {args.stub_concurrency} concurrent calls' if args.stub_concurrency else ''})")
+    elif args.replay:
+        call = make_local_call("replay", args.replay, args.latency_scale, compress=args.compress, profiler=profiler)
+        target = f"in-process (replay {args.replay}, latency x{args.latency_scale})"
+    elif args.record:
+        call = make_local_call("record", args.record, compress=args.compress, profiler=profiler)
+        target = f"in-process (recording to {args.record})"
+    else:
+        call, target = (lambda payload: api_call(args.url, payload, args.compress)), args.url
+
     print(f"\nBenchmark config:")
-    print(f"  API URL:    {args.url}")
+    print(f"  Target:     {target}")
     print(f"  Runs:       {args.runs}")
     print(f"  Threshold:  {args.threshold}s")
     print(f"  Transcript: {len(TRANSCRIPT)} messages, {len(PROBLEMS)} problems")
+    print(f"  Wire:       {'gzip' if args.compress else 'plain JSON'}{', content refs' if args.refs else ''}")
+    print(f"  Phase 1:    {args.strategy if args.strategy == 'client' else f'multi_problem ({args.strategy})'}")
+    print(f"  Synthesis:  {args.synthesis_engine or 'function default'}")
     print(f"  Date:       {time.strftime('%Y-%m-%d %H:%M:%S %Z')}")
 
+    # Optional priming: what a client (or the schedule) does when a session starts
+    if args.prime:
+        print(f"\nPrime (warmup mode)...", end=" ", flush=True)
+        prime = call({"analysis_mode": "warmup"})
+        info = (prime["body"] or {}).get("warmup", {})
+        print(f"{'OK' if prime['ok'] else 'FAIL'} ({prime['elapsed']:.2f}s, container {info.get('container', '?')})")
+        for name, step in info.get("steps", {}).items():
+            print(f"    {name:<20} {step['ms']:>8.1f} ms  {step['status']}")
+
     # Warmup call
     print(f"\nWarmup call...", end=" ", flush=True)
-    warmup = api_call(args.url, {
+    warmup = call({
         "analysis_mode": "per_problem",
         "transcript": TRANSCRIPT[:4],
         "problem_focus": PROBLEMS[0],
@@ -381,7 +691,7 @@ def main():
     runs = []
     for i in range(1, args.runs + 1):
         print(f"\rRun {i}/{args.runs}...", end="", flush=True)
-        result = run_pipeline(args.url)
+        result = run_pipeline(call, args.refs, args.synthesis_engine, args.strategy)
         runs.append(result)
         status = "ok" if result["all_ok"] else "FAIL"
         print(f"\rRun {i}/{args.runs}: {result['total_s']:.2f}s [{status}]  (p1={result['phase1_s']:.1f}s  p2={result['phase2_s']:.1f}s)")
@@ -389,12 +699,35 @@ def main():
     # Report
     passed = print_report(runs, args.threshold)
 
+    if args.compare_strategies:
+        print_strategy_comparison(compare_strategies(call, args.runs))
+    if args.compare_synthesis:
+        print_synthesis_comparison(compare_synthesis(call, args.runs))
+
+    # Optional profiling passes (separate from the timed runs above)
+    if profiler:
+        import lambda_function as lf  # already loaded by make_local_call
+        from profiler import PASSES
+        for pass_name in PASSES:
+            print(f"Profiling pass: {pass_name} ({args.profile_runs} runs)...")
+            with profiler.session(pass_name, lf):
+                # Sampled stacks need wall time (~1 sample/ms of handler time), not just runs
+                deadline = time.perf_counter() + (STACKS_PASS_MIN_S if pass_name == "stacks" else 0)
+                done = 0
+                while done < args.profile_runs or time.perf_counter() < deadline:
+                    run_pipeline(call, args.refs, args.synthesis_engine, args.strategy)
+                    done += 1
+        profiler.print_report()
+        print(f"  Profiles written: {len(profiler.write())} files in {args.profile}\n")
+
     # Optional JSON dump
     if args.json:
         out_path = "benchmark_results.json"
         with open(out_path, "w") as f:
             json.dump({
-                "config": {"url": args.url, "runs": args.runs, "threshold": args.threshold},
+                "config": {"target": target, "runs": args.runs, "threshold": args.threshold,
+                           "compress": args.compress, "refs": args.refs,
+                           "synthesis_engine": args.synthesis_engine, "strategy": args.strategy},
                 "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
                 "runs": runs,
             }, f, indent=2)
@@ -4,8 +4,9 @@
 #
 # Removes all AWS resources created by deploy.sh:
 # - HTTP API Gateway
-# - Lambda function
+# - Lambda function (and its warmup schedule, if any)
 # - IAM role and policies
+# (a RESULT_BUCKET and a REPORT_TABLE are kept: they hold data; results expire on their own)
 #
 # Usage: ./cleanup.sh
 #
@@ -60,6 +61,13 @@ fi
 echo ""
 echo "[2/3] Deleting Lambda function..."
 
+# Warmup schedule (deploy.sh WARMUP_SCHEDULE)
+if aws events describe-rule --name "${FUNCTION_NAME}-warmup" --region "$REGION" >/dev/null 2>&1; then
+    aws events remove-targets --rule "${FUNCTION_NAME}-warmup" --ids analysis-lambda --region "$REGION" >/dev/null 2>&1 || true
+    aws events delete-rule --name "${FUNCTION_NAME}-warmup" --region "$REGION" 2>/dev/null || true
+    echo "  ✓ Warmup schedule deleted"
+fi
+
 if aws lambda get-function --function-name "$FUNCTION_NAME" --region "$REGION" >/dev/null 2>&1; then
     aws lambda delete-function --function-name "$FUNCTION_NAME" --region "$REGION"
     echo "  ✓ Lambda function deleted"
@@ -79,6 +87,12 @@ aws iam delete-role-policy \
     --role-name "$ROLE_NAME" \
     --policy-name bedrock-invoke 2>/dev/null || true
 
+for POLICY in self-invoke admission-buckets result-store report-archive; do
+    aws iam delete-role-policy \
+        --role-name "$ROLE_NAME" \
+        --policy-name "$POLICY" 2>/dev/null || true
+done
+
 # Detach managed policies
 aws iam detach-role-policy \
     --role-name "$ROLE_NAME" \
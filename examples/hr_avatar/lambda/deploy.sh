@@ -11,6 +11,11 @@
 #   - Claude models enabled in Bedrock console
 #
 # Usage: ./deploy.sh
+#        WITH_ORJSON=1 ./deploy.sh   # also bundle orjson (faster JSON)
+#        ADMISSION_TABLE=hr-avatar-admission ./deploy.sh   # shared admission-control buckets
+#        WARMUP_SCHEDULE="rate(5 minutes)" ./deploy.sh   # keep one container primed
+#        RESULT_BUCKET=my-avatar-results ./deploy.sh   # S3 store for progressive results and content refs
+#        REPORT_TABLE=hr-avatar-reports ./deploy.sh   # DynamoDB archive behind the reports query mode
 #
 
 set -e  # Exit on error
@@ -22,6 +27,7 @@ set -e  # Exit on error
 FUNCTION_NAME="hr-avatar-analysis"
 API_NAME="hr-avatar-analysis-api"
 ROLE_NAME="hr-avatar-analysis-lambda-role"
+MEMORY_SIZE="${MEMORY_SIZE:-256}"   # MB; pick with memory_sweep.py
 REGION="${AWS_DEFAULT_REGION:-us-west-2}"
 ACCOUNT_ID=$(aws sts get-caller-identity --query Account --output text 2>/dev/null || echo "")
 
@@ -80,8 +86,73 @@ aws iam attach-role-policy \
     --role-name "$ROLE_NAME" \
     --policy-arn arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole 2>/dev/null || true
 
+# analyze_and_deliver hands the report email to an async invocation of this function
+aws iam put-role-policy \
+    --role-name "$ROLE_NAME" \
+    --policy-name self-invoke \
+    --policy-document "{\"Version\":\"2012-10-17\",\"Statement\":[{\"Effect\":\"Allow\",\"Action\":\"lambda:InvokeFunction\",\"Resource\":\"arn:aws:lambda:${REGION}:${ACCOUNT_ID}:function:${FUNCTION_NAME}\"}]}" \
+    2>/dev/null || true
+
 echo "  ✓ Role ready: $ROLE_ARN"
 
+# Optional: DynamoDB table for admission-control token buckets shared by all containers
+if [ -n "${ADMISSION_TABLE:-}" ]; then
+    if ! aws dynamodb describe-table --table-name "$ADMISSION_TABLE" --region "$REGION" >/dev/null 2>&1; then
+        aws dynamodb create-table \
+            --table-name "$ADMISSION_TABLE" \
+            --attribute-definitions AttributeName=bucket_id,AttributeType=S \
+            --key-schema AttributeName=bucket_id,KeyType=HASH \
+            --billing-mode PAY_PER_REQUEST \
+            --region "$REGION" \
+            >/dev/null
+        aws dynamodb wait table-exists --table-name "$ADMISSION_TABLE" --region "$REGION"
+    fi
+    aws iam put-role-policy \
+        --role-name "$ROLE_NAME" \
+        --policy-name admission-buckets \
+        --policy-document "{\"Version\":\"2012-10-17\",\"Statement\":[{\"Effect\":\"Allow\",\"Action\":[\"dynamodb:BatchGetItem\",\"dynamodb:TransactWriteItems\",\"dynamodb:UpdateItem\",\"dynamodb:PutItem\"],\"Resource\":\"arn:aws:dynamodb:${REGION}:${ACCOUNT_ID}:table/${ADMISSION_TABLE}\"}]}" \
+        2>/dev/null || true
+    echo "  ✓ Admission table ready: $ADMISSION_TABLE"
+fi
+
+# Optional: DynamoDB table archiving every analysis for the reports query mode
+if [ -n "${REPORT_TABLE:-}" ]; then
+    if ! aws dynamodb describe-table --table-name "$REPORT_TABLE" --region "$REGION" >/dev/null 2>&1; then
+        aws dynamodb create-table \
+            --table-name "$REPORT_TABLE" \
+            --attribute-definitions AttributeName=pk,AttributeType=S AttributeName=sk,AttributeType=S \
+            --key-schema AttributeName=pk,KeyType=HASH AttributeName=sk,KeyType=RANGE \
+            --billing-mode PAY_PER_REQUEST \
+            --region "$REGION" \
+            >/dev/null
+        aws dynamodb wait table-exists --table-name "$REPORT_TABLE" --region "$REGION"
+    fi
+    aws iam put-role-policy \
+        --role-name "$ROLE_NAME" \
+        --policy-name report-archive \
+        --policy-document "{\"Version\":\"2012-10-17\",\"Statement\":[{\"Effect\":\"Allow\",\"Action\":[\"dynamodb:BatchWriteItem\",\"dynamodb:GetItem\",\"dynamodb:Query\",\"dynamodb:UpdateItem\"],\"Resource\":\"arn:aws:dynamodb:${REGION}:${ACCOUNT_ID}:table/${REPORT_TABLE}\"}]}" \
+        2>/dev/null || true
+    echo "  ✓ Report table ready: $REPORT_TABLE"
+fi
+
+# Optional: S3 bucket for progressive results (drafts first, full analysis polled later)
+if [ -n "${RESULT_BUCKET:-}" ]; then
+    if ! aws s3api head-bucket --bucket "$RESULT_BUCKET" 2>/dev/null; then
+        aws s3 mb "s3://$RESULT_BUCKET" --region "$REGION" >/dev/null
+    fi
+    aws s3api put-bucket-lifecycle-configuration \
+        --bucket "$RESULT_BUCKET" \
+        --lifecycle-configuration '{"Rules":[{"ID":"expire-results","Status":"Enabled","Filter":{"Prefix":"results/"},"Expiration":{"Days":1}},{"ID":"expire-content","Status":"Enabled","Filter":{"Prefix":"content/"},"Expiration":{"Days":1}}]}' \
+        2>/dev/null || true
+    # ListBucket makes a missing key a 404 (NoSuchKey: unknown ref / pending result) instead of a 403
+    aws iam put-role-policy \
+        --role-name "$ROLE_NAME" \
+        --policy-name result-store \
+        --policy-document "{\"Version\":\"2012-10-17\",\"Statement\":[{\"Effect\":\"Allow\",\"Action\":[\"s3:GetObject\",\"s3:PutObject\"],\"Resource\":[\"arn:aws:s3:::${RESULT_BUCKET}/results/*\",\"arn:aws:s3:::${RESULT_BUCKET}/content/*\"]},{\"Effect\":\"Allow\",\"Action\":\"s3:ListBucket\",\"Resource\":\"arn:aws:s3:::${RESULT_BUCKET}\"}]}" \
+        2>/dev/null || true
+    echo "  ✓ Result bucket ready: $RESULT_BUCKET (results and content refs expire after 1 day)"
+fi
+
 # =============================================================================
 # STEP 2: Package Lambda Function
 # =============================================================================
@@ -93,6 +164,16 @@ rm -f function.zip
 zip -j function.zip lambda_function.py >/dev/null
 echo "  ✓ Created function.zip"
 
+# Optional: bundle orjson for faster JSON handling (lambda_function falls back to stdlib json)
+if [ "${WITH_ORJSON:-0}" = "1" ]; then
+    BUILD_DIR=$(mktemp -d)
+    pip install orjson --quiet --target "$BUILD_DIR" \
+        --platform manylinux2014_x86_64 --python-version 3.11 --only-binary=:all:
+    (cd "$BUILD_DIR" && zip -qr "$OLDPWD/function.zip" . -x '*.dist-info/*')
+    rm -rf "$BUILD_DIR"
+    echo "  ✓ Bundled orjson"
+fi
+
 # =============================================================================
 # STEP 3: Create or Update Lambda Function
 # =============================================================================
@@ -110,7 +191,15 @@ if aws lambda get-function --function-name "$FUNCTION_NAME" --region "$REGION" >
 
     # Wait for update to complete
     aws lambda wait function-updated --function-name "$FUNCTION_NAME" --region "$REGION" 2>/dev/null || sleep 5
-    echo "  ✓ Function updated"
+
+    # Re-apply the memory size (e.g. a new memory_sweep.py recommendation)
+    aws lambda update-function-configuration \
+        --function-name "$FUNCTION_NAME" \
+        --memory-size "$MEMORY_SIZE" \
+        --region "$REGION" \
+        >/dev/null
+    aws lambda wait function-updated --function-name "$FUNCTION_NAME" --region "$REGION" 2>/dev/null || sleep 5
+    echo "  ✓ Function updated (${MEMORY_SIZE} MB)"
 else
     echo "  Creating new function..."
     sleep 5  # Wait for role propagation
@@ -122,7 +211,7 @@ else
         --role "$ROLE_ARN" \
         --zip-file fileb://function.zip \
         --timeout 90 \
-        --memory-size 256 \
+        --memory-size "$MEMORY_SIZE" \
         --region "$REGION" \
         --description "Analyzes HR Avatar call transcripts using Bedrock Claude" \
         >/dev/null
@@ -151,7 +240,7 @@ else
     API_RESULT=$(aws apigatewayv2 create-api \
         --name "$API_NAME" \
         --protocol-type HTTP \
-        --cors-configuration '{"AllowOrigins":["*"],"AllowMethods":["POST","OPTIONS"],"AllowHeaders":["content-type"],"MaxAge":86400}' \
+        --cors-configuration '{"AllowOrigins":["*"],"AllowMethods":["POST","OPTIONS"],"AllowHeaders":["content-type","content-encoding"],"ExposeHeaders":["retry-after"],"MaxAge":86400}' \
         --target "$LAMBDA_ARN" \
         --region "$REGION" \
         2>/dev/null)
@@ -189,6 +278,29 @@ aws lambda add-permission \
 
 echo "  ✓ Permissions configured"
 
+# Optional: EventBridge schedule that sends warmup events (e.g. WARMUP_SCHEDULE="rate(5 minutes)")
+if [ -n "${WARMUP_SCHEDULE:-}" ]; then
+    RULE_ARN=$(aws events put-rule \
+        --name "${FUNCTION_NAME}-warmup" \
+        --schedule-expression "$WARMUP_SCHEDULE" \
+        --region "$REGION" \
+        --query RuleArn --output text)
+    aws lambda add-permission \
+        --function-name "$FUNCTION_NAME" \
+        --statement-id "warmup-schedule" \
+        --action lambda:InvokeFunction \
+        --principal events.amazonaws.com \
+        --source-arn "$RULE_ARN" \
+        --region "$REGION" \
+        >/dev/null 2>&1 || true
+    aws events put-targets \
+        --rule "${FUNCTION_NAME}-warmup" \
+        --targets "Id=analysis-lambda,Arn=${LAMBDA_ARN}" \
+        --region "$REGION" \
+        >/dev/null
+    echo "  ✓ Warmup schedule: $WARMUP_SCHEDULE"
+fi
+
 # =============================================================================
 # DONE
 # =============================================================================
@@ -211,6 +323,32 @@ echo "  hr_avatar/hr-demo.js:     ANALYSIS_API_URL: '$API_ENDPOINT'"
 echo "  code_interview/code-interview.js: ANALYSIS_API_URL: '$API_ENDPOINT'"
 echo ""
 
+if [ -n "${REPORT_TABLE:-}" ]; then
+    echo "Enable the report archive (add to the function's existing environment variables):"
+    echo "  REPORT_STORE=dynamodb://$REPORT_TABLE"
+    echo "Query it with a direct invoke, or over HTTP with x-api-key set to:"
+    echo "  REPORTS_API_KEY=\$(openssl rand -hex 24)"
+    echo "Learned max_tokens per request can share the table:"
+    echo "  OUTPUT_STATS_STORE=dynamodb://$REPORT_TABLE"
+    echo ""
+fi
+
+if [ -n "${RESULT_BUCKET:-}" ]; then
+    echo "Enable progressive results (add to the function's existing environment variables):"
+    echo "  RESULT_STORE=s3://$RESULT_BUCKET/results"
+    echo "Optionally let callers pass notify_url (https, listed hosts only):"
+    echo "  NOTIFY_URL_HOSTS=hooks.example.com"
+    echo "Enable content refs (store_content) across containers:"
+    echo "  CONTENT_STORE=s3://$RESULT_BUCKET/content"
+    echo ""
+fi
+
+if [ -n "${ADMISSION_TABLE:-}" ]; then
+    echo "Enable admission control (add to the function's existing environment variables):"
+    echo "  ADMISSION_STORE=dynamodb://$ADMISSION_TABLE  BEDROCK_RPM=<quota>  BEDROCK_TPM=<quota>"
+    echo ""
+fi
+
 # Save URL to file
 echo "$API_ENDPOINT" > .api-url
 echo "(Endpoint saved to .api-url)"
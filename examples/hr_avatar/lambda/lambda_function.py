@@ -7,32 +7,203 @@ structured JSON summaries.
 
 Analysis modes (selected by the `analysis_mode` request field):
   - "per_problem":       Analyze a single coding problem from a transcript (~5s, max_tokens=512)
-  - "synthesis":         Synthesize per-problem results into an overall assessment (~8s, max_tokens=512)
+  - "multi_problem":     Analyze every problem of a session in one request: one combined generation
+                         or parallel per_problem calls, picked per request (see Multi-problem analysis)
+  - "synthesis":         Synthesize per-problem results into an overall assessment (~8s, max_tokens=512;
+                         see Synthesis engine for the hybrid/local variants)
   - "knowledge_check":   Analyze a product knowledge check session (~8s, max_tokens=1500)
   - "training_summary":  Generate a prose training session summary (~5s, max_tokens=500)
   - "call_summary_email": Alias for training_summary (Alon's original main-avatar post-call mode)
   - "general":           Structured sales training session report (~8s, max_tokens=1200)
   - "send_report_email": Email a formatted report to the user via SES
-  - (default):           Full single-call HR analysis using HR_SYSTEM_PROMPT (v4.1 schema, max_tokens from env)
-
-The Code Interview client fires N parallel per_problem calls then one synthesis call.
+  - "analyze_and_deliver": knowledge_check or general, then email the report in the background
+  - "result":            Poll a progressive result by result_id (see Progressive results)
+  - "refine_result":     Internal: run the full analysis behind a progressive draft
+                         (direct Lambda invocations only; 403 through API Gateway)
+  - "reports":           Read-only queries over archived analyses (see Report archive);
+                         direct invocations, or HTTP with x-api-key = REPORTS_API_KEY
+  - "store_content":     Store transcript/dpp once and return content refs (see Request ingress)
+  - "warmup":            Prime this container (clients, connections, templates); also run by
+                         EventBridge schedule events
+  - (default):           Full single-call HR analysis using HR_SYSTEM_PROMPT (v4.1 schema, max_tokens from env);
+                         with "progressive": true, a fast draft now and the full analysis later
+
+The Code Interview client fires N parallel per_problem calls then one synthesis call
+(multi_problem is the single-request alternative to the per_problem fan-out).
 The HR Avatar client sends a single request with no analysis_mode (hits the default path).
-The AT&T Seller Hub sends knowledge_check (for quizzes), general (for coaching sessions),
-or send_report_email (fire-and-forget after report is shown).
+The AT&T Seller Hub sends analyze_and_deliver (knowledge_check for quizzes, general for
+coaching sessions, plus the user's email); send_report_email remains for older clients.
 
 Environment Variables:
     MODEL_ID:    Bedrock model ID (default: claude-3-haiku)
     MAX_TOKENS:  Max output tokens for default/full mode (default: 2048)
     TEMPERATURE: Model temperature (default: 0.3)
     SES_FROM_EMAIL: Verified SES sender address (default: noreply@avatardemo.att-sellerhub.com)
+    TRAFFIC_LOG_PATH: If set, append Bedrock/SES request hashes, responses and latencies
+                      to this JSON Lines file (gzip if it ends in .gz) for offline replay
+    MAX_REQUEST_BYTES: Max decoded (decompressed) request body size (default: 4194304)
+    CONTENT_STORE: Backend for content-addressed transcript/DPP refs:
+                   "local[:/dir]" (default /tmp/content-store, per process: local tools only)
+                   or "s3://bucket/prefix" (needed on Lambda, where refs are off otherwise)
+    RESULT_STORE: Where progressive results are kept until polled: "local[:/dir]"
+                  (default /tmp/result-store, per container: local tools only) or
+                  "s3://bucket/prefix" (needed on Lambda)
+    NOTIFY_URL_HOSTS: Comma-separated hostnames a progressive "notify_url" may point at
+                  (https only); unset = notify_url is off
+    REPORT_STORE: Archives every successful analysis for the reports mode: "sqlite[:/path]"
+                  (default /tmp/reports.db, per container) or "dynamodb://table" (shared); unset = off
+    REPORTS_API_KEY: Key HTTP callers of the reports mode send as x-api-key; unset = the
+                  mode only answers direct Lambda invocations
+    OUTPUT_STATS_STORE: Learns output lengths to set max_tokens per request: "local[:/path]"
+                   (default /tmp/output-stats.json, per container) or "dynamodb://table" (shared); unset = off
+    OUTPUT_QUANTILE / OUTPUT_MARGIN: predicted max_tokens = this quantile of recorded lengths
+                   x (1 + margin) (default: 0.99 / 0.2)
+    ADMISSION_STORE: Enables admission control in front of Bedrock: "local" (per
+                     container/process) or "dynamodb://table" (shared); unset = off
+    BEDROCK_RPM / BEDROCK_TPM: Account-wide Bedrock quota the global buckets enforce
+                     (default: 100 requests / 200000 tokens per minute)
+    ADMISSION_LIMITS: JSON of extra per-scope limits, e.g.
+                      {"mode:knowledge_check": {"rpm": 30, "tpm": 60000}, "tenant:seller-hub": {"rpm": 50}}
+    COMBINED_MAX_PROBLEMS: multi_problem "auto" never combines more problems than this (default: 6)
+    COMBINED_MIN_SAVED_TOKENS: ...and combines when parallel calls would resend at least this
+                      many transcript tokens (default: 12000)
+    SYNTHESIS_ENGINE: "llm" (default; the model writes the whole assessment), "hybrid"
+                      (scores computed locally, the model writes only prose) or "local" (no model call)
+    WARMUP_MODEL_CALL: "1" = warmups also send a 1-token Bedrock call (default: connection only)
+    EMIT_METRICS: "1" = print CloudWatch EMF metrics per request (default: on in Lambda only)
+    METRICS_NAMESPACE: CloudWatch namespace for those metrics (default: AvatarAnalysis)
+
+Request ingress:
+  Bodies may be sent gzip/deflate-compressed (Content-Encoding header). Large
+  fields can be uploaded once with analysis_mode "store_content", which returns
+  refs ("sha256:<hex>"); later requests send transcript_ref / dpp_ref instead of
+  the inline transcript / dpp. On Lambda store_content answers 404 NOT_ENABLED
+  unless CONTENT_STORE is s3:// (a /tmp store is invisible to other containers).
+
+Progressive results:
+  A default-path request with "progressive": true first gets a draft from
+  HR_DRAFT_SYSTEM_PROMPT (overview, fit, three strengths; max_tokens=200) and
+  returns it with a "result_id" (on Lambda only when RESULT_STORE is s3://;
+  otherwise the request gets the full analysis as usual). The full analysis runs afterwards in an
+  asynchronous refine_result invocation (a thread off Lambda) and is stored in
+  RESULT_STORE; poll it with {"analysis_mode": "result", "result_id": ...} or
+  pass "notify_url" (https, host listed in NOTIFY_URL_HOSTS; redirects are not
+  followed) to have the finished record POSTed there. The refine first claims
+  the record (pending -> refining, a conditional write that also drops the
+  stored request), so a duplicate async delivery runs and notifies nothing.
+  Records carry draft_ms, refine_ms and ready_after_ms, also emitted as
+  DraftMs / RefineMs / ReadyAfterMs metrics.
+
+Report archive:
+  With REPORT_STORE set, every successful analysis (per_problem, multi_problem,
+  synthesis, knowledge_check, training_summary, general, full, and the refined
+  result of a progressive request) is stored with its index values -
+  session_id, subject (candidate/user; an email address is indexed as
+  "email:<hash>"), mode, product (or HR role title), UTC date - plus its
+  headline score and grade, and the response carries its "report_id". Optional
+  request fields "session_id", "subject" and "product" set the index values
+  directly. The read-only "reports" mode returns one
+  report ({"report_id"}), a newest-first page of one index ({"product": ...,
+  "limit", "cursor"} -> "reports", "next_cursor") or the per-product/mode
+  aggregates kept up to date on write ({"aggregates": true} -> report count,
+  avg_score, grade distribution), without a model call. Store writes run on a
+  background thread after the response (run_after_response). The reports mode answers direct
+  invocations (already authorized by IAM); through API Gateway it needs an
+  x-api-key header equal to REPORTS_API_KEY and is 404 NOT_ENABLED without one.
+
+Report delivery:
+  analyze_and_deliver takes a knowledge_check/general request plus
+  "report_mode" and "deliver": {"to_email", "title"}. The report is returned as
+  soon as the analysis finishes; the email is sent by an asynchronous
+  (InvocationType=Event) send_report_email invocation of this function on
+  Lambda (needs lambda:InvokeFunction on itself), or a background thread
+  elsewhere. The response carries "delivery": {"status": "queued"|"sent"|"failed"}.
+  An invalid to_email still gets the report, with "delivery": {"status":
+  "skipped", "reason": "invalid_email"}.
+
+Multi-problem analysis:
+  "multi_problem" returns {"problems": [<per_problem JSON>, ...]} for the listed
+  "problems" (default: dpp.all_problems_in_session). "strategy" is "combined"
+  (one generation for all problems: the transcript is sent once), "parallel"
+  (concurrent per_problem model calls from this invocation) or "auto"
+  (default): combined after a recent throttle in this container or when the
+  transcript is large enough that resending it per problem costs more than
+  COMBINED_MIN_SAVED_TOKENS; parallel for one problem, more than
+  COMBINED_MAX_PROBLEMS, or otherwise (lower latency). Problems the combined
+  answer leaves out or garbles are re-analyzed per problem. The response
+  carries "strategy", "strategy_reason" and "model_calls".
+
+Synthesis engine:
+  The hybrid and local engines derive every number in the synthesis JSON from
+  the per-problem results (difficulty-weighted 1-5 means, fit.score_0_100 =
+  skill 60% + potential 40%, rec thresholds, strengths/areas ranking). Hybrid
+  then asks the model only for the short prose fields (max_tokens=256); local
+  fills them from templates. Requests may pick one with "synthesis_engine".
+
+Warmup & container metrics:
+  A warmup (analysis_mode "warmup", or any EventBridge "aws.events" event)
+  creates the lazily built clients, opens the Bedrock and SES connections with
+  a cheap API call (any response, AccessDenied included, leaves a live TLS
+  connection in the pool), renders every prompt template and the email
+  template once, and optionally makes a 1-token model call (WARMUP_MODEL_CALL,
+  or "model_call": true in a schedule event's detail; request bodies cannot ask),
+  admitted at background priority (reported "shed" when there is no room). Every other request emits EMF metrics (LatencyMs,
+  Requests, SincePrimeS) with a ContainerState dimension: "cold" (first
+  invocation of the container), "primed" (a warmup ran here earlier) or
+  "unprimed" (warm, never primed).
+
+Output length prediction:
+  With OUTPUT_STATS_STORE set, every model call's usage.output_tokens is
+  recorded in a histogram per mode, transcript size (estimated tokens, next
+  power of two) and problem count. Once one has OUTPUT_MIN_SAMPLES, calls ask
+  for its OUTPUT_QUANTILE plus OUTPUT_MARGIN instead of the mode's fixed budget
+  (never more). An answer cut off at that prediction (stop_reason
+  "max_tokens") is retried once at the fixed budget. Answers cut off at the
+  fixed budget, or longer than OUTLIER_FACTOR x the median, are logged as
+  outliers. Metrics: OutputTokens, MaxTokens, OutputOutliers, BudgetRetries.
+
+Admission control:
+  When ADMISSION_STORE is set, every Bedrock call first takes one request and
+  its estimated tokens from per-minute buckets (global quota, plus optional
+  per-mode / per-tenant limits). Lower priority classes must leave a share of
+  the global quota free for interactive modes. Requests that cannot be admitted
+  within their class's wait budget get 429 THROTTLING with a Retry-After hint.
+  The tenant (for "tenant:<name>" limits) is what the gateway vouches for: a
+  "tenant" from the API Gateway authorizer (Lambda authorizer context or JWT
+  claim), else the API key id. A "tenant" field in the body is ignored.
 """
 
+import atexit
+import base64
+import contextvars
+import gzip
+import hashlib
+import hmac
 import json
+import math
 import os
+import queue
 import re
+import sqlite3
+import statistics
+import string
 import html
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import boto3
 from botocore.config import Config
+from botocore.exceptions import ClientError
+
+try:
+    import orjson  # optional: faster JSON encode/decode when bundled with the function
+except ImportError:
+    orjson = None
 
 # =============================================================================
 # CONFIGURATION
@@ -45,13 +216,48 @@ TEMPERATURE = float(os.environ.get('TEMPERATURE', '0.3'))
 bedrock_config = Config(
     retries={'max_attempts': 3, 'mode': 'adaptive'},
     read_timeout=60,
-    connect_timeout=10
+    connect_timeout=10,
+    tcp_keepalive=True
 )
 
 bedrock = boto3.client('bedrock-runtime', config=bedrock_config)
 
 SES_FROM_EMAIL = os.environ.get('SES_FROM_EMAIL', 'noreply@avatardemo.att-sellerhub.com')
-ses = boto3.client('ses')
+ses = boto3.client('ses', config=Config(tcp_keepalive=True))
+lambda_client = None  # created on first async delivery or warmup (keeps it off the cold start)
+
+TRAFFIC_LOG_PATH = os.environ.get('TRAFFIC_LOG_PATH', '')
+
+MAX_REQUEST_BYTES = int(os.environ.get('MAX_REQUEST_BYTES', str(4 * 1024 * 1024)))
+CONTENT_STORE = os.environ.get('CONTENT_STORE', 'local')
+RESULT_STORE = os.environ.get('RESULT_STORE', 'local')
+NOTIFY_URL_HOSTS = frozenset(h.strip().lower() for h in os.environ.get('NOTIFY_URL_HOSTS', '').split(',') if h.strip())
+REPORT_STORE = os.environ.get('REPORT_STORE', '')
+REPORTS_API_KEY = os.environ.get('REPORTS_API_KEY', '')
+OUTPUT_STATS_STORE = os.environ.get('OUTPUT_STATS_STORE', '')
+OUTPUT_QUANTILE = float(os.environ.get('OUTPUT_QUANTILE', '0.99'))
+OUTPUT_MARGIN = float(os.environ.get('OUTPUT_MARGIN', '0.2'))
+
+ADMISSION_STORE = os.environ.get('ADMISSION_STORE', '')
+BEDROCK_RPM = int(os.environ.get('BEDROCK_RPM', '100'))
+BEDROCK_TPM = int(os.environ.get('BEDROCK_TPM', '200000'))
+ADMISSION_LIMITS = json.loads(os.environ.get('ADMISSION_LIMITS', '{}'))
+
+COMBINED_MAX_PROBLEMS = int(os.environ.get('COMBINED_MAX_PROBLEMS', '6'))
+COMBINED_MIN_SAVED_TOKENS = int(os.environ.get('COMBINED_MIN_SAVED_TOKENS', '12000'))
+
+SYNTHESIS_ENGINE = os.environ.get('SYNTHESIS_ENGINE', 'llm')
+
+WARMUP_MODEL_CALL = os.environ.get('WARMUP_MODEL_CALL', '') == '1'
+EMIT_METRICS = os.environ.get('EMIT_METRICS', '1' if os.environ.get('AWS_LAMBDA_FUNCTION_NAME') else '') == '1'
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'AvatarAnalysis')
+
+# Analysis mode of the request being handled (labels recorded traffic, selects admission limits)
+current_mode = contextvars.ContextVar('current_mode', default='full')
+current_tenant = contextvars.ContextVar('current_tenant', default='default')
+current_container = contextvars.ContextVar('current_container', default='unprimed')
+# (summary, usage) of the last success_response built for this request (read by archive_response)
+current_result = contextvars.ContextVar('current_result', default=None)
 
 # =============================================================================
 # CORS HEADERS
@@ -60,7 +266,8 @@ ses = boto3.client('ses')
 CORS_HEADERS = {
     'Access-Control-Allow-Origin': '*',
     'Access-Control-Allow-Methods': 'POST, OPTIONS',
-    'Access-Control-Allow-Headers': 'Content-Type',
+    'Access-Control-Allow-Headers': 'Content-Type, Content-Encoding',
+    'Access-Control-Expose-Headers': 'Retry-After',
     'Content-Type': 'application/json'
 }
 
@@ -68,17 +275,30 @@ CORS_HEADERS = {
 # CODE INTERVIEW PROMPTS (per-problem + synthesis)
 # =============================================================================
 
+PROBLEM_RESULT_SHAPE = '{"problem_id":"str","problem_title":"str","difficulty":"easy|medium|hard","outcome":"solved|partial|stuck|skipped","tests_passed":int,"tests_total":int,"approach":"brute_force|hash_map|two_pointer|sorting|dynamic_programming|recursion|greedy|other|incomplete","approach_used":"str","time_complexity":"str","space_complexity":"str","optimal":bool,"time_spent_minutes":int,"hints_used":int,"scores":{"creativity":1-5,"logic":1-5,"code_quality":1-5,"explainability":1-5,"complexity":1-5,"scale":1-5},"eval_notes":"1-2 sentences"}'
+
 PER_PROBLEM_SYSTEM_PROMPT = """Analyze ONE coding problem from an interview transcript. Focus ONLY on the specified problem.
 Output ONLY valid JSON. No markdown. Be concise — all strings 1 sentence max.
 
 OUTPUT JSON SHAPE:
-{"problem_id":"str","problem_title":"str","difficulty":"easy|medium|hard","outcome":"solved|partial|stuck|skipped","tests_passed":int,"tests_total":int,"approach":"brute_force|hash_map|two_pointer|sorting|dynamic_programming|recursion|greedy|other|incomplete","approach_used":"str","time_complexity":"str","space_complexity":"str","optimal":bool,"time_spent_minutes":int,"hints_used":int,"scores":{"creativity":1-5,"logic":1-5,"code_quality":1-5,"explainability":1-5,"complexity":1-5,"scale":1-5},"eval_notes":"1-2 sentences"}"""
+""" + PROBLEM_RESULT_SHAPE
+
+MULTI_PROBLEM_SYSTEM_PROMPT = """Analyze EVERY listed coding problem from an interview transcript. Judge each problem ONLY on the part of the transcript about it.
+Output ONLY valid JSON. No markdown. Be concise — all strings 1 sentence max.
+
+OUTPUT JSON SHAPE: {"problems":[one object per listed problem, in the listed order]}, each object:
+""" + PROBLEM_RESULT_SHAPE
 
 SYNTHESIS_SYSTEM_PROMPT = """Synthesize coding interview results into overall assessment. Output ONLY valid JSON. Be VERY concise — max 5 words per string field. fit.score_0_100=skill(60%)+potential(40%).
 
 JSON:
 {"overview":"20-30 words","skill_assessment":{"problem_solving":1-5,"problem_solving_e":"str","code_fluency":1-5,"code_fluency_e":"str","communication":1-5,"communication_e":"str","efficiency_awareness":1-5,"efficiency_awareness_e":"str"},"potential_assessment":{"creativity_score":1-5,"creativity_a":"str","tenacity_score":1-5,"tenacity_a":"str","aptitude_score":1-5,"aptitude_a":"str","propensity_score":1-5,"propensity_a":"str","talent_indicators":["max3"],"potential_vs_performance":"potential_exceeds|matches|performance_exceeds|insufficient","growth_trajectory":"high|moderate|limited|unknown"},"fit":{"score_0_100":num,"rec":"strong_yes|yes|lean_yes|lean_no|no","conf":"high|medium|low","rationale":"str"},"strengths":["max3"],"areas_for_improvement":["max3"],"cq":{"emo":"calm|confident|neutral|frustrated|stressed|positive|unknown","tone":"collaborative|independent|receptive|defensive|unknown","eng":"high|medium|low|unknown","think_aloud":bool},"risk":{"flags":["none"],"escalated":false,"reason":""},"next_steps":["max2"]}"""
 
+SYNTHESIS_PROSE_SYSTEM_PROMPT = """Write the prose for a coding interview assessment whose scores are already computed. Output ONLY valid JSON. Be VERY concise — max 5 words per string field. Do not output or change any score.
+
+JSON:
+{"overview":"20-30 words","problem_solving_e":"str","code_fluency_e":"str","communication_e":"str","efficiency_awareness_e":"str","creativity_a":"str","tenacity_a":"str","aptitude_a":"str","propensity_a":"str","talent_indicators":["max3"],"rationale":"str","cq":{"emo":"calm|confident|neutral|frustrated|stressed|positive|unknown","tone":"collaborative|independent|receptive|defensive|unknown","eng":"high|medium|low|unknown","think_aloud":bool},"risk":{"flags":["none"],"escalated":false,"reason":""},"next_steps":["max2"]}"""
+
 # =============================================================================
 # HR DEMO SYSTEM PROMPT (default / full mode)
 # =============================================================================
@@ -111,6 +331,10 @@ REQUIRED OUTPUT STRUCTURE:
 
 Return ONLY the JSON object."""
 
+HR_DRAFT_SYSTEM_PROMPT = """You are an expert HR analyst. Give a FAST first read of an HR call transcript; the full report is produced separately.
+Output ONLY valid JSON - no markdown, no explanations:
+{"overview":"1-2 sentences, max 40 words","fit":{"score_0_100":num,"rec":"strong_yes|yes|lean_yes|lean_no|no","conf":"high|medium|low"},"strengths":["exactly 3, max 6 words each"]}"""
+
 # =============================================================================
 # AT&T SELLER HUB PROMPTS (knowledge check + training summary)
 # =============================================================================
@@ -172,33 +396,58 @@ OUTPUT SCHEMA:
 # LAMBDA HANDLER
 # =============================================================================
 
+MODE_ALIASES = {'call_summary_email': 'training_summary'}
+INTERNAL_MODES = ('refine_result',)  # self-invocations; never reachable through API Gateway
+
 def lambda_handler(event, context):
     # Handle CORS preflight
     if event.get('requestContext', {}).get('http', {}).get('method') == 'OPTIONS':
         return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': ''}
 
-    try:
-        body = event.get('body', '{}')
-        if isinstance(body, str):
-            body = json.loads(body)
+    current_container.set(enter_container())
+    if event.get('source') == 'aws.events':
+        # EventBridge schedule (deploy.sh WARMUP_SCHEDULE)
+        current_mode.set('warmup')
+        return handle_warmup(event.get('detail') or {}, trigger='schedule')
 
-        mode = body.get('analysis_mode')
+    current_mode.set('invalid')  # until the body names a mode
+    if not EMIT_METRICS:
+        return route_request(event)
+    t0 = time.perf_counter()
+    response = route_request(event)
+    if current_mode.get() != 'warmup':
+        emit_request_metrics(response, _elapsed_ms(t0))
+    return response
 
-        if mode == 'per_problem':
-            return handle_per_problem(body)
-        elif mode == 'synthesis':
-            return handle_synthesis(body)
-        elif mode == 'knowledge_check':
-            return handle_knowledge_check(body)
-        elif mode in ('training_summary', 'call_summary_email'):
-            return handle_training_summary(body)
-        elif mode == 'general':
-            return handle_general(body)
-        elif mode == 'send_report_email':
-            return handle_send_report_email(body)
-        else:
-            return handle_full(body)
 
+def route_request(event):
+    try:
+        body = decode_request_body(event)
+        mode = body.get('analysis_mode')
+        current_mode.set(MODE_ALIASES.get(mode, mode) or 'full')
+        current_tenant.set(request_tenant(event))
+
+        # API Gateway, Function URLs and server.py always set requestContext; direct invokes don't
+        if mode in INTERNAL_MODES and 'requestContext' in event:
+            return error_response(f'{mode} is internal', 'FORBIDDEN', 403)
+        if mode == 'reports' and 'requestContext' in event:
+            denied = check_reports_key(event)
+            if denied:
+                return denied
+        if mode == 'store_content':
+            return handle_store_content(body)
+        resolve_content_refs(body)
+
+        current_result.set(None)
+        response = dispatch(mode, body)
+        if response['statusCode'] == 200 and current_mode.get() in ARCHIVED_MODES and get_report_store():
+            response = archive_response(body, response)
+        return response
+
+    except RequestError as e:
+        return error_response(str(e), e.code, e.status_code)
+    except AdmissionRejected as e:
+        return error_response('Service busy, please retry', 'THROTTLING', 429, retry_after=e.retry_after)
     except json.JSONDecodeError as e:
         return error_response(f'Invalid JSON: {str(e)}', 'VALIDATION_ERROR')
     except bedrock.exceptions.ThrottlingException:
@@ -210,103 +459,185 @@ def lambda_handler(event, context):
         return error_response(f'Analysis failed: {str(e)}', 'BEDROCK_ERROR', 500)
 
 
+def request_tenant(event):
+    """Tenant for admission limits, from what API Gateway vouches for; "default" otherwise.
+
+    Never from the body: any caller could name another tenant to dodge its own
+    bucket or drain someone else's.
+    """
+    context = event.get('requestContext') or {}
+    authorizer = context.get('authorizer') or {}
+    tenant = ((authorizer.get('lambda') or {}).get('tenant')
+              or ((authorizer.get('jwt') or {}).get('claims') or {}).get('tenant')
+              or authorizer.get('tenant')
+              or (context.get('identity') or {}).get('apiKeyId'))
+    return str(tenant)[:64] if tenant else 'default'
+
+
+def dispatch(mode, body):
+    """Route a decoded request to its mode handler (the default path when no mode matches)."""
+    if mode == 'per_problem':
+        return handle_per_problem(body)
+    elif mode == 'multi_problem':
+        return handle_multi_problem(body)
+    elif mode == 'synthesis':
+        return handle_synthesis(body)
+    elif mode == 'knowledge_check':
+        return handle_knowledge_check(body)
+    elif mode in ('training_summary', 'call_summary_email'):
+        return handle_training_summary(body)
+    elif mode == 'general':
+        return handle_general(body)
+    elif mode == 'send_report_email':
+        return handle_send_report_email(body)
+    elif mode == 'analyze_and_deliver':
+        return handle_analyze_and_deliver(body)
+    elif mode == 'warmup':
+        return handle_warmup(body, trigger='request')
+    elif mode == 'result':
+        return handle_result(body)
+    elif mode == 'refine_result':
+        return handle_refine_result(body)
+    elif mode == 'reports':
+        return handle_reports(body)
+    else:
+        return handle_full(body)
+
+
+def content_refs_available():
+    """On Lambda the next request may land on another container, so refs need a shared store."""
+    return CONTENT_STORE.startswith('s3://') or not os.environ.get('AWS_LAMBDA_FUNCTION_NAME')
+
+
+def handle_store_content(body):
+    """Store transcript/DPP once and return content refs for later requests."""
+    if not content_refs_available():
+        return error_response('Content refs are off (CONTENT_STORE is not s3://); send content inline',
+                              'NOT_ENABLED', 404)
+    refs = {}
+    for field in CONTENT_REF_FIELDS:
+        if body.get(field):
+            refs[field] = store_content(body[field])
+    if not refs:
+        return error_response(f'Missing: one of {", ".join(CONTENT_REF_FIELDS)}', 'VALIDATION_ERROR')
+
+    return {
+        'statusCode': 200,
+        'headers': CORS_HEADERS,
+        'body': json_dumps({'success': True, 'refs': refs})
+    }
+
+
 def handle_per_problem(body):
     """Analyze a single problem from the transcript."""
     transcript = body.get('transcript', [])
     problem = body.get('problem_focus', {})
-    dpp = body.get('dpp', {})
 
     if not transcript:
         return error_response('Missing: transcript', 'VALIDATION_ERROR')
     if not problem.get('id'):
         return error_response('Missing: problem_focus.id', 'VALIDATION_ERROR')
 
-    transcript_text = format_transcript(transcript)
+    result, usage, raw = analyze('per_problem', body)
+
+    return success_response(result, usage, raw)
 
-    user_prompt = (
-        f"Analyze ONLY the problem \"{problem.get('title', problem['id'])}\" "
-        f"(id: {problem['id']}, difficulty: {problem.get('difficulty', '?')}).\n\n"
-        f"## Session Context\n"
-        f"Language: {dpp.get('live_code', dpp.get('session', {})).get('language', 'python') if isinstance(dpp.get('live_code'), dict) else 'python'}\n"
-        f"Session problems: {json.dumps(dpp.get('all_problems_in_session', []), separators=(',', ':'))}\n\n"
-        f"## Transcript\n{transcript_text}\n\n"
-        f"Output the JSON for this ONE problem only."
-    )
 
-    result, usage = call_bedrock(user_prompt, PER_PROBLEM_SYSTEM_PROMPT, max_tokens=512)
+def handle_multi_problem(body):
+    """Analyze every problem of a session: one combined generation or parallel per-problem calls."""
+    transcript = body.get('transcript', [])
+    problems = body.get('problems') or (body.get('dpp') or {}).get('all_problems_in_session') or []
+    strategy = body.get('strategy') or 'auto'
 
-    return success_response(result, usage)
+    if not transcript:
+        return error_response('Missing: transcript', 'VALIDATION_ERROR')
+    if not problems or not all(isinstance(p, dict) and p.get('id') for p in problems):
+        return error_response('Missing: problems (each with an id)', 'VALIDATION_ERROR')
+    if strategy not in PROBLEM_STRATEGIES:
+        return error_response(f'strategy must be one of: {", ".join(PROBLEM_STRATEGIES)}', 'VALIDATION_ERROR')
+
+    body['problems'] = problems
+    ctx = PromptContext(body)
+    reason = 'requested'
+    if strategy == 'auto':
+        strategy, reason = choose_problem_strategy(ctx, problems)
+
+    results, usage, calls = {}, {'input_tokens': 0, 'output_tokens': 0}, 0
+    if strategy == 'combined':
+        results, usage = analyze_combined(ctx, problems)
+        calls = 1
+    missing = [p for p in problems if p['id'] not in results]
+    if missing:
+        if strategy == 'combined':
+            print(f'Combined analysis missed {[p["id"] for p in missing]}, analyzing them per problem')
+        parallel_results, parallel_usage = analyze_parallel(ctx, missing)
+        results.update(parallel_results)
+        usage = {key: usage[key] + parallel_usage[key] for key in usage}
+        calls += len(missing)
+
+    return success_response({'problems': [results[p['id']] for p in problems]}, usage,
+                            strategy=strategy, strategy_reason=reason, model_calls=calls)
 
 
 def handle_synthesis(body):
     """Synthesize per-problem results into an overall assessment."""
     problem_results = body.get('problem_results', [])
-    dpp = body.get('dpp', {})
-
-    if not problem_results:
-        return error_response('Missing: problem_results', 'VALIDATION_ERROR')
+    engine = body.get('synthesis_engine') or SYNTHESIS_ENGINE
 
-    candidate = dpp.get('candidate', {})
-    name = candidate.get('full_name', candidate.get('first_name', 'Candidate'))
-    elapsed = dpp.get('session', {}).get('elapsed_minutes', '?')
-    total_problems = dpp.get('session', {}).get('total_problems', len(problem_results))
+    if not isinstance(problem_results, list) or not any(isinstance(p, dict) for p in problem_results):
+        return error_response('Missing: problem_results (at least one result object)', 'VALIDATION_ERROR')
+    if engine not in SYNTHESIS_ENGINES:
+        return error_response(f'synthesis_engine must be one of: {", ".join(SYNTHESIS_ENGINES)}', 'VALIDATION_ERROR')
+    if engine != 'llm':
+        return synthesize(body, engine)
 
-    user_prompt = (
-        f"Candidate: {name}\n"
-        f"Session: {elapsed} minutes, {len(problem_results)} of {total_problems} problems attempted.\n"
-        f"Hints given: {dpp.get('session', {}).get('hints_given', 0)}\n\n"
-        f"## Per-Problem Results\n"
-        f"```json\n{json.dumps(problem_results, separators=(',', ':'))}\n```\n\n"
-        f"Synthesize these results into one overall assessment JSON."
-    )
+    result, usage, raw = analyze('synthesis', body)
 
-    result, usage = call_bedrock(user_prompt, SYNTHESIS_SYSTEM_PROMPT, max_tokens=512)
-
-    return success_response(result, usage)
+    return success_response(result, usage, raw)
 
 
 def handle_full(body):
     """Full single-call analysis (HR demo or legacy code interview)."""
     transcript = body.get('transcript', [])
     dpp = body.get('dpp', {})
-    schema = body.get('schema')
-    custom_prompt = body.get('summary_prompt')
 
     if not transcript:
         return error_response('Missing: transcript', 'VALIDATION_ERROR')
     if not dpp:
         return error_response('Missing: dpp', 'VALIDATION_ERROR')
+    if body.get('progressive') and progressive_available():
+        return handle_progressive(body)
+
+    summary, usage, raw = run_full(body, PromptContext(body))
+    return success_response(summary, usage, raw)
 
-    user_prompt = build_full_prompt(transcript, dpp, schema, custom_prompt)
-    summary, usage = call_bedrock(user_prompt, custom_prompt or HR_SYSTEM_PROMPT)
+
+def run_full(body, ctx):
+    """The default path's model call; returns call_bedrock's tuple with final_code attached."""
+    system_prompt, user_prompt = render_prompt('full', ctx)
+    # A caller's own summary_prompt asks for a different answer: it keeps the fixed budget
+    length_keys = None if body.get('summary_prompt') else output_length_keys('full', ctx)
+    summary, usage, raw = call_bedrock(user_prompt, body.get('summary_prompt') or system_prompt,
+                                       max_tokens=MODE_MAX_TOKENS['full'], length_keys=length_keys)
 
     # Inject final_code from DPP
+    dpp = body.get('dpp', {})
     final_code = dpp.get('final_code') or dpp.get('live_code', {}).get('current_code', '')
-    if final_code and 'final_code' not in summary:
+    if final_code and isinstance(summary, dict) and 'final_code' not in summary:
         summary['final_code'] = final_code
-
-    return success_response(summary, usage)
+        raw = splice_field(raw, 'final_code', final_code)
+    return summary, usage, raw
 
 
 def handle_knowledge_check(body):
     """Analyze a product knowledge check session and produce a graded report."""
     transcript = body.get('transcript', [])
-    product = body.get('product', 'AT&T Product')
-    questions = body.get('questions', [])
 
     if not transcript:
         return error_response('Missing: transcript', 'VALIDATION_ERROR')
 
-    q_block = '\n'.join(f'{i+1}. {q}' for i, q in enumerate(questions)) if questions else 'Not provided'
-    user_prompt = (
-        f"Product assessed: {product}\n\n"
-        f"Questions asked during the session:\n{q_block}\n\n"
-        f"## Transcript\n{format_transcript(transcript)}\n\n"
-        f"Analyze this knowledge check and output the JSON report."
-    )
-
-    result, usage = call_bedrock(user_prompt, KNOWLEDGE_CHECK_SYSTEM_PROMPT, max_tokens=1500)
-    return success_response(result, usage)
+    result, usage, raw = analyze('knowledge_check', body)
+    return success_response(result, usage, raw)
 
 
 def handle_training_summary(body):
@@ -316,31 +647,19 @@ def handle_training_summary(body):
     if not transcript:
         return error_response('Missing: transcript', 'VALIDATION_ERROR')
 
-    user_prompt = (
-        f"## Transcript\n{format_transcript(transcript)}\n\n"
-        f"Write the call summary and output the JSON."
-    )
-
-    result, usage = call_bedrock(user_prompt, TRAINING_SUMMARY_SYSTEM_PROMPT, max_tokens=500)
-    return success_response(result, usage)
+    result, usage, raw = analyze('training_summary', body)
+    return success_response(result, usage, raw)
 
 
 def handle_general(body):
     """Analyze a general sales training session and produce a structured report."""
     transcript = body.get('transcript', [])
-    context = body.get('context', '')
 
     if not transcript:
         return error_response('Missing: transcript', 'VALIDATION_ERROR')
 
-    user_prompt = (
-        (f"Session context: {context}\n\n" if context else '') +
-        f"## Transcript\n{format_transcript(transcript)}\n\n"
-        f"Analyze this sales training session and output the JSON report."
-    )
-
-    result, usage = call_bedrock(user_prompt, GENERAL_ANALYSIS_SYSTEM_PROMPT, max_tokens=1200)
-    return success_response(result, usage)
+    result, usage, raw = analyze('general', body)
+    return success_response(result, usage, raw)
 
 
 def handle_send_report_email(body):
@@ -349,25 +668,13 @@ def handle_send_report_email(body):
     report = body.get('report', {})
     title = body.get('title', 'Session Report')
 
-    if not to_email or not re.match(r'^[^@\s]+@[^@\s]+\.[^@\s]+$', to_email):
+    if not is_valid_email(to_email):
         return error_response('Missing or invalid to_email', 'VALIDATION_ERROR')
     if not report:
         return error_response('Missing report data', 'VALIDATION_ERROR')
 
-    html_body = build_report_email_html(report, title)
-    subject = f'AT&T Seller Hub — {title} Report'
-
     try:
-        ses.send_email(
-            Source=f'AT&T Seller Hub <{SES_FROM_EMAIL}>',
-            Destination={'ToAddresses': [to_email]},
-            Message={
-                'Subject': {'Data': subject, 'Charset': 'UTF-8'},
-                'Body': {
-                    'Html': {'Data': html_body, 'Charset': 'UTF-8'}
-                }
-            }
-        )
+        send_report(to_email, report, title)
     except Exception as e:
         print(f'SES send error: {e}')
         return error_response(f'Email send failed: {str(e)}', 'SES_ERROR', 500)
@@ -375,10 +682,113 @@ def handle_send_report_email(body):
     return {
         'statusCode': 200,
         'headers': CORS_HEADERS,
-        'body': json.dumps({'success': True, 'message': f'Report emailed to {to_email}'})
+        'body': json_dumps({'success': True, 'message': f'Report emailed to {to_email}'})
     }
 
 
+def handle_analyze_and_deliver(body):
+    """Run knowledge_check/general, return the report, and email it without waiting for SES."""
+    report_mode = body.get('report_mode')
+    deliver = body.get('deliver') or {}
+    to_email = str(deliver.get('to_email', '')).strip()
+    title = deliver.get('title') or 'Session Report'
+
+    if report_mode not in DELIVERABLE_MODES:
+        return error_response(f'report_mode must be one of: {", ".join(DELIVERABLE_MODES)}', 'VALIDATION_ERROR')
+    if not body.get('transcript'):
+        return error_response('Missing: transcript', 'VALIDATION_ERROR')
+
+    current_mode.set(report_mode)  # admission class and traffic records follow the analysis
+    result, usage, raw = analyze(report_mode, body)
+    # An undeliverable address costs the user the email, not the report
+    if not is_valid_email(to_email):
+        return success_response(result, usage, raw,
+                                delivery={'status': 'skipped', 'reason': 'invalid_email', 'to_email': to_email})
+    status = deliver_report_async(to_email, result, title) if isinstance(result, dict) and result else 'failed'
+    return success_response(result, usage, raw, delivery={'status': status, 'to_email': to_email})
+
+
+DELIVERABLE_MODES = ('knowledge_check', 'general')
+
+
+def is_valid_email(address):
+    return bool(address) and re.match(r'^[^@\s]+@[^@\s]+\.[^@\s]+$', address) is not None
+
+
+def send_report(to_email, report, title):
+    """Render a report as branded HTML and send it through SES."""
+    send_email(to_email, f'AT&T Seller Hub — {title} Report', build_report_email_html(report, title))
+
+
+def deliver_report_async(to_email, report, title):
+    """Hand the report email off the request path. Returns "queued", "sent" or "failed".
+
+    On Lambda a thread would be frozen as soon as the handler returns, so the
+    send runs in an asynchronous send_report_email invocation of this function
+    instead; elsewhere (local tools, servers) it runs on a daemon thread. If the
+    async invoke is refused, the email is sent inline rather than dropped.
+    """
+    payload = {'analysis_mode': 'send_report_email', 'to_email': to_email, 'report': report, 'title': title}
+    function_name = os.environ.get('AWS_LAMBDA_FUNCTION_NAME')
+    if not function_name:
+        ctx = contextvars.copy_context()
+        threading.Thread(target=ctx.run, args=(_send_report_logged, to_email, report, title),
+                         name='report-delivery', daemon=True).start()
+        return 'queued'
+
+    try:
+        get_lambda_client().invoke(FunctionName=function_name, InvocationType='Event',
+                             Payload=json_dumps({'body': json_dumps(payload)}).encode('utf-8'))
+        return 'queued'
+    except Exception as e:
+        print(f'Async delivery invoke failed, sending inline: {e}')
+    return 'sent' if _send_report_logged(to_email, report, title) else 'failed'
+
+
+def get_lambda_client():
+    global lambda_client
+    if lambda_client is None:
+        lambda_client = boto3.client('lambda')
+    return lambda_client
+
+
+def _send_report_logged(to_email, report, title):
+    try:
+        send_report(to_email, report, title)
+        return True
+    except Exception as e:
+        print(f'SES send error: {e}')
+        return False
+
+
+def send_email(to_email, subject, html_body):
+    """Send one HTML email through SES, recording the call when traffic logging is on."""
+    message = {
+        'Source': f'AT&T Seller Hub <{SES_FROM_EMAIL}>',
+        'Destination': {'ToAddresses': [to_email]},
+        'Message': {
+            'Subject': {'Data': subject, 'Charset': 'UTF-8'},
+            'Body': {
+                'Html': {'Data': html_body, 'Charset': 'UTF-8'}
+            }
+        }
+    }
+    if not TRAFFIC_LOG_PATH:
+        return ses.send_email(**message)
+
+    key = request_hash('ses', to_email, subject, html_body)
+    t0 = time.perf_counter()
+    try:
+        response = ses.send_email(**message)
+    except Exception as e:
+        record_traffic({'kind': 'ses', 'key': key, 'mode': current_mode.get(), 'latency_ms': _elapsed_ms(t0),
+                        'error': type(e).__name__, 'message': str(e)})
+        raise
+    record_traffic({'kind': 'ses', 'key': key, 'mode': current_mode.get(), 'latency_ms': _elapsed_ms(t0),
+                    'response': {'MessageId': response.get('MessageId', '')}})
+    return response
+
+
 def build_report_email_html(report, title):
     """Build an AT&T-branded HTML email from a report JSON object."""
     h = html.escape
@@ -556,58 +966,74 @@ def build_report_email_html(report, title):
 # HELPERS
 # =============================================================================
 
-def build_full_prompt(transcript, dpp, schema=None, custom_prompt=None):
-    transcript_text = format_transcript(transcript)
-    turn_count = len([t for t in transcript if t.get('role') == 'user'])
-    dpp_clean = {k: v for k, v in dpp.items() if k != 'summary_prompt'}
-
-    parts = [
-        "Analyze this session and produce a JSON summary.\n",
-        f"## Session Mode\n{dpp_clean.get('mode', 'interview')}\n",
-        f"## Turn Count\n{turn_count} user turns\n",
-        f"## DPP\n```json\n{json.dumps(dpp_clean, separators=(',', ':'))}\n```\n",
-        f"## Transcript\n{transcript_text}\n",
-    ]
-
-    if schema:
-        parts.append(f"## Schema\n```json\n{json.dumps(schema, separators=(',', ':'))}\n```\n")
-
-    parts.append(
-        "\n## Instructions\n"
-        "Follow the system prompt schema exactly.\n"
-        "Output ONLY the JSON object, no other text."
-    )
-
-    return '\n'.join(parts)
-
-
 def format_transcript(transcript):
-    lines = []
-    for i, turn in enumerate(transcript, 1):
-        role = turn.get('role', 'unknown')
-        content = turn.get('content', '')
-        speaker = 'AI' if role == 'assistant' else 'Candidate'
-        lines.append(f"[{i}] {speaker}: {content}")
-    return '\n'.join(lines)
-
-
-def call_bedrock(user_prompt, system_prompt, max_tokens=None):
+    return '\n'.join([
+        f"[{i}] {'AI' if turn.get('role') == 'assistant' else 'Candidate'}: {turn.get('content', '')}"
+        for i, turn in enumerate(transcript, 1)
+    ])
+
+
+def call_bedrock(user_prompt, system_prompt, max_tokens=None, length_keys=None):
+    """Run one model call. Returns (summary, usage, raw) where raw is the validated JSON text.
+
+    `max_tokens` is the mode's fixed budget. With `length_keys` (output_length_keys)
+    and OUTPUT_STATS_STORE set, the call asks for the budget predicted from past
+    output lengths instead, and an answer cut off at that prediction
+    (stop_reason "max_tokens") is retried once at the fixed budget.
+    """
+    ceiling = max_tokens or MAX_TOKENS
+    budget, histogram = plan_output_budget(length_keys, ceiling)
+    message = invoke_admitted(user_prompt, system_prompt, budget)
+    spent = None
+    if message.get('stop_reason') == 'max_tokens' and budget < ceiling:
+        print(f'Output cut off at predicted max_tokens={budget} ({length_keys[0]}); retrying at {ceiling}')
+        emit_metrics({'BudgetRetries': 1}, {'Mode': length_keys[0].split('|', 1)[0]})
+        spent = message.get('usage', {})
+        budget = ceiling
+        message = invoke_admitted(user_prompt, system_prompt, budget)
+    observe_output_length(length_keys, message, budget, ceiling, histogram)
+
+    summary, usage, content = parse_bedrock_message(message)
+    if spent:
+        usage = {key: usage[key] + spent.get(key, 0) for key in usage}
+    return summary, usage, content
+
+
+def invoke_admitted(user_prompt, system_prompt, max_tokens):
+    """One admitted Bedrock call; returns the decoded response body."""
     request_body = {
         "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": max_tokens or MAX_TOKENS,
+        "max_tokens": max_tokens,
         "temperature": TEMPERATURE,
         "system": system_prompt,
         "messages": [{"role": "user", "content": user_prompt}]
     }
 
-    response = bedrock.invoke_model(
-        modelId=MODEL_ID,
-        body=json.dumps(request_body),
-        contentType='application/json',
-        accept='application/json'
-    )
+    request_json = json.dumps(request_body)
+    ticket = admit(estimate_input_tokens(system_prompt, user_prompt) + max_tokens)
+    try:
+        raw = invoke_bedrock(request_json, system_prompt)
+    except bedrock.exceptions.ThrottlingException as e:
+        note_throttled()
+        report_throttled(ticket, e)
+        raise
+    except Exception:
+        settle(ticket, 0)
+        raise
+
+    message = json_loads(raw)
+    usage = message.get('usage', {})
+    settle(ticket, usage.get('input_tokens', 0) + usage.get('output_tokens', 0))
+    return message
+
+
+def parse_bedrock_response(raw):
+    """Extract and validate the model's JSON text from a Bedrock response body."""
+    return parse_bedrock_message(json_loads(raw))
 
-    response_body = json.loads(response['body'].read())
+
+def parse_bedrock_message(response_body):
+    """parse_bedrock_response for an already decoded response body."""
     content = response_body.get('content', [{}])[0].get('text', '{}').strip()
 
     if content.startswith('```'):
@@ -615,7 +1041,7 @@ def call_bedrock(user_prompt, system_prompt, max_tokens=None):
         content = '\n'.join(lines[1:-1] if lines[-1] == '```' else lines[1:])
 
     try:
-        summary = json.loads(content)
+        summary = json_loads(content)
     except json.JSONDecodeError as e:
         print(f'Failed to parse LLM response: {content[:500]}')
         raise ValueError(f'LLM returned invalid JSON: {str(e)}')
@@ -625,20 +1051,2182 @@ def call_bedrock(user_prompt, system_prompt, max_tokens=None):
         'output_tokens': response_body.get('usage', {}).get('output_tokens', 0)
     }
 
-    return summary, usage
+    return summary, usage, content
+
+
+def invoke_bedrock(request_json, system_prompt):
+    """Call Bedrock and return the raw response body, recording it when traffic logging is on."""
+    def invoke():
+        response = bedrock.invoke_model(
+            modelId=MODEL_ID,
+            body=request_json,
+            contentType='application/json',
+            accept='application/json'
+        )
+        return response['body'].read()
+
+    if not TRAFFIC_LOG_PATH:
+        return invoke()
+
+    entry = {
+        'kind': 'bedrock',
+        'key': request_hash(MODEL_ID, request_json),
+        'prompt_key': request_hash(system_prompt),
+        'mode': current_mode.get(),
+        'model': MODEL_ID,
+    }
+    t0 = time.perf_counter()
+    try:
+        raw = invoke()
+    except Exception as e:
+        record_traffic(dict(entry, latency_ms=_elapsed_ms(t0), error=type(e).__name__, message=str(e)))
+        raise
+
+    usage = json_loads(raw).get('usage', {})
+    record_traffic(dict(entry, latency_ms=_elapsed_ms(t0),
+                        input_tokens=usage.get('input_tokens', 0),
+                        output_tokens=usage.get('output_tokens', 0),
+                        response=raw.decode('utf-8')))
+    return raw
+
+
+# =============================================================================
+# BACKGROUND WRITES (store writes that must not hold up the response)
+# =============================================================================
+
+_background_queue = queue.SimpleQueue()
+_background_lock = threading.Lock()
+_background_worker = None
+
+
+def run_after_response(fn, *args):
+    """Queue fn(*args) on the background writer thread; failures are logged, never raised.
+
+    One thread runs the queue in order. On Lambda it is frozen with the
+    container between invocations and resumes when the next one thaws it.
+    A container reclaimed while frozen loses what is still queued.
+    """
+    global _background_worker
+    if _background_worker is None:
+        with _background_lock:
+            if _background_worker is None:
+                _background_worker = threading.Thread(target=_run_background, name='background-writes', daemon=True)
+                _background_worker.start()
+                atexit.register(flush_background)
+    _background_queue.put((fn, args))
+
+
+def _run_background():
+    while True:
+        fn, args = _background_queue.get()
+        try:
+            fn(*args)
+        except Exception as e:
+            print(f'Background {getattr(fn, "__name__", fn)} failed: {e}')
+
+
+def flush_background(timeout=5.0):
+    """Wait until everything queued so far has run (local tools, tests, shutdown). False on timeout."""
+    if _background_worker is None:
+        return True
+    done = threading.Event()
+    _background_queue.put((done.set, ()))
+    return done.wait(timeout)
+
+
+# =============================================================================
+# REQUEST INGRESS (compression, content refs, size limits)
+# =============================================================================
+
+CONTENT_REF_FIELDS = ('transcript', 'dpp')
+
+
+class RequestError(Exception):
+    """Client error raised while decoding a request; mapped to error_response."""
+
+    def __init__(self, message, code='VALIDATION_ERROR', status_code=400):
+        super().__init__(message)
+        self.code = code
+        self.status_code = status_code
+
+
+def decode_request_body(event):
+    """Return the parsed JSON body, undoing base64/gzip/deflate and enforcing MAX_REQUEST_BYTES."""
+    body = event.get('body') or '{}'
+    if isinstance(body, dict):
+        return body
+
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    encoding = headers.get('content-encoding', '').strip().lower()
+
+    if event.get('isBase64Encoded'):
+        data = base64.b64decode(body)
+    else:
+        data = body.encode('utf-8') if isinstance(body, str) else body
+
+    if encoding in ('gzip', 'deflate'):
+        # gzip: wbits=31, zlib-wrapped deflate: 15; bounded to stop decompression bombs
+        inflater = zlib.decompressobj(31 if encoding == 'gzip' else 15)
+        try:
+            data = inflater.decompress(data, MAX_REQUEST_BYTES + 1)
+        except zlib.error as e:
+            raise RequestError(f'Invalid {encoding} body: {e}')
+    elif encoding not in ('', 'identity'):
+        raise RequestError(f'Unsupported Content-Encoding: {encoding}', 'UNSUPPORTED_ENCODING', 415)
+
+    if len(data) > MAX_REQUEST_BYTES:
+        raise RequestError(f'Request body exceeds {MAX_REQUEST_BYTES} bytes after decoding',
+                           'PAYLOAD_TOO_LARGE', 413)
+    return json_loads(data)
+
+
+def resolve_content_refs(body):
+    """Replace <field>_ref entries with the stored content (inline values win).
+
+    A <field>_ref left in the body afterwards always describes body[field], so
+    PromptContext can key its memo on it.
+    """
+    for field in CONTENT_REF_FIELDS:
+        ref = body.get(f'{field}_ref')
+        if ref and body.get(field):
+            del body[f'{field}_ref']
+        elif ref:
+            body[field] = load_content(ref)
+
+
+def store_content(value):
+    """Store a JSON value under its content hash and return its ref."""
+    data = json_dumps(value).encode('utf-8')
+    ref = 'sha256:' + hashlib.sha256(data).hexdigest()
+    _ref_cache.put(ref, value)
+    get_content_store().put(ref, data)
+    return ref
+
+
+def load_content(ref):
+    if not isinstance(ref, str) or not re.fullmatch(r'sha256:[0-9a-f]{64}', ref):
+        raise RequestError(f'Invalid content ref: {ref!r}')
+    cached = _ref_cache.get(ref)
+    if cached is not None:
+        return cached
+
+    data = get_content_store().get(ref)
+    if data is None:
+        raise RequestError(f'Unknown content ref {ref}; resend the content inline or via store_content',
+                           'UNKNOWN_REF', 409)
+    if 'sha256:' + hashlib.sha256(data).hexdigest() != ref:
+        raise RequestError(f'Stored content for {ref} is corrupt; resend it', 'UNKNOWN_REF', 409)
+    value = json_loads(data)
+    _ref_cache.put(ref, value)
+    return value
+
+
+class LRUCache:
+    """Small thread-safe per-container LRU; cached values are shared and must be treated as read-only."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+        return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+
+# Decoded refs, so warm invocations skip the store read.
+REF_CACHE_SIZE = 32
+_ref_cache = LRUCache(REF_CACHE_SIZE)
+
+
+class LocalContentStore:
+    """Content blobs on the container's local disk; shared only within one warm container."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, ref):
+        return os.path.join(self.root, ref.split(':', 1)[1])
+
+    def get(self, ref):
+        try:
+            with open(self._path(ref), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, ref, data):
+        path = self._path(ref)
+        if not os.path.exists(path):
+            tmp = f'{path}.{os.getpid()}.{threading.get_ident()}'
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+
+
+class S3ContentStore:
+    """Content blobs in S3, shared by every container (needs s3:GetObject/PutObject)."""
+
+    def __init__(self, bucket, prefix=''):
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.s3 = boto3.client('s3')
+
+    def _key(self, ref):
+        name = ref.split(':', 1)[1]
+        return f'{self.prefix}/{name}' if self.prefix else name
+
+    def get(self, ref):
+        try:
+            return self.s3.get_object(Bucket=self.bucket, Key=self._key(ref))['Body'].read()
+        except self.s3.exceptions.NoSuchKey:
+            return None
+
+    def put(self, ref, data):
+        self.s3.put_object(Bucket=self.bucket, Key=self._key(ref), Body=data,
+                           ContentType='application/json')
+
+
+_content_store = None
+
+
+def get_content_store():
+    """Build the configured content store on first use (CONTENT_STORE)."""
+    global _content_store
+    if _content_store is None:
+        if CONTENT_STORE.startswith('s3://'):
+            bucket, _, prefix = CONTENT_STORE[len('s3://'):].partition('/')
+            _content_store = S3ContentStore(bucket, prefix)
+        else:
+            _, _, root = CONTENT_STORE.partition(':')
+            _content_store = LocalContentStore(root or '/tmp/content-store')
+    return _content_store
+
+
+# =============================================================================
+# PROMPT ASSEMBLY (per-mode templates, per-request context)
+# =============================================================================
+
+MODE_MAX_TOKENS = {
+    'per_problem': 512,
+    'synthesis': 512,
+    'synthesis_prose': 256,
+    'knowledge_check': 1500,
+    'training_summary': 500,
+    'general': 1200,
+    'full': None,  # MAX_TOKENS
+    'full_draft': 200,
+}
+
+FRAGMENT_CACHE_SIZE = 64
+
+
+def compact_json(value):
+    return json.dumps(value, separators=(',', ':'))
+
+
+class PromptContext:
+    """Per-request view of the body that builds each prompt fragment at most once.
+
+    Fragments derived from content that arrived as a ref (transcript_ref / dpp_ref)
+    are also memoized across warm invocations under the ref's content hash. Inline
+    content is not hashed: hashing it costs about as much as formatting it.
+    Every public method is a template field and returns a string.
+    """
+
+    def __init__(self, body):
+        self.body = body
+        self.transcript = body.get('transcript') or []
+        self.dpp = body.get('dpp') or {}
+        self._values = {}
+
+    def _fragment(self, name, source, build):
+        if name in self._values:
+            return self._values[name]
+        ref = self.body.get(f'{source}_ref')
+        value = _fragment_cache.get((ref, name)) if ref else None
+        if value is None:
+            value = build()
+            if ref:
+                _fragment_cache.put((ref, name), value)
+        self._values[name] = value
+        return value
+
+    # ── Transcript ────────────────────────────────────────────────────────────
+
+    def transcript_text(self):
+        return self._fragment('transcript_text', 'transcript', lambda: format_transcript(self.transcript))
+
+    def user_turns(self):
+        return self._fragment('user_turns', 'transcript',
+                              lambda: str(sum(1 for t in self.transcript if t.get('role') == 'user')))
+
+    # ── DPP ───────────────────────────────────────────────────────────────────
+
+    def dpp_json(self):
+        return self._fragment('dpp_json', 'dpp', lambda: compact_json(
+            {k: v for k, v in self.dpp.items() if k != 'summary_prompt'}))
+
+    def session_mode(self):
+        return str(self.dpp.get('mode', 'interview'))
+
+    def session_problems_json(self):
+        return self._fragment('session_problems_json', 'dpp',
+                              lambda: compact_json(self.dpp.get('all_problems_in_session', [])))
+
+    def language(self):
+        live_code = self.dpp.get('live_code')
+        return str(live_code.get('language', 'python')) if isinstance(live_code, dict) else 'python'
+
+    def candidate_name(self):
+        candidate = self.dpp.get('candidate', {})
+        return str(candidate.get('full_name', candidate.get('first_name', 'Candidate')))
+
+    def elapsed_minutes(self):
+        return str(self.dpp.get('session', {}).get('elapsed_minutes', '?'))
+
+    def total_problems(self):
+        return str(self.dpp.get('session', {}).get('total_problems', len(self.body.get('problem_results', []))))
+
+    def hints_given(self):
+        return str(self.dpp.get('session', {}).get('hints_given', 0))
+
+    # ── Request fields ────────────────────────────────────────────────────────
+
+    def problem_title(self):
+        problem = self.body.get('problem_focus', {})
+        return str(problem.get('title', problem.get('id')))
+
+    def problem_id(self):
+        return str(self.body.get('problem_focus', {}).get('id'))
+
+    def problem_difficulty(self):
+        return str(self.body.get('problem_focus', {}).get('difficulty', '?'))
+
+    def problem_count(self):
+        return str(len(self.body.get('problems', [])))
+
+    def problem_list(self):
+        return '\n'.join(f'{i}. "{p.get("title", p["id"])}" (id: {p["id"]}, difficulty: {p.get("difficulty", "?")})'
+                         for i, p in enumerate(self.body.get('problems', []), 1))
+
+    def problems_attempted(self):
+        return str(len(self.body.get('problem_results', [])))
+
+    def problem_results_json(self):
+        return compact_json(self.body.get('problem_results', []))
+
+    def assessment_json(self):
+        return compact_json(self.body.get('assessment', {}))
+
+    def product(self):
+        return str(self.body.get('product', 'AT&T Product'))
+
+    def questions_block(self):
+        questions = self.body.get('questions', [])
+        return '\n'.join(f'{i+1}. {q}' for i, q in enumerate(questions)) if questions else 'Not provided'
+
+    def context_line(self):
+        context = self.body.get('context', '')
+        return f"Session context: {context}\n\n" if context else ''
+
+    def schema_section(self):
+        schema = self.body.get('schema')
+        return f"## Schema\n```json\n{compact_json(schema)}\n```\n\n" if schema else ''
+
+    def with_fields(self, **fields):
+        """Context for the body plus `fields`, sharing the fragments built so far."""
+        ctx = PromptContext(dict(self.body, **fields))
+        ctx._values = self._values
+        return ctx
+
+
+class PromptTemplate:
+    """A mode's system prompt plus its user-prompt template, compiled once at import.
+
+    `{name}` placeholders are PromptContext methods; literal braces are `{{` / `}}`.
+    """
+
+    def __init__(self, system_prompt, template):
+        self.system_prompt = system_prompt
+        self.parts = []
+        for literal, field, _, _ in string.Formatter().parse(template):
+            if literal:
+                self.parts.append(literal)
+            if field is not None:
+                getter = getattr(PromptContext, field, None)
+                if field.startswith('_') or not callable(getter):
+                    raise ValueError(f'Unknown prompt field: {{{field}}}')
+                self.parts.append(getter)
+
+    def render(self, ctx):
+        return ''.join([part if isinstance(part, str) else part(ctx) for part in self.parts])
+
+
+PROMPT_TEMPLATES = {
+    'per_problem': PromptTemplate(
+        PER_PROBLEM_SYSTEM_PROMPT,
+        'Analyze ONLY the problem "{problem_title}" '
+        '(id: {problem_id}, difficulty: {problem_difficulty}).\n\n'
+        '## Session Context\n'
+        'Language: {language}\n'
+        'Session problems: {session_problems_json}\n\n'
+        '## Transcript\n{transcript_text}\n\n'
+        'Output the JSON for this ONE problem only.'
+    ),
+    'multi_problem': PromptTemplate(
+        MULTI_PROBLEM_SYSTEM_PROMPT,
+        'Analyze each of these {problem_count} problems:\n{problem_list}\n\n'
+        '## Session Context\n'
+        'Language: {language}\n'
+        'Session problems: {session_problems_json}\n\n'
+        '## Transcript\n{transcript_text}\n\n'
+        'Output the JSON with one object per listed problem.'
+    ),
+    'synthesis': PromptTemplate(
+        SYNTHESIS_SYSTEM_PROMPT,
+        'Candidate: {candidate_name}\n'
+        'Session: {elapsed_minutes} minutes, {problems_attempted} of {total_problems} problems attempted.\n'
+        'Hints given: {hints_given}\n\n'
+        '## Per-Problem Results\n'
+        '```json\n{problem_results_json}\n```\n\n'
+        'Synthesize these results into one overall assessment JSON.'
+    ),
+    'synthesis_prose': PromptTemplate(
+        SYNTHESIS_PROSE_SYSTEM_PROMPT,
+        'Candidate: {candidate_name}\n'
+        'Session: {elapsed_minutes} minutes, {problems_attempted} of {total_problems} problems attempted.\n'
+        'Hints given: {hints_given}\n\n'
+        '## Per-Problem Results\n'
+        '```json\n{problem_results_json}\n```\n\n'
+        '## Computed Assessment (final; do not repeat or change)\n'
+        '```json\n{assessment_json}\n```\n\n'
+        'Write the prose fields for this assessment.'
+    ),
+    'knowledge_check': PromptTemplate(
+        KNOWLEDGE_CHECK_SYSTEM_PROMPT,
+        'Product assessed: {product}\n\n'
+        'Questions asked during the session:\n{questions_block}\n\n'
+        '## Transcript\n{transcript_text}\n\n'
+        'Analyze this knowledge check and output the JSON report.'
+    ),
+    'training_summary': PromptTemplate(
+        TRAINING_SUMMARY_SYSTEM_PROMPT,
+        '## Transcript\n{transcript_text}\n\n'
+        'Write the call summary and output the JSON.'
+    ),
+    'general': PromptTemplate(
+        GENERAL_ANALYSIS_SYSTEM_PROMPT,
+        '{context_line}'
+        '## Transcript\n{transcript_text}\n\n'
+        'Analyze this sales training session and output the JSON report.'
+    ),
+    'full_draft': PromptTemplate(
+        HR_DRAFT_SYSTEM_PROMPT,
+        'Give the first read of this session.\n\n'
+        '## Session Mode\n{session_mode}\n\n'
+        '## DPP\n```json\n{dpp_json}\n```\n\n'
+        '## Transcript\n{transcript_text}\n\n'
+        'Output ONLY the JSON object.'
+    ),
+    'full': PromptTemplate(
+        HR_SYSTEM_PROMPT,
+        'Analyze this session and produce a JSON summary.\n\n'
+        '## Session Mode\n{session_mode}\n\n'
+        '## Turn Count\n{user_turns} user turns\n\n'
+        '## DPP\n```json\n{dpp_json}\n```\n\n'
+        '## Transcript\n{transcript_text}\n\n'
+        '{schema_section}'
+        '\n## Instructions\n'
+        'Follow the system prompt schema exactly.\n'
+        'Output ONLY the JSON object, no other text.'
+    ),
+}
+
+_fragment_cache = LRUCache(FRAGMENT_CACHE_SIZE)
+
+
+def render_prompt(mode, ctx):
+    """Return (system_prompt, user_prompt) for an analysis mode."""
+    template = PROMPT_TEMPLATES[mode]
+    return template.system_prompt, template.render(ctx)
+
+
+def analyze(mode, body):
+    """Render the mode's prompt for `body` and run the model call; returns call_bedrock's tuple."""
+    ctx = PromptContext(body)
+    system_prompt, user_prompt = render_prompt(mode, ctx)
+    problems = 1 if mode == 'per_problem' else len(body.get('problem_results') or ())
+    return call_bedrock(user_prompt, system_prompt, max_tokens=MODE_MAX_TOKENS[mode],
+                        length_keys=output_length_keys(mode, ctx, problems))
+
+
+# =============================================================================
+# OUTPUT LENGTH PREDICTION (learned max_tokens per request)
+# =============================================================================
+
+OUTPUT_BIN_TOKENS = 32        # histogram resolution
+OUTPUT_MIN_SAMPLES = 20       # recorded calls a histogram needs before it sets budgets
+OUTPUT_MIN_BUDGET = 64        # never predict below this
+OUTLIER_FACTOR = 2.0          # flag answers longer than this multiple of the histogram median
+OUTPUT_STATS_FLUSH_S = 10.0   # local store: save to disk at most this often
+OUTPUT_STATS_REFRESH_S = 60.0  # dynamodb store: reload the histograms at most this often
+
+
+def output_length_keys(mode, ctx, problems=0):
+    """Histogram keys for one call: (mode, transcript size, problem count), then (mode, problem count).
+
+    The problem count is how many problems the answer covers: 1 for every
+    per_problem call (standalone or fanned out), the result count for
+    synthesis, the problem count for combined multi_problem, 0 otherwise.
+    Transcript size is the estimated token count rounded up to a power of two, so
+    similar-length sessions share a histogram; the second key pools every size
+    until the first has OUTPUT_MIN_SAMPLES. None when OUTPUT_STATS_STORE is off.
+    """
+    if not OUTPUT_STATS_STORE:
+        return None
+    tokens = len(ctx.transcript_text()) // 4
+    size = 1 << tokens.bit_length() if tokens else 0
+    return f'{mode}|t{size}|p{problems}', f'{mode}|p{problems}'
+
+
+def plan_output_budget(keys, ceiling):
+    """max_tokens for one call, and the histogram it was predicted from (None = fixed budget).
+
+    The OUTPUT_QUANTILE of the recorded output lengths plus OUTPUT_MARGIN, from the
+    first key with enough samples; never above `ceiling`, the mode's fixed budget.
+    """
+    store = get_output_stats_store()
+    if store is None or keys is None:
+        return ceiling, None
+    try:
+        histograms = store.histograms(keys)
+    except Exception as e:
+        print(f'Output stats unavailable: {e}')
+        return ceiling, None
+    for histogram in histograms:
+        if sum(histogram.values()) >= OUTPUT_MIN_SAMPLES:
+            predicted = math.ceil(histogram_quantile(histogram, OUTPUT_QUANTILE) * (1 + OUTPUT_MARGIN))
+            return min(ceiling, max(OUTPUT_MIN_BUDGET, predicted)), histogram
+    return ceiling, None
+
+
+def histogram_quantile(histogram, q):
+    """Upper edge, in tokens, of the bin holding the q-quantile of a {bin: count} histogram."""
+    target = q * sum(histogram.values())
+    seen = 0
+    for index in sorted(histogram):
+        seen += histogram[index]
+        if seen >= target:
+            break
+    return (index + 1) * OUTPUT_BIN_TOKENS
+
+
+def observe_output_length(keys, message, budget, ceiling, histogram):
+    """Record a call's output length and flag runaway generations; never raises.
+
+    A runaway is an answer cut off at the mode's fixed budget, or one longer than
+    OUTLIER_FACTOR x the median of the histogram its budget came from.
+    """
+    store = get_output_stats_store()
+    if store is None or keys is None:
+        return
+    tokens = message.get('usage', {}).get('output_tokens', 0)
+    median = histogram_quantile(histogram, 0.5) if histogram else None
+    outlier = ((message.get('stop_reason') == 'max_tokens' and budget >= ceiling)
+               or (median is not None and tokens > OUTLIER_FACTOR * median))
+    if outlier:
+        print(f'Output length outlier: {keys[0]} generated {tokens} tokens '
+              f'(median {median or "unknown"}, max_tokens {budget})')
+    try:
+        store.add(keys, tokens)
+    except Exception as e:
+        print(f'Output stats update failed: {e}')
+    emit_metrics({'OutputTokens': tokens, 'MaxTokens': budget, 'OutputOutliers': int(outlier)},
+                 {'Mode': keys[0].split('|', 1)[0]})
+
+
+class LocalOutputStatsStore:
+    """Output-length histograms in process memory, saved to a JSON file every OUTPUT_STATS_FLUSH_S.
+
+    Per container on Lambda (learned again after each cold start); local tools and
+    single-host servers keep what they learned across restarts.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._saved_at = 0.0
+        try:
+            with open(path, 'rb') as f:
+                saved = json_loads(f.read())
+            self._histograms = {key: {int(index): count for index, count in bins.items()}
+                                for key, bins in saved.items()}
+        except (OSError, ValueError):
+            self._histograms = {}
+        atexit.register(self.save)
+
+    def histograms(self, keys):
+        with self._lock:
+            return [dict(self._histograms.get(key, ())) for key in keys]
+
+    def add(self, keys, tokens):
+        index = tokens // OUTPUT_BIN_TOKENS
+        with self._lock:
+            for key in keys:
+                bins = self._histograms.setdefault(key, {})
+                bins[index] = bins.get(index, 0) + 1
+            due = time.monotonic() - self._saved_at >= OUTPUT_STATS_FLUSH_S
+        if due:
+            self.save()
+
+    def save(self):
+        with self._lock:
+            self._saved_at = time.monotonic()
+            data = json_dumps({key: {str(index): count for index, count in bins.items()}
+                               for key, bins in self._histograms.items()})
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp = f'{self.path}.{os.getpid()}.{threading.get_ident()}'
+        with open(tmp, 'wb') as f:
+            f.write(data.encode('utf-8'))
+        os.replace(tmp, self.path)
+
+
+class DynamoOutputStatsStore:
+    """Output-length histograms in a DynamoDB table (partition key "pk", sort key "sk"), shared by all containers.
+
+    One item per histogram under ("output_length", <key>) with a "bin#<n>"
+    counter per bin, bumped with ADD. Every histogram is loaded with one Query
+    and reused for OUTPUT_STATS_REFRESH_S, with this container's own samples
+    added as they happen. Samples are counted in memory and written after the
+    response (run_after_response): one UpdateItem per histogram per flush, for
+    every sample added since the last one. The report archive's table
+    (REPORT_STORE) can be shared. Needs dynamodb:Query and UpdateItem on the table.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.ddb = boto3.client('dynamodb')
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._loaded_at = None
+        self._pending = {}  # {key: {bin: count}} added here and not yet written
+        self._flush_queued = False
+
+    def histograms(self, keys):
+        with self._lock:
+            stale = self._loaded_at is None or time.monotonic() - self._loaded_at >= OUTPUT_STATS_REFRESH_S
+            if stale:
+                self._loaded_at = time.monotonic()  # one reload at a time, and none right after a failed one
+        if stale:
+            self._load()
+        with self._lock:
+            return [dict(self._histograms.get(key, ())) for key in keys]
+
+    def _load(self):
+        histograms, kwargs = {}, {'TableName': self.table, 'KeyConditionExpression': 'pk = :pk',
+                                  'ExpressionAttributeValues': {':pk': {'S': 'output_length'}}}
+        while True:
+            response = self.ddb.query(**kwargs)
+            for item in response['Items']:
+                histograms[item['sk']['S']] = {int(name[len('bin#'):]): int(value['N'])
+                                               for name, value in item.items() if name.startswith('bin#')}
+            if 'LastEvaluatedKey' not in response:
+                break
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        with self._lock:
+            self._histograms = histograms
+
+    def add(self, keys, tokens):
+        index = tokens // OUTPUT_BIN_TOKENS
+        with self._lock:
+            for key in keys:
+                bins = self._histograms.setdefault(key, {})
+                bins[index] = bins.get(index, 0) + 1
+                pending = self._pending.setdefault(key, {})
+                pending[index] = pending.get(index, 0) + 1
+            queued, self._flush_queued = self._flush_queued, True
+        if not queued:
+            run_after_response(self.flush)
+
+    def flush(self):
+        """Write the samples counted since the last flush: one ADD per histogram covering all its bins."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flush_queued = False
+        for key, bins in pending.items():
+            counts = sorted(bins.items())
+            self.ddb.update_item(
+                TableName=self.table, Key={'pk': {'S': 'output_length'}, 'sk': {'S': key}},
+                UpdateExpression='ADD ' + ', '.join(f'#b{i} :n{i}' for i in range(len(counts))),
+                ExpressionAttributeNames={f'#b{i}': f'bin#{index}' for i, (index, _) in enumerate(counts)},
+                ExpressionAttributeValues={f':n{i}': {'N': str(count)} for i, (_, count) in enumerate(counts)})
+
+
+_output_stats_store = None
+
+
+def get_output_stats_store():
+    """Build the configured output stats store on first use (OUTPUT_STATS_STORE); None = fixed budgets."""
+    global _output_stats_store
+    if _output_stats_store is None and OUTPUT_STATS_STORE:
+        if OUTPUT_STATS_STORE.startswith('dynamodb://'):
+            _output_stats_store = DynamoOutputStatsStore(OUTPUT_STATS_STORE[len('dynamodb://'):])
+        else:
+            _, _, path = OUTPUT_STATS_STORE.partition(':')
+            _output_stats_store = LocalOutputStatsStore(path or '/tmp/output-stats.json')
+    return _output_stats_store
+
+
+# =============================================================================
+# MULTI-PROBLEM ANALYSIS (one combined generation or parallel per-problem calls)
+# =============================================================================
+
+PROBLEM_STRATEGIES = ('auto', 'combined', 'parallel')
+
+COMBINED_TOKENS_PER_PROBLEM = 384  # per_problem answers run ~190 tokens (per_problem itself caps at 512)
+THROTTLE_MEMORY_S = 60.0           # auto combines for this long after a throttle in this container
+PARALLEL_MAX_WORKERS = 16          # model calls in flight per container for parallel analysis
+
+_last_throttled_at = None
+_problem_pool = None
+_problem_pool_lock = threading.Lock()
+
+
+def note_throttled():
+    """Remember that Bedrock or admission control pushed back (read by choose_problem_strategy)."""
+    global _last_throttled_at
+    _last_throttled_at = time.monotonic()
+
+
+def recently_throttled():
+    return _last_throttled_at is not None and time.monotonic() - _last_throttled_at < THROTTLE_MEMORY_S
+
+
+def choose_problem_strategy(ctx, problems):
+    """Pick 'combined' or 'parallel' for an auto request. Returns (strategy, reason).
+
+    Parallel calls finish sooner (each generates one problem's JSON) but resend the
+    transcript per problem and compete for the same quota; one combined generation
+    sends it once and makes a single call, at the cost of a longer output.
+    """
+    if len(problems) == 1:
+        return 'parallel', 'single_problem'
+    if len(problems) > COMBINED_MAX_PROBLEMS:
+        return 'parallel', 'problem_count'
+    if recently_throttled():
+        return 'combined', 'throttled'
+    if len(ctx.transcript_text()) // 4 * (len(problems) - 1) >= COMBINED_MIN_SAVED_TOKENS:
+        return 'combined', 'transcript_size'
+    return 'parallel', 'latency'
+
 
+def get_problem_pool():
+    """Thread pool for parallel per-problem calls, created on first use and kept for warm invocations."""
+    global _problem_pool
+    if _problem_pool is None:
+        with _problem_pool_lock:
+            if _problem_pool is None:
+                _problem_pool = ThreadPoolExecutor(max_workers=PARALLEL_MAX_WORKERS,
+                                                   thread_name_prefix='problem')
+    return _problem_pool
+
+
+def analyze_combined(ctx, problems):
+    """One generation for every problem. Returns ({problem_id: result}, usage).
+
+    Results without a listed id or a scores object are dropped, and output that is
+    not valid JSON (e.g. cut off at max_tokens) yields no results, so the caller
+    re-analyzes those problems per problem instead of failing the request.
+    """
+    system_prompt, user_prompt = render_prompt('multi_problem', ctx)
+    try:
+        summary, usage, _ = call_bedrock(user_prompt, system_prompt,
+                                         max_tokens=COMBINED_TOKENS_PER_PROBLEM * len(problems),
+                                         length_keys=output_length_keys('multi_problem', ctx, len(problems)))
+    except ValueError as e:
+        print(f'Combined analysis unusable: {e}')
+        return {}, {'input_tokens': 0, 'output_tokens': 0}
+
+    wanted = {p['id'] for p in problems}
+    items = summary.get('problems') if isinstance(summary, dict) else None
+    results = {}
+    for item in items if isinstance(items, list) else []:
+        if isinstance(item, dict) and item.get('problem_id') in wanted and isinstance(item.get('scores'), dict):
+            results.setdefault(item['problem_id'], item)
+    return results, usage
+
+
+def analyze_parallel(ctx, problems):
+    """Concurrent per_problem calls. Returns ({problem_id: result}, usage); re-raises a failed call."""
+    ctx.transcript_text()  # build the shared fragments once, before the threads need them
+    ctx.session_problems_json()
+
+    def analyze_one(problem):
+        system_prompt, user_prompt = render_prompt('per_problem', ctx.with_fields(problem_focus=problem))
+        return call_bedrock(user_prompt, system_prompt, max_tokens=MODE_MAX_TOKENS['per_problem'],
+                            length_keys=output_length_keys('per_problem', ctx, 1))
+
+    if len(problems) == 1:
+        outcomes = [analyze_one(problems[0])]
+    else:
+        pool = get_problem_pool()
+        futures = [pool.submit(contextvars.copy_context().run, analyze_one, p) for p in problems]
+        outcomes = [future.result() for future in futures]
+
+    usage = {'input_tokens': 0, 'output_tokens': 0}
+    for _, call_usage, _ in outcomes:
+        usage = {key: usage[key] + call_usage[key] for key in usage}
+    return {p['id']: result for p, (result, _, _) in zip(problems, outcomes)}, usage
+
+
+# =============================================================================
+# SYNTHESIS ENGINE (scores computed locally, model used only for prose)
+# =============================================================================
+
+SYNTHESIS_ENGINES = ('llm', 'hybrid', 'local')
+
+DIFFICULTY_WEIGHTS = {'easy': 1.0, 'medium': 1.5, 'hard': 2.0}
+OUTCOME_SCORES = {'solved': 5, 'partial': 3, 'stuck': 2, 'skipped': 1}
+TENACITY_SCORES = {'solved': 5, 'partial': 4, 'stuck': 3, 'skipped': 1}
+SKILL_WEIGHT = 0.6  # fit.score_0_100 = skill(60%) + potential(40%)
+
+# Lowest fit score for each recommendation, checked in order
+REC_THRESHOLDS = (('strong_yes', 85), ('yes', 70), ('lean_yes', 58), ('lean_no', 45), ('no', 0))
+
+# Per-problem score dimension → (topic, strength label, improvement label)
+SCORE_LABELS = {
+    'logic': ('problem-solving logic', 'Sound problem-solving logic', 'Structure the solution first'),
+    'code_quality': ('code readability', 'Clean, readable code', 'Code readability'),
+    'creativity': ('alternative approaches', 'Creative approaches', 'Explore alternative approaches'),
+    'explainability': ('explaining reasoning', 'Clear explanations', 'Explain reasoning aloud'),
+    'complexity': ('complexity analysis', 'Complexity analysis', 'Complexity analysis precision'),
+    'scale': ('scale and edge cases', 'Thinks about scale', 'Consider scale and edge cases'),
+}
+STRENGTH_MIN = 4.0     # a dimension must average at least this to count as a strength
+IMPROVEMENT_MAX = 3.5  # ...and at most this to be listed as an area to improve
+
+PROSE_STRING_FIELDS = ('overview', 'problem_solving_e', 'code_fluency_e', 'communication_e',
+                       'efficiency_awareness_e', 'creativity_a', 'tenacity_a', 'aptitude_a',
+                       'propensity_a', 'rationale')
+PROSE_LIST_LIMITS = {'talent_indicators': 3, 'next_steps': 2}  # the schema's "max3" / "max2"
+
+
+def synthesize(body, engine):
+    """Synthesis with locally computed numbers; hybrid adds model-written prose."""
+    dpp = body.get('dpp') or {}
+    scores = score_problem_results(body['problem_results'])
+    prose = local_prose(scores, dpp)
+    usage = {'input_tokens': 0, 'output_tokens': 0}
+    if engine == 'hybrid':
+        prose_body = dict(body, assessment=scores['summary'])
+        model_prose, usage, _ = analyze('synthesis_prose', prose_body)
+        prose = merge_prose(prose, model_prose)
+    return success_response(build_synthesis(scores, prose), usage, synthesis_engine=engine)
+
+
+def score_problem_results(problem_results):
+    """Aggregate per-problem JSON into the synthesis numbers. Weighted by difficulty."""
+    problems = [p for p in problem_results if isinstance(p, dict)]
+
+    def wmean(value):
+        total = weight_sum = 0.0
+        for p in problems:
+            weight = DIFFICULTY_WEIGHTS.get(p.get('difficulty'), 1.0)
+            total += weight * value(p)
+            weight_sum += weight
+        return total / weight_sum if weight_sum else 1.0
+
+    def score(p, key):
+        value = (p.get('scores') or {}).get(key)
+        return min(5.0, max(1.0, float(value))) if isinstance(value, (int, float)) else 3.0
+
+    def hints_used(p):
+        value = p.get('hints_used')
+        return int(value) if isinstance(value, (int, float)) and value > 0 else 0
+
+    outcome = lambda p: OUTCOME_SCORES.get(p.get('outcome'), 3)
+    hints = lambda p: min(hints_used(p), 2)
+
+    skill = {
+        'problem_solving': wmean(lambda p: (score(p, 'logic') + outcome(p)) / 2),
+        'code_fluency': wmean(lambda p: score(p, 'code_quality')),
+        'communication': wmean(lambda p: score(p, 'explainability')),
+        'efficiency_awareness': wmean(lambda p: (score(p, 'complexity') + score(p, 'scale')) / 2),
+    }
+    potential = {
+        'creativity_score': wmean(lambda p: score(p, 'creativity')),
+        'tenacity_score': wmean(lambda p: max(1.0, TENACITY_SCORES.get(p.get('outcome'), 3) - 0.5 * hints(p))),
+        'aptitude_score': wmean(lambda p: (score(p, 'logic') + score(p, 'complexity') + (5 if p.get('optimal') else 3)) / 3),
+        'propensity_score': wmean(lambda p: (score(p, 'explainability') + score(p, 'scale')) / 2),
+    }
+    dimensions = {key: wmean(lambda p, key=key: score(p, key)) for key in SCORE_LABELS}
+
+    skill_pct = (statistics.fmean(skill.values()) - 1) / 4 * 100
+    potential_pct = (statistics.fmean(potential.values()) - 1) / 4 * 100
+    fit = round(SKILL_WEIGHT * skill_pct + (1 - SKILL_WEIGHT) * potential_pct)
+    rec = next(name for name, floor in REC_THRESHOLDS if fit >= floor)
+
+    attempted = [p for p in problems if p.get('outcome') != 'skipped']
+    ranked = sorted(dimensions, key=lambda key: (-dimensions[key], key)) if problems else []
+    gap = potential_pct - skill_pct
+
+    return {
+        'problems': problems,
+        'attempted': len(attempted),
+        'solved': sum(1 for p in problems if p.get('outcome') == 'solved'),
+        'optimal': sum(1 for p in problems if p.get('optimal')),
+        'hints': sum(hints_used(p) for p in problems),
+        'skill': {key: _score_1_5(value) for key, value in skill.items()},
+        'potential': {key: _score_1_5(value) for key, value in potential.items()},
+        'dimensions': dimensions,
+        'skill_pct': round(skill_pct),
+        'potential_pct': round(potential_pct),
+        'strengths': [key for key in ranked if dimensions[key] >= STRENGTH_MIN][:3],
+        'improvements': [key for key in reversed(ranked) if dimensions[key] <= IMPROVEMENT_MAX][:3],
+        'summary': {  # what the hybrid prose prompt sees
+            'skill': {key: _score_1_5(value) for key, value in skill.items()},
+            'potential': {key: _score_1_5(value) for key, value in potential.items()},
+            'fit': fit,
+            'rec': rec,
+        },
+        'fit': fit,
+        'rec': rec,
+        'conf': 'high' if len(attempted) >= 3 else 'medium' if len(attempted) == 2 else 'low',
+        'potential_vs_performance': ('insufficient' if not attempted else 'potential_exceeds' if gap > 10
+                                     else 'performance_exceeds' if gap < -10 else 'matches'),
+        'growth_trajectory': ('unknown' if not attempted else 'high' if potential_pct >= 75
+                              else 'moderate' if potential_pct >= 50 else 'limited'),
+    }
+
+
+def _score_1_5(value):
+    return int(min(5, max(1, math.floor(value + 0.5))))
+
+
+def local_prose(scores, dpp):
+    """Template prose for the local engine (and fallback for fields the model leaves out)."""
+    dims = scores['dimensions']
+    n = len(scores['problems'])
+    candidate = dpp.get('candidate', {})
+    name = candidate.get('first_name') or candidate.get('full_name') or 'Candidate'
+    strongest = SCORE_LABELS[scores['strengths'][0]][0] if scores['strengths'] else None
+    weakest = SCORE_LABELS[scores['improvements'][0]][0] if scores['improvements'] else None
+
+    overview = (f"{name} solved {scores['solved']} of {n} problems, {scores['optimal']} optimally, "
+                f"with {scores['hints']} hints")
+    if strongest:
+        overview += f"; strongest in {strongest}"
+    if weakest:
+        overview += f"; needs work on {weakest}"
+
+    next_steps = {'strong_yes': 'Advance to next round', 'yes': 'Advance to next round',
+                  'lean_yes': 'Follow-up technical round', 'lean_no': 'Follow-up technical round',
+                  'no': 'Do not advance'}[scores['rec']]
+    return {
+        'overview': overview + '.',
+        'problem_solving_e': f"{scores['solved']}/{n} solved, {scores['optimal']} optimal",
+        'code_fluency_e': f"Code quality {dims['code_quality']:.1f}/5",
+        'communication_e': f"Explainability {dims['explainability']:.1f}/5",
+        'efficiency_awareness_e': f"Complexity {dims['complexity']:.1f}/5, scale {dims['scale']:.1f}/5",
+        'creativity_a': f"Creativity {dims['creativity']:.1f}/5",
+        'tenacity_a': f"{scores['attempted']}/{n} attempted, {scores['hints']} hints",
+        'aptitude_a': f"{scores['optimal']}/{n} optimal solutions",
+        'propensity_a': f"Explainability {dims['explainability']:.1f}/5",
+        'talent_indicators': [SCORE_LABELS[key][1] for key in scores['strengths']],
+        'rationale': f"Skill {scores['skill_pct']}, potential {scores['potential_pct']}",
+        'cq': {'emo': 'unknown', 'tone': 'unknown', 'eng': 'unknown',
+               'think_aloud': dims['explainability'] >= STRENGTH_MIN},
+        'risk': {'flags': ['none'], 'escalated': False, 'reason': ''},
+        'next_steps': [next_steps] + ([f"Follow up on {weakest}"] if weakest else []),
+    }
+
+
+def merge_prose(fallback, model_prose):
+    """Take the model's prose fields where they have the expected type; keep the fallback otherwise."""
+    if not isinstance(model_prose, dict):
+        return fallback
+    prose = dict(fallback)
+    for key in PROSE_STRING_FIELDS:
+        if isinstance(model_prose.get(key), str) and model_prose[key].strip():
+            prose[key] = model_prose[key].strip()
+    for key, limit in PROSE_LIST_LIMITS.items():
+        value = model_prose.get(key)
+        if isinstance(value, list) and all(isinstance(v, str) for v in value):
+            prose[key] = value[:limit]
+    for key in ('cq', 'risk'):
+        if isinstance(model_prose.get(key), dict):
+            prose[key] = {**fallback[key], **model_prose[key]}
+    return prose
+
+
+def build_synthesis(scores, prose):
+    """Assemble the synthesis JSON in SYNTHESIS_SYSTEM_PROMPT's shape."""
+    skill, potential = scores['skill'], scores['potential']
+    return {
+        'overview': prose['overview'],
+        'skill_assessment': {
+            'problem_solving': skill['problem_solving'],
+            'problem_solving_e': prose['problem_solving_e'],
+            'code_fluency': skill['code_fluency'],
+            'code_fluency_e': prose['code_fluency_e'],
+            'communication': skill['communication'],
+            'communication_e': prose['communication_e'],
+            'efficiency_awareness': skill['efficiency_awareness'],
+            'efficiency_awareness_e': prose['efficiency_awareness_e'],
+        },
+        'potential_assessment': {
+            'creativity_score': potential['creativity_score'],
+            'creativity_a': prose['creativity_a'],
+            'tenacity_score': potential['tenacity_score'],
+            'tenacity_a': prose['tenacity_a'],
+            'aptitude_score': potential['aptitude_score'],
+            'aptitude_a': prose['aptitude_a'],
+            'propensity_score': potential['propensity_score'],
+            'propensity_a': prose['propensity_a'],
+            'talent_indicators': prose['talent_indicators'],
+            'potential_vs_performance': scores['potential_vs_performance'],
+            'growth_trajectory': scores['growth_trajectory'],
+        },
+        'fit': {
+            'score_0_100': scores['fit'],
+            'rec': scores['rec'],
+            'conf': scores['conf'],
+            'rationale': prose['rationale'],
+        },
+        'strengths': [SCORE_LABELS[key][1] for key in scores['strengths']],
+        'areas_for_improvement': [SCORE_LABELS[key][2] for key in scores['improvements']],
+        'cq': prose['cq'],
+        'risk': prose['risk'],
+        'next_steps': prose['next_steps'],
+    }
+
+
+# =============================================================================
+# PROGRESSIVE RESULTS (fast draft now, full analysis in the background)
+# =============================================================================
+
+RESULT_ID_RE = re.compile(r'[0-9a-f]{32}')
+NOTIFY_TIMEOUT_S = 5
+PRIVATE_RECORD_FIELDS = ('request', 'notify_url')  # never returned by the result mode or notifications
+
+
+def progressive_available():
+    """On Lambda the refine and the polls land on other containers, so results need a shared store."""
+    return RESULT_STORE.startswith('s3://') or not os.environ.get('AWS_LAMBDA_FUNCTION_NAME')
+
+
+def handle_progressive(body):
+    """Return a draft of the default-path analysis now; the full one follows under a result id."""
+    notify_url = body.get('notify_url')
+    if notify_url and not NOTIFY_URL_HOSTS:
+        return error_response('notify_url is off (NOTIFY_URL_HOSTS unset); poll the result instead',
+                              'NOT_ENABLED', 404)
+    if notify_url and not is_allowed_notify_url(notify_url):
+        return error_response('notify_url must be an https:// URL on a host in NOTIFY_URL_HOSTS',
+                              'VALIDATION_ERROR')
+
+    t0 = time.perf_counter()
+    created_at = time.time()
+    ctx = PromptContext(body)
+    current_mode.set('full_draft')
+    system_prompt, user_prompt = render_prompt('full_draft', ctx)
+    draft, usage, raw = call_bedrock(user_prompt, system_prompt, max_tokens=MODE_MAX_TOKENS['full_draft'],
+                                     length_keys=output_length_keys('full_draft', ctx))
+    draft_ms = _elapsed_ms(t0)
+
+    result_id = uuid.uuid4().hex
+    get_result_store().put(result_id, {
+        'result_id': result_id,
+        'status': 'pending',
+        'created_at': created_at,
+        'draft': draft,
+        'draft_ms': draft_ms,
+        'notify_url': notify_url,
+        'request': {k: v for k, v in body.items() if k not in ('progressive', 'notify_url')},
+    })
+    emit_metrics({'DraftMs': draft_ms}, {'Mode': 'full'})
+    status = refine_async(result_id, ctx)
+    return success_response(draft, usage, raw, result_id=result_id,
+                            refined={'status': status, 'poll': {'analysis_mode': 'result', 'result_id': result_id}})
+
+
+def handle_result(body):
+    """Return a progressive result record: status pending, refining, complete (with summary) or failed."""
+    result_id = str(body.get('result_id', ''))
+    if not RESULT_ID_RE.fullmatch(result_id):
+        return error_response('Missing or invalid result_id', 'VALIDATION_ERROR')
+    record = get_result_store().get(result_id)
+    if record is None:
+        return error_response(f'Unknown result_id {result_id}', 'NOT_FOUND', 404)
 
-def success_response(data, usage):
     return {
         'statusCode': 200,
         'headers': CORS_HEADERS,
-        'body': json.dumps({'success': True, 'summary': data, 'usage': usage})
+        'body': json_dumps({'success': True, **public_record(record)})
     }
 
 
-def error_response(message, code, status_code=400):
+def handle_refine_result(body):
+    """Async target of refine_async on Lambda."""
+    result_id = str(body.get('result_id', ''))
+    if not RESULT_ID_RE.fullmatch(result_id):
+        return error_response('Missing or invalid result_id', 'VALIDATION_ERROR')
+    status = refine_result(result_id)
+
     return {
-        'statusCode': status_code,
+        'statusCode': 200,
         'headers': CORS_HEADERS,
-        'body': json.dumps({'success': False, 'error': message, 'code': code})
+        'body': json_dumps({'success': True, 'result_id': result_id, 'status': status})
+    }
+
+
+def refine_async(result_id, ctx):
+    """Start the full analysis for a pending result off the request path.
+
+    Same hand-off as deliver_report_async: an asynchronous refine_result
+    invocation on Lambda, a daemon thread elsewhere (reusing the request's
+    prompt fragments), and inline if the invoke is refused. Returns "queued",
+    or the final status when it ran inline.
+    """
+    function_name = os.environ.get('AWS_LAMBDA_FUNCTION_NAME')
+    if not function_name:
+        ctx_vars = contextvars.copy_context()
+        threading.Thread(target=ctx_vars.run, args=(refine_result, result_id, ctx),
+                         name='refine-result', daemon=True).start()
+        return 'queued'
+
+    try:
+        get_lambda_client().invoke(FunctionName=function_name, InvocationType='Event',
+                                   Payload=json_dumps({'body': json_dumps(
+                                       {'analysis_mode': 'refine_result', 'result_id': result_id})}).encode('utf-8'))
+        return 'queued'
+    except Exception as e:
+        print(f'Async refine invoke failed, refining inline: {e}')
+    return refine_result(result_id, ctx)
+
+
+def refine_result(result_id, ctx=None):
+    """Run the full analysis for a pending result and store it. Returns the record's status.
+
+    The store's claim moves the record from pending to refining first (a
+    conditional write), so a second delivery of the same async invoke finds it
+    taken and neither reruns the analysis nor notifies again.
+    """
+    store = get_result_store()
+    record = store.claim(result_id)
+    if record is None:
+        record = store.get(result_id)
+        return record['status'] if record else 'unknown'
+
+    current_mode.set('full')
+    request = record.pop('request')
+    t0 = time.perf_counter()
+    try:
+        summary, usage, _ = run_full(request, ctx or PromptContext(request))
+        record.update(status='complete', summary=summary, usage=usage)
+        report_id = archive_report('full', request, summary, usage)
+        if report_id:
+            record['report_id'] = report_id
+    except Exception as e:
+        print(f'Refine {result_id} failed: {e}')
+        record.update(status='failed', error=str(e))
+    record['refine_ms'] = _elapsed_ms(t0)
+    record['completed_at'] = time.time()
+    record['ready_after_ms'] = round((record['completed_at'] - record['created_at']) * 1000, 1)
+    store.put(result_id, record)
+
+    emit_metrics({'RefineMs': record['refine_ms'], 'ReadyAfterMs': record['ready_after_ms']},
+                 {'Mode': 'full'}, status=record['status'])
+    if record.get('notify_url') and is_allowed_notify_url(record['notify_url']):
+        notify_result(record)
+    return record['status']
+
+
+def public_record(record):
+    return {k: v for k, v in record.items() if k not in PRIVATE_RECORD_FIELDS}
+
+
+def is_allowed_notify_url(url):
+    """https to a NOTIFY_URL_HOSTS host; plain http only to a listed localhost, and only off Lambda."""
+    parts = urllib.parse.urlsplit(str(url))
+    if not parts.hostname or parts.hostname.lower() not in NOTIFY_URL_HOSTS:
+        return False
+    return parts.scheme == 'https' or (parts.scheme == 'http' and parts.hostname in ('localhost', '127.0.0.1')
+                                       and not os.environ.get('AWS_LAMBDA_FUNCTION_NAME'))
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """A listed host must not bounce the POST to one that isn't."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+_notify_opener = urllib.request.build_opener(_NoRedirect)
+
+
+def notify_result(record):
+    """POST the finished record to its notify_url. Best effort: failures are logged, not retried."""
+    request = urllib.request.Request(record['notify_url'], data=json_dumps(public_record(record)).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'}, method='POST')
+    try:
+        with _notify_opener.open(request, timeout=NOTIFY_TIMEOUT_S) as response:
+            response.read()
+    except Exception as e:
+        print(f'Notify for {record["result_id"]} failed: {e}')
+
+
+class LocalResultStore:
+    """Result records as JSON files on local disk; visible only within one container."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, result_id):
+        return os.path.join(self.root, f'{result_id}.json')
+
+    def get(self, result_id):
+        try:
+            with open(self._path(result_id), 'rb') as f:
+                return json_loads(f.read())
+        except FileNotFoundError:
+            return None
+
+    def put(self, result_id, record):
+        path = self._path(result_id)
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}'
+        with open(tmp, 'wb') as f:
+            f.write(json_dumps(record).encode('utf-8'))
+        os.replace(tmp, path)
+
+    def claim(self, result_id):
+        """Move a pending record to refining; returns it (request included), or None if absent or already claimed."""
+        try:
+            os.close(os.open(f'{self._path(result_id)}.claim', os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return None
+        record = self.get(result_id)
+        if record is None or record['status'] != 'pending':
+            return None
+        self.put(result_id, refining_record(record))
+        return record
+
+
+class S3ResultStore:
+    """Result records in S3, shared by every container (needs s3:GetObject/PutObject).
+
+    claim is a conditional PutObject (If-Match on the ETag just read), so of two
+    concurrent claims only one succeeds.
+    """
+
+    def __init__(self, bucket, prefix=''):
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.s3 = boto3.client('s3')
+
+    def _key(self, result_id):
+        return f'{self.prefix}/{result_id}.json' if self.prefix else f'{result_id}.json'
+
+    def get(self, result_id):
+        try:
+            return json_loads(self.s3.get_object(Bucket=self.bucket, Key=self._key(result_id))['Body'].read())
+        except self.s3.exceptions.NoSuchKey:
+            return None
+
+    def put(self, result_id, record):
+        self.s3.put_object(Bucket=self.bucket, Key=self._key(result_id), Body=json_dumps(record).encode('utf-8'),
+                           ContentType='application/json')
+
+    def claim(self, result_id):
+        """Move a pending record to refining; returns it (request included), or None if absent or already claimed."""
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=self._key(result_id))
+        except self.s3.exceptions.NoSuchKey:
+            return None
+        record = json_loads(response['Body'].read())
+        if record['status'] != 'pending':
+            return None
+        try:
+            self.s3.put_object(Bucket=self.bucket, Key=self._key(result_id), IfMatch=response['ETag'],
+                               Body=json_dumps(refining_record(record)).encode('utf-8'),
+                               ContentType='application/json')
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                return None
+            raise
+        return record
+
+
+def refining_record(record):
+    """What a claimed record stores while it refines: status refining, and the request (transcript) dropped."""
+    return {**{k: v for k, v in record.items() if k != 'request'}, 'status': 'refining'}
+
+
+_result_store = None
+
+
+def get_result_store():
+    """Build the configured result store on first use (RESULT_STORE)."""
+    global _result_store
+    if _result_store is None:
+        if RESULT_STORE.startswith('s3://'):
+            bucket, _, prefix = RESULT_STORE[len('s3://'):].partition('/')
+            _result_store = S3ResultStore(bucket, prefix)
+        else:
+            _, _, root = RESULT_STORE.partition(':')
+            _result_store = LocalResultStore(root or '/tmp/result-store')
+    return _result_store
+
+
+# =============================================================================
+# REPORT ARCHIVE (successful analyses indexed for reopening and dashboards)
+# =============================================================================
+
+# Modes whose successful responses are archived (analyze_and_deliver runs as its report_mode)
+ARCHIVED_MODES = ('per_problem', 'multi_problem', 'synthesis', 'knowledge_check', 'training_summary', 'general',
+                  'full')
+REPORT_INDEXES = ('session_id', 'subject', 'mode', 'product', 'date')
+REPORT_LIST_FIELDS = ('report_id', 'created_at', *REPORT_INDEXES, 'score', 'grade')  # one row of a page
+REPORT_PAGE_SIZE = 20
+REPORT_PAGE_MAX = 100
+REPORT_FIELD_MAX = 200  # characters kept per index value
+
+
+def check_reports_key(event):
+    """Error response for an HTTP reports request without the right x-api-key, else None."""
+    if not REPORTS_API_KEY:
+        return error_response('reports is off over HTTP (REPORTS_API_KEY unset); invoke the function directly',
+                              'NOT_ENABLED', 404)
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    if not hmac.compare_digest(str(headers.get('x-api-key', '')).encode('utf-8'), REPORTS_API_KEY.encode('utf-8')):
+        return error_response('Missing or invalid x-api-key', 'UNAUTHORIZED', 401)
+    return None
+
+
+def handle_reports(body):
+    """Read-only report queries: one report by id, a page of one index, or aggregates."""
+    store = get_report_store()
+    if store is None:
+        return error_response('Report archive is off (REPORT_STORE unset)', 'NOT_ENABLED', 404)
+
+    if 'report_id' in body:
+        report_id = str(body.get('report_id', ''))
+        if not RESULT_ID_RE.fullmatch(report_id):
+            return error_response('Invalid report_id', 'VALIDATION_ERROR')
+        report = store.get(report_id)
+        if report is None:
+            return error_response(f'Unknown report_id {report_id}', 'NOT_FOUND', 404)
+        payload = {'report': report}
+    elif body.get('aggregates'):
+        payload = {'aggregates': store.aggregates(product=body.get('product'), mode=body.get('mode'))}
+    else:
+        indexes = [index for index in REPORT_INDEXES if body.get(index)]
+        if len(indexes) != 1:
+            return error_response(f'Give exactly one of: {", ".join(REPORT_INDEXES)} (or report_id, aggregates)',
+                                  'VALIDATION_ERROR')
+        limit = body.get('limit', REPORT_PAGE_SIZE)
+        if not isinstance(limit, int) or not 1 <= limit <= REPORT_PAGE_MAX:
+            return error_response(f'limit must be 1-{REPORT_PAGE_MAX}', 'VALIDATION_ERROR')
+        index = indexes[0]
+        value = report_subject(str(body[index])) if index == 'subject' else str(body[index])
+        reports, position = store.query(index, value, limit, decode_cursor(body.get('cursor')))
+        payload = {'reports': reports, 'next_cursor': encode_cursor(position)}
+
+    return {
+        'statusCode': 200,
+        'headers': CORS_HEADERS,
+        'body': json_dumps({'success': True, **payload})
+    }
+
+
+def archive_response(body, response):
+    """Archive the analysis the handler just returned and add its "report_id" to the response.
+
+    Summary and usage come from success_response (current_result), so the
+    envelope is never parsed back.
+    """
+    result = current_result.get()
+    if result is None:
+        return response
+    report_id = archive_report(current_mode.get(), body, *result)
+    if report_id is None:
+        return response
+    return {**response, 'body': splice_field(response['body'], 'report_id', report_id)}
+
+
+def archive_report(mode, body, summary, usage):
+    """Queue one analysis for the report store. Returns its report_id, or None when off or on failure.
+
+    Only the record is built here; the store write runs after the response
+    (run_after_response), so a failed write is logged and its report_id never resolves.
+    """
+    store = get_report_store()
+    if store is None:
+        return None
+    created_at = time.time()
+    try:
+        report = {
+            'report_id': uuid.uuid4().hex,
+            'created_at': created_at,
+            **report_index_values(mode, body, created_at),
+            **report_score(summary),
+            'summary': summary,
+            'usage': usage,
+        }
+    except Exception as e:
+        print(f'Report archive failed: {e}')
+        return None
+    run_after_response(write_report, store, mode, report)
+    return report['report_id']
+
+
+def write_report(store, mode, report):
+    t0 = time.perf_counter()
+    try:
+        store.put(report)
+    except Exception as e:
+        print(f'Report archive failed for {report["report_id"]}: {e}')
+        return
+    emit_metrics({'ArchiveMs': _elapsed_ms(t0)}, {'Mode': mode})
+
+
+def report_index_values(mode, body, created_at):
+    """Index values of a report: explicit request fields first, else what the DPP carries."""
+    dpp = body.get('dpp') if isinstance(body.get('dpp'), dict) else {}
+    subj = dpp.get('subj') if isinstance(dpp.get('subj'), dict) else {}
+    candidate = dpp.get('candidate') if isinstance(dpp.get('candidate'), dict) else {}
+    role = dpp.get('role') if isinstance(dpp.get('role'), dict) else {}
+
+    def first(*values):
+        return next((str(v).strip()[:REPORT_FIELD_MAX] for v in values if v and str(v).strip()), '')
+
+    return {
+        'session_id': first(body.get('session_id'), dpp.get('session_id')),
+        'subject': report_subject(first(body.get('subject'), subj.get('id'), subj.get('name'),
+                                        candidate.get('full_name'))),
+        'mode': mode,
+        'product': first(body.get('product'), role.get('t')),
+        'date': time.strftime('%Y-%m-%d', time.gmtime(created_at)),
+    }
+
+
+def report_subject(value):
+    """Subject index value; email addresses are kept only as a hash (queries hash theirs the same way)."""
+    value = value.strip()
+    if '@' not in value:
+        return value
+    return f'email:{request_hash(value.lower())}'
+
+
+def report_score(summary):
+    """Headline score (0-100) and grade; HR and synthesis reports are graded by their recommendation."""
+    if not isinstance(summary, dict):
+        return {'score': None, 'grade': ''}
+    fit = summary.get('fit') if isinstance(summary.get('fit'), dict) else {}
+    score = summary.get('overall_score', fit.get('score_0_100'))
+    if isinstance(score, bool) or not isinstance(score, (int, float)):
+        score = None
+    return {'score': score, 'grade': str(summary.get('grade') or fit.get('rec') or '')[:16]}
+
+
+def summarize_aggregates(rows):
+    """Fold (product, mode, grade, reports, scored, score_sum) rows into one entry per product and mode."""
+    groups = {}
+    for product, mode, grade, reports, scored, score_sum in rows:
+        group = groups.setdefault((product, mode), {'product': product, 'mode': mode, 'reports': 0,
+                                                    'scored': 0, 'score_sum': 0.0, 'grades': {}})
+        group['reports'] += reports
+        group['scored'] += scored
+        group['score_sum'] += score_sum
+        if grade:
+            group['grades'][grade] = group['grades'].get(grade, 0) + reports
+    return [{'product': g['product'], 'mode': g['mode'], 'reports': g['reports'],
+             'avg_score': round(g['score_sum'] / g['scored'], 1) if g['scored'] else None,
+             'grades': g['grades']}
+            for _, g in sorted(groups.items())]
+
+
+def encode_cursor(position):
+    if position is None:
+        return None
+    return base64.urlsafe_b64encode(json_dumps(position).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Opaque page cursor -> [sort position, tie-breaker] as the store returned it."""
+    if not cursor:
+        return None
+    try:
+        position = json_loads(base64.urlsafe_b64decode(str(cursor)))
+    except Exception:
+        raise RequestError('Invalid cursor')
+    if not (isinstance(position, list) and len(position) == 2):
+        raise RequestError('Invalid cursor')
+    return position
+
+
+class SQLiteReportStore:
+    """Reports in a SQLite file: one row per report plus per-(product, mode, grade) counters.
+
+    Every index column has a (column, created_at) index, so a page is one
+    indexed range scan, newest first; the counters are updated in the insert's
+    transaction, so aggregates never scan reports. Per container on Lambda:
+    local tools and single-host servers.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self.db:
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('PRAGMA synchronous=NORMAL')
+            self.db.execute('CREATE TABLE IF NOT EXISTS reports (report_id TEXT PRIMARY KEY, created_at REAL NOT NULL, '
+                            'session_id TEXT, subject TEXT, mode TEXT, product TEXT, date TEXT, score REAL, '
+                            'grade TEXT, record TEXT NOT NULL)')
+            for index in REPORT_INDEXES:
+                self.db.execute(f'CREATE INDEX IF NOT EXISTS reports_{index} ON reports ({index}, created_at)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS report_aggregates (product TEXT NOT NULL, mode TEXT NOT NULL, '
+                            'grade TEXT NOT NULL, reports INTEGER NOT NULL, scored INTEGER NOT NULL, '
+                            'score_sum REAL NOT NULL, PRIMARY KEY (product, mode, grade))')
+
+    def put(self, report):
+        scored = report['score'] is not None
+        with self._lock, self.db:
+            self.db.execute('INSERT INTO reports VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                            (*(report[field] for field in REPORT_LIST_FIELDS), json_dumps(report)))
+            self.db.execute('INSERT INTO report_aggregates VALUES (?, ?, ?, 1, ?, ?) '
+                            'ON CONFLICT (product, mode, grade) DO UPDATE SET reports = reports + 1, '
+                            'scored = scored + excluded.scored, score_sum = score_sum + excluded.score_sum',
+                            (report['product'], report['mode'], report['grade'], int(scored),
+                             report['score'] if scored else 0.0))
+
+    def get(self, report_id):
+        with self._lock:
+            row = self.db.execute('SELECT record FROM reports WHERE report_id = ?', (report_id,)).fetchone()
+        return json_loads(row[0]) if row else None
+
+    def query(self, index, value, limit, cursor):
+        """One page of reports with index == value, newest first; returns (rows, next cursor position)."""
+        sql = f'SELECT {", ".join(REPORT_LIST_FIELDS)} FROM reports WHERE {index} = ?'
+        params = [value]
+        if cursor:
+            sql += ' AND (created_at, report_id) < (?, ?)'
+            params += cursor
+        sql += ' ORDER BY created_at DESC, report_id DESC LIMIT ?'
+        with self._lock:
+            rows = self.db.execute(sql, (*params, limit + 1)).fetchall()
+        page = [dict(zip(REPORT_LIST_FIELDS, row)) for row in rows[:limit]]
+        return page, ([page[-1]['created_at'], page[-1]['report_id']] if len(rows) > limit else None)
+
+    def aggregates(self, product=None, mode=None):
+        sql = 'SELECT product, mode, grade, reports, scored, score_sum FROM report_aggregates WHERE 1 = 1'
+        params = []
+        for column, value in (('product', product), ('mode', mode)):
+            if value:
+                sql += f' AND {column} = ?'
+                params.append(value)
+        with self._lock:
+            rows = self.db.execute(sql, params).fetchall()
+        return summarize_aggregates(rows)
+
+
+class DynamoReportStore:
+    """Reports in a DynamoDB table (partition key "pk", sort key "sk"), shared by all containers.
+
+    Key-value layout: the report under ("report#<id>", "report"); a small
+    listing item per non-empty index value under ("<index>#<value>",
+    "<created_at>#<id>"), so a page is one Query, newest first; and a counter
+    item per product and mode under ("aggregate", ...) bumped with ADD.
+    Needs dynamodb:BatchWriteItem, GetItem, Query and UpdateItem on the table.
+    """
+
+    MAX_ATTEMPTS = 4
+
+    def __init__(self, table):
+        self.table = table
+        self.ddb = boto3.client('dynamodb')
+
+    def put(self, report):
+        sort_key = f'{report["created_at"]:017.6f}#{report["report_id"]}'
+        listing = json_dumps({field: report[field] for field in REPORT_LIST_FIELDS})
+        items = [{'pk': {'S': f'report#{report["report_id"]}'}, 'sk': {'S': 'report'},
+                  'record': {'S': json_dumps(report)}}]
+        items += [{'pk': {'S': f'{index}#{report[index]}'}, 'sk': {'S': sort_key}, 'entry': {'S': listing}}
+                  for index in REPORT_INDEXES if report[index]]
+        requests = [{'PutRequest': {'Item': item}} for item in items]
+        for attempt in range(self.MAX_ATTEMPTS):
+            unprocessed = self.ddb.batch_write_item(RequestItems={self.table: requests}).get('UnprocessedItems', {})
+            requests = unprocessed.get(self.table)
+            if not requests:
+                break
+            time.sleep(0.05 * 2 ** attempt)
+        if requests:
+            raise RuntimeError(f'{len(requests)} report items unwritten after {self.MAX_ATTEMPTS} attempts')
+
+        names = {'#p': 'product', '#m': 'mode', '#r': 'reports'}
+        values = {':p': {'S': report['product']}, ':m': {'S': report['mode']}, ':one': {'N': '1'}}
+        update = 'SET #p = :p, #m = :m ADD #r :one'
+        if report['score'] is not None:
+            names.update({'#k': 'scored', '#s': 'score_sum'})
+            values[':s'] = {'N': repr(report['score'])}
+            update += ', #k :one, #s :s'
+        if report['grade']:
+            names['#g'] = f'grade#{report["grade"]}'
+            update += ', #g :one'
+        self.ddb.update_item(TableName=self.table,
+                             Key={'pk': {'S': 'aggregate'}, 'sk': {'S': json_dumps([report['product'], report['mode']])}},
+                             UpdateExpression=update, ExpressionAttributeNames=names, ExpressionAttributeValues=values)
+
+    def get(self, report_id):
+        item = self.ddb.get_item(TableName=self.table,
+                                 Key={'pk': {'S': f'report#{report_id}'}, 'sk': {'S': 'report'}}).get('Item')
+        return json_loads(item['record']['S']) if item else None
+
+    def query(self, index, value, limit, cursor):
+        partition = f'{index}#{value}'
+        kwargs = {'TableName': self.table, 'KeyConditionExpression': 'pk = :pk',
+                  'ExpressionAttributeValues': {':pk': {'S': partition}}, 'ScanIndexForward': False, 'Limit': limit}
+        if cursor:
+            if cursor[0] != partition or not isinstance(cursor[1], str):
+                raise RequestError('Invalid cursor')
+            kwargs['ExclusiveStartKey'] = {'pk': {'S': cursor[0]}, 'sk': {'S': cursor[1]}}
+        response = self.ddb.query(**kwargs)
+        last = response.get('LastEvaluatedKey')
+        return ([json_loads(item['entry']['S']) for item in response['Items']],
+                [last['pk']['S'], last['sk']['S']] if last else None)
+
+    def aggregates(self, product=None, mode=None):
+        rows, kwargs = [], {'TableName': self.table, 'KeyConditionExpression': 'pk = :pk',
+                            'ExpressionAttributeValues': {':pk': {'S': 'aggregate'}}}
+        while True:
+            response = self.ddb.query(**kwargs)
+            for item in response['Items']:
+                item_product, item_mode = item['product']['S'], item['mode']['S']
+                if (product and item_product != product) or (mode and item_mode != mode):
+                    continue
+                reports = int(item['reports']['N'])
+                graded = {name[len('grade#'):]: int(value['N']) for name, value in item.items()
+                          if name.startswith('grade#')}
+                # Scores ride on the ungraded row; grade counts carry no score of their own
+                rows.append((item_product, item_mode, '', reports - sum(graded.values()),
+                             int(item.get('scored', {'N': '0'})['N']), float(item.get('score_sum', {'N': '0'})['N'])))
+                rows += [(item_product, item_mode, grade, count, 0, 0.0) for grade, count in graded.items()]
+            if 'LastEvaluatedKey' not in response:
+                return summarize_aggregates(rows)
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+_report_store = None
+
+
+def get_report_store():
+    """Build the configured report store on first use (REPORT_STORE); None = archive off."""
+    global _report_store
+    if _report_store is None and REPORT_STORE:
+        if REPORT_STORE.startswith('dynamodb://'):
+            _report_store = DynamoReportStore(REPORT_STORE[len('dynamodb://'):])
+        else:
+            _, _, path = REPORT_STORE.partition(':')
+            _report_store = SQLiteReportStore(path or '/tmp/reports.db')
+    return _report_store
+
+
+# =============================================================================
+# ADMISSION CONTROL (token buckets in front of Bedrock)
+# =============================================================================
+
+# Priority class per analysis mode; unlisted modes are 'standard'
+MODE_PRIORITY = {
+    'per_problem': 'interactive',
+    'multi_problem': 'interactive',
+    'synthesis': 'interactive',
+    'full': 'interactive',
+    'full_draft': 'interactive',
+    'knowledge_check': 'standard',
+    'general': 'standard',
+    'training_summary': 'background',
+    'warmup': 'background',
+}
+
+# reserve: share of the global quota a class must leave untouched (kept for higher classes)
+# max_wait_s: how long a request may queue for capacity before it is shed
+PRIORITY_CLASSES = {
+    'interactive': {'reserve': 0.0, 'max_wait_s': 3.0},
+    'standard': {'reserve': 0.15, 'max_wait_s': 1.0},
+    'background': {'reserve': 0.4, 'max_wait_s': 0.0},
+}
+
+
+class AdmissionRejected(Exception):
+    """Raised when a Bedrock call cannot be admitted; mapped to 429 with Retry-After."""
+
+    def __init__(self, retry_after):
+        super().__init__(f'Rate limited, retry after {retry_after:.1f}s')
+        self.retry_after = retry_after
+
+
+def estimate_input_tokens(system_prompt, user_prompt):
+    """Rough input token count (~4 characters per token) for admission before the call."""
+    return (len(system_prompt) + len(user_prompt)) // 4
+
+
+def admission_demands(mode, tenant, tokens, reserve):
+    """Bucket demands for one call: (bucket_id, limit_per_min, cost, floor) per limited scope.
+
+    The global buckets (account quota) apply the priority class's reserve; mode and
+    tenant buckets apply only when configured in ADMISSION_LIMITS. Costs are capped
+    so that a full bucket can always admit the request.
+    """
+    scopes = [('global', {'rpm': BEDROCK_RPM, 'tpm': BEDROCK_TPM}, reserve)]
+    for scope in (f'mode:{mode}', f'tenant:{tenant}'):
+        if scope in ADMISSION_LIMITS:
+            scopes.append((scope, ADMISSION_LIMITS[scope], 0.0))
+
+    demands = []
+    for scope, limits, scope_reserve in scopes:
+        for unit, cost in (('rpm', 1), ('tpm', tokens)):
+            limit = limits.get(unit)
+            if limit:
+                floor = scope_reserve * limit
+                demands.append((f'{scope}#{unit}', limit, min(cost, limit - floor), floor))
+    return demands
+
+
+def admit(estimated_tokens):
+    """Take capacity for one Bedrock call, waiting up to the class budget; returns a ticket.
+
+    Returns None when admission control is off. Raises AdmissionRejected as soon as
+    the required wait is known to exceed the budget, instead of queueing a doomed call.
+    """
+    store = get_admission_store()
+    if store is None:
+        return None
+
+    mode = current_mode.get()
+    priority = MODE_PRIORITY.get(mode, 'standard')
+    cls = PRIORITY_CLASSES[priority]
+    demands = admission_demands(mode, current_tenant.get(), estimated_tokens, cls['reserve'])
+    deadline = time.time() + cls['max_wait_s']
+    while True:
+        now = time.time()
+        wait = store.acquire(demands, now)
+        if wait <= 0:
+            return demands
+        if now + wait > deadline:
+            print(f'Admission: shed {mode} ({priority}, tenant {current_tenant.get()}), retry after {wait:.1f}s')
+            note_throttled()
+            raise AdmissionRejected(wait)
+        time.sleep(wait)
+
+
+def settle(ticket, actual_tokens):
+    """Return the unused part of the token estimate (or charge the overrun) after a call.
+
+    Never raises: it also runs while a failed call's own error propagates, and a
+    bucket that cannot be corrected must not hide that error (or fail a good answer).
+    """
+    if ticket is None:
+        return
+    store = get_admission_store()
+    now = time.time()
+    for bucket, limit, cost, _ in ticket:
+        if bucket.endswith('#tpm') and cost != actual_tokens:
+            try:
+                store.adjust(bucket, limit, cost - actual_tokens, now)
+            except Exception as e:
+                print(f'Admission: settle {bucket} failed: {e}')
+
+
+def report_throttled(ticket, error):
+    """Bedrock throttled an admitted call: our quota view is optimistic, so empty the global
+    buckets (later calls queue or shed instead of hitting Bedrock) and hint a retry delay."""
+    if ticket is None:
+        return
+    store = get_admission_store()
+    now = time.time()
+    for bucket, _, _, _ in ticket:
+        if bucket.startswith('global#'):
+            try:
+                store.drain(bucket, now)
+            except Exception as e:
+                print(f'Admission: drain {bucket} failed: {e}')
+    retry_after = max(cost * 60.0 / limit for bucket, limit, cost, _ in ticket if bucket.startswith('global#'))
+    raise AdmissionRejected(max(retry_after, 1.0)) from error
+
+
+def _bucket_level(state, limit, now):
+    """Tokens in a bucket of `limit` per minute (burst = one minute) given its stored state."""
+    if state is None:
+        return float(limit)
+    level, updated_at = state[0], state[1]
+    return min(float(limit), level + (now - updated_at) * limit / 60.0)
+
+
+def _shortfall_wait(levels, demands):
+    """Seconds until every bucket can cover its cost above its floor (0 = admit now)."""
+    wait = 0.0
+    for level, (_, limit, cost, floor) in zip(levels, demands):
+        short = cost + floor - level
+        if short > 0:
+            wait = max(wait, short * 60.0 / limit)
+    return wait
+
+
+class LocalBucketStore:
+    """Token buckets in process memory; shared only by requests in one container/process."""
+
+    def __init__(self):
+        self._state = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, demands, now):
+        """Take every demand or none; returns 0 on success, else seconds to wait."""
+        with self._lock:
+            levels = [_bucket_level(self._state.get(d[0]), d[1], now) for d in demands]
+            wait = _shortfall_wait(levels, demands)
+            if wait == 0:
+                for level, (bucket, _, cost, _) in zip(levels, demands):
+                    self._state[bucket] = (level - cost, now)
+            return wait
+
+    def adjust(self, bucket, limit, delta, now):
+        with self._lock:
+            level = _bucket_level(self._state.get(bucket), limit, now)
+            self._state[bucket] = (min(float(limit), level + delta), now)
+
+    def drain(self, bucket, now):
+        with self._lock:
+            level = self._state.get(bucket, (0.0, now))[0]
+            self._state[bucket] = (min(level, 0.0), now)
+
+
+class DynamoBucketStore:
+    """Token buckets in a DynamoDB table (partition key "bucket_id"), shared by all containers.
+
+    Takes are optimistic: read the buckets, then write all of them in one transaction
+    conditioned on their timestamps and levels being unchanged; retried on contention.
+    Needs dynamodb:BatchGetItem, TransactWriteItems and UpdateItem on the table.
+    """
+
+    MAX_ATTEMPTS = 4
+
+    def __init__(self, table):
+        self.table = table
+        self.ddb = boto3.client('dynamodb')
+
+    def _read(self, buckets):
+        response = self.ddb.batch_get_item(RequestItems={self.table: {
+            'Keys': [{'bucket_id': {'S': b}} for b in buckets], 'ConsistentRead': True}})
+        return {item['bucket_id']['S']: (float(item['tokens']['N']), float(item['updated_at']['N']),
+                                         item['updated_at']['N'], item['tokens']['N'])
+                for item in response['Responses'].get(self.table, [])}
+
+    def _put(self, bucket, level, now, prev):
+        put = {'TableName': self.table,
+               'Item': {'bucket_id': {'S': bucket}, 'tokens': {'N': repr(level)}, 'updated_at': {'N': repr(now)}}}
+        if prev is None:
+            put['ConditionExpression'] = 'attribute_not_exists(bucket_id)'
+        else:
+            # tokens too: adjust() ADDs to it without touching updated_at
+            put['ConditionExpression'] = '#u = :u AND #t = :t'
+            put['ExpressionAttributeNames'] = {'#u': 'updated_at', '#t': 'tokens'}
+            put['ExpressionAttributeValues'] = {':u': {'N': prev[2]}, ':t': {'N': prev[3]}}
+        return {'Put': put}
+
+    def acquire(self, demands, now):
+        wait = 0.0
+        for _ in range(self.MAX_ATTEMPTS):
+            state = self._read([d[0] for d in demands])
+            levels = [_bucket_level(state.get(d[0]), d[1], now) for d in demands]
+            wait = _shortfall_wait(levels, demands)
+            if wait > 0:
+                return wait
+            try:
+                self.ddb.transact_write_items(TransactItems=[
+                    self._put(bucket, level - cost, now, state.get(bucket))
+                    for level, (bucket, _, cost, _) in zip(levels, demands)])
+                return 0.0
+            except self.ddb.exceptions.TransactionCanceledException:
+                now = time.time()
+        return 0.5  # persistent contention: treat as briefly full
+
+    def adjust(self, bucket, limit, delta, now):
+        # Unclamped; _bucket_level caps the level at the limit on the next read
+        self.ddb.update_item(
+            TableName=self.table, Key={'bucket_id': {'S': bucket}},
+            UpdateExpression='ADD #t :d', ConditionExpression='attribute_exists(bucket_id)',
+            ExpressionAttributeNames={'#t': 'tokens'}, ExpressionAttributeValues={':d': {'N': repr(delta)}})
+
+    def drain(self, bucket, now):
+        self.ddb.update_item(
+            TableName=self.table, Key={'bucket_id': {'S': bucket}},
+            UpdateExpression='SET #t = :z, #u = :now',
+            ExpressionAttributeNames={'#t': 'tokens', '#u': 'updated_at'},
+            ExpressionAttributeValues={':z': {'N': '0'}, ':now': {'N': repr(now)}})
+
+
+_admission_store = None
+
+
+def get_admission_store():
+    """Build the configured bucket store on first use (ADMISSION_STORE); None = admission off."""
+    global _admission_store
+    if _admission_store is None and ADMISSION_STORE:
+        if ADMISSION_STORE.startswith('dynamodb://'):
+            _admission_store = DynamoBucketStore(ADMISSION_STORE[len('dynamodb://'):])
+        else:
+            _admission_store = LocalBucketStore()
+    return _admission_store
+
+
+# =============================================================================
+# WARMUP & CONTAINER METRICS
+# =============================================================================
+
+# Small synthetic request that touches every PromptContext field
+WARMUP_BODY = {
+    'transcript': [{'role': 'assistant', 'content': 'Hi'}, {'role': 'user', 'content': 'Hello'}],
+    'dpp': {'mode': 'warmup', 'live_code': {'language': 'python'}, 'all_problems_in_session': []},
+    'problem_focus': {'id': 'warmup'},
+    'problems': [{'id': 'warmup'}],
+    'problem_results': [{}],
+    'questions': ['Warmup?'],
+    'context': 'warmup',
+    'schema': {'type': 'object'},
+}
+WARMUP_REPORT = {'overall_score': 0, 'grade': 'A', 'summary': 'Warmup', 'strong_spots': ['Warmup']}
+
+_container = {'init_at': time.time(), 'invocations': 0, 'primed_at': None, 'state': 'unprimed'}
+
+
+def enter_container():
+    """Count this invocation and classify the container it landed on: cold, primed or unprimed.
+
+    Runs on every request, so it takes no lock: Lambda sends a container one
+    request at a time, and under server.py a lost increment only skews the
+    diagnostic count. handle_warmup flips 'state' once.
+    """
+    _container['invocations'] += 1
+    return 'cold' if _container['invocations'] == 1 else _container['state']
+
+
+def handle_warmup(body, trigger):
+    """Prime this container so the next real request skips client setup and TLS handshakes."""
+    t_start = time.perf_counter()
+    steps = {}
+
+    def step(name, fn):
+        t0 = time.perf_counter()
+        try:
+            status = fn() or 'ok'
+        except Exception as e:
+            status = f'error: {type(e).__name__}'
+        steps[name] = {'status': status, 'ms': _elapsed_ms(t0)}
+
+    step('clients', _warm_clients)
+    step('bedrock_connection', lambda: _open_connection(bedrock, 'list_async_invokes', maxResults=1))
+    step('ses_connection', lambda: _open_connection(ses, 'get_send_quota'))
+    step('templates', _warm_templates)
+    # Public warmup requests cannot buy a model call; only the operator's env default
+    # or the schedule's event detail can
+    if body.get('model_call', WARMUP_MODEL_CALL) if trigger == 'schedule' else WARMUP_MODEL_CALL:
+        step('model_call', _warm_model_call)
+
+    _container['primed_at'] = time.time()
+    _container['state'] = 'primed'
+    total_ms = _elapsed_ms(t_start)
+    emit_metrics({'WarmupMs': total_ms}, {'Trigger': trigger, 'ContainerState': current_container.get()})
+
+    return {
+        'statusCode': 200,
+        'headers': CORS_HEADERS,
+        'body': json_dumps({'success': True, 'warmup': {
+            'container': current_container.get(),
+            'invocations': _container['invocations'],
+            'container_age_s': round(time.time() - _container['init_at'], 1),
+            'total_ms': total_ms,
+            'steps': steps,
+        }})
+    }
+
+
+def _warm_clients():
+    get_content_store()
+    get_result_store()
+    get_report_store()
+    get_output_stats_store()
+    get_admission_store()
+    get_problem_pool()
+    if os.environ.get('AWS_LAMBDA_FUNCTION_NAME'):
+        get_lambda_client()
+
+
+def _open_connection(client, operation, **kwargs):
+    """Make a cheap call so the client resolves its endpoint and pools a TLS connection."""
+    call = getattr(client, operation, None)
+    if call is None:
+        return 'unavailable'  # stub client or an SDK without the operation
+    try:
+        call(**kwargs)
+    except ClientError as e:
+        # Denied or invalid still means a signed round trip over a pooled connection
+        return f"ok ({e.response.get('Error', {}).get('Code', 'ClientError')})"
+    return 'ok'
+
+
+def _warm_templates():
+    for template in PROMPT_TEMPLATES.values():
+        template.render(PromptContext(WARMUP_BODY))
+    build_report_email_html(WARMUP_REPORT, 'Warmup')
+    json_loads(json_dumps(WARMUP_BODY))
+    return f'{len(PROMPT_TEMPLATES)} templates'
+
+
+def _warm_model_call():
+    # Admitted in the background class (MODE_PRIORITY['warmup']): never queues, and
+    # leaves the reserve to real requests, so a burst of scheduled warmups cannot drain it
+    try:
+        invoke_admitted('ping', '', 1)
+    except AdmissionRejected:
+        return 'shed'
+
+
+def emit_request_metrics(response, latency_ms):
+    if not EMIT_METRICS:
+        return
+    metrics = {'LatencyMs': latency_ms, 'Requests': 1}
+    primed_at = _container['primed_at']
+    if primed_at:
+        metrics['SincePrimeS'] = round(time.time() - primed_at, 1)
+    emit_metrics(metrics, {'Mode': current_mode.get(), 'ContainerState': current_container.get()},
+                 status_code=response.get('statusCode', 200))
+
+
+def emit_metrics(metrics, dimensions, **properties):
+    """Print one CloudWatch Embedded Metric Format record (no API call; Lambda ships the log line).
+
+    `properties` are logged alongside for Logs Insights but are not dimensions.
+    """
+    if not EMIT_METRICS:
+        return
+    print(json_dumps({
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [list(dimensions)],
+                'Metrics': [{'Name': name, 'Unit': _metric_unit(name)} for name in metrics],
+            }],
+        },
+        **dimensions,
+        **properties,
+        **metrics,
+    }))
+
+
+def _metric_unit(name):
+    if name.endswith('Ms'):
+        return 'Milliseconds'
+    if name.endswith('S'):
+        return 'Seconds'
+    return 'Count'
+
+
+# =============================================================================
+# TRAFFIC RECORDING (record side of traffic_replay.py)
+# =============================================================================
+
+_traffic_lock = threading.Lock()
+
+
+def request_hash(*parts):
+    """Stable short hash identifying a recorded request (shared with traffic_replay.py)."""
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()[:24]
+
+
+def record_traffic(entry):
+    """Append one entry to the traffic log; recording must never fail a request."""
+    entry['ts'] = round(time.time(), 3)
+    line = json.dumps(entry, separators=(',', ':')) + '\n'
+    opener = gzip.open if TRAFFIC_LOG_PATH.endswith('.gz') else open
+    try:
+        with _traffic_lock, opener(TRAFFIC_LOG_PATH, 'at', encoding='utf-8') as f:
+            f.write(line)
+    except OSError as e:
+        print(f'Traffic log write failed: {e}')
+
+
+def _elapsed_ms(t0):
+    return round((time.perf_counter() - t0) * 1000, 1)
+
+
+# =============================================================================
+# JSON SERIALIZATION
+# =============================================================================
+
+def json_loads(data):
+    return orjson.loads(data) if orjson else json.loads(data)
+
+
+def json_dumps(obj):
+    if orjson:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+
+
+def splice_field(raw, key, value):
+    """Append one key to already-valid JSON object text without re-encoding it."""
+    head = raw.rstrip()[:-1].rstrip()
+    sep = '' if head.endswith('{') else ','
+    return f'{head}{sep}{json_dumps(key)}:{json_dumps(value)}}}'
+
+
+def success_response(data, usage, raw=None, **extra):
+    """Build the success envelope; `extra` adds top-level fields after "usage".
+
+    When `raw` (the model's JSON text, already validated by parse_bedrock_response
+    and matching `data`) is given, it is spliced into the envelope as-is instead
+    of re-encoding `data`.
+    """
+    current_result.set((data, usage))
+    if raw is None:
+        body = json_dumps({'success': True, 'summary': data, 'usage': usage, **extra})
+    else:
+        body = f'{{"success":true,"summary":{raw},"usage":{json_dumps(usage)}'
+        if extra:
+            body += ''.join(f',{json_dumps(key)}:{json_dumps(value)}' for key, value in extra.items())
+        body += '}'
+    return {
+        'statusCode': 200,
+        'headers': CORS_HEADERS,
+        'body': body
+    }
+
+
+def error_response(message, code, status_code=400, retry_after=None):
+    if retry_after is None:
+        return {
+            'statusCode': status_code,
+            'headers': CORS_HEADERS,
+            'body': json_dumps({'success': False, 'error': message, 'code': code})
+        }
+    return {
+        'statusCode': status_code,
+        'headers': {**CORS_HEADERS, 'Retry-After': str(max(1, math.ceil(retry_after)))},
+        'body': json_dumps({'success': False, 'error': message, 'code': code,
+                            'retry_after': round(retry_after, 1)})
     }
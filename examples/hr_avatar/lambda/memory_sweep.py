@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Memory-size sweep: right-size the analysis Lambda's memory setting.
+
+Lambda allocates CPU in proportion to memory (1769 MB = one full vCPU), so the
+memory setting decides how fast init (boto3 import + client creation) and the
+Python-side work around each model call (JSON handling, prompt building, HTML
+rendering) run.  This tool emulates each memory tier locally: every tier runs
+in a fresh child process pinned to one CPU and throttled to that tier's CPU
+share, then measures
+
+    init      import of lambda_function (boto3 + client creation), ms
+    peak RSS  child's max resident set size after all cases, MB
+    overhead  mean in-Lambda time per mode, stubbed Bedrock/SES (regression cases);
+              the mean, not the median, because a short call often fits in one
+              unthrottled slice and the stalls land on a few calls
+
+and prices each tier: billed duration = model latency (unchanged by memory)
++ in-Lambda overhead + init × cold-start rate, weighted by the request mix.
+
+Throttling:
+    cgroup   cgroup v2 cpu.max on a child cgroup (needs a writable /sys/fs/cgroup)
+    signal   SIGSTOP/SIGCONT duty cycle from the parent (works anywhere on POSIX)
+    auto     cgroup when available, else signal (default)
+
+Usage:
+    python3 memory_sweep.py                              # default tiers, equal mode mix
+    python3 memory_sweep.py --tiers 128,256,512,1024
+    python3 memory_sweep.py --mix per_problem=4,synthesis=1 --iterations 30
+    python3 memory_sweep.py --traffic traffic.jsonl.gz   # model latencies from a recorded log
+    python3 memory_sweep.py --cold-rate 0.2              # spiky traffic: more cold starts
+    python3 memory_sweep.py --json sweep.json
+"""
+
+import argparse
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+
+LAMBDA_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_TIERS = [128, 256, 512, 1024, 1769, 3008]
+CURRENT_TIER = 256                      # deploy.sh MEMORY_SIZE default
+FULL_VCPU_MB = 1769                     # Lambda: one full vCPU at 1769 MB
+DEFAULT_ITERATIONS = 15
+DUTY_PERIOD_S = 0.02                    # signal throttling period
+CGROUP_PERIOD_US = 20000
+RSS_HEADROOM = 0.7                      # peak RSS must stay under 70% of the tier
+DEFAULT_COLD_RATE = 0.05                # share of requests that hit a cold container
+DEFAULT_MAX_ADDED_MS = 100.0            # expected latency allowed above the fastest tier
+DEFAULT_MAX_INIT_MS = 1500.0            # worst cold start we accept
+
+# Pricing (us-east-1, x86): per GB-second and per request
+PRICE_GB_S = 0.0000166667
+PRICE_REQUEST = 0.20 / 1_000_000
+
+# Typical model/SES latency per mode (s) when no traffic log is given (see lambda_function docstring)
+MODEL_LATENCY_S = {
+    "per_problem": 5.0, "synthesis": 8.0, "knowledge_check": 8.0, "general": 8.0,
+    "training_summary": 5.0, "full": 10.0, "send_report_email": 0.3,
+}
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Child: measure one tier (runs throttled)
+# ─────────────────────────────────────────────────────────────────────────────
+
+def worker(iterations):
+    """Runs in the throttled child. Waits for "go" on stdin, prints a JSON result."""
+    sys.stdin.readline()
+    import resource
+
+    sys.path.insert(0, LAMBDA_DIR)
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-west-2")
+    t0 = time.perf_counter()
+    import lambda_function as lf
+    init_ms = (time.perf_counter() - t0) * 1000
+
+    from bedrock_stub import stub_clients, installed
+    from regression import build_cases, invoke
+
+    overhead = {}
+    bedrock, ses = stub_clients(lf)
+    with installed(lf, bedrock, ses):
+        for case in build_cases():
+            event = {"body": json.dumps(case["payload"])}
+            invoke(event, bedrock, ses)                     # warm-up
+            samples = [invoke(event, bedrock, ses)[1]["total_us"] for _ in range(iterations)]
+            overhead.setdefault(case["mode"], []).append(statistics.mean(samples))
+
+    json.dump({
+        "init_ms": init_ms,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "overhead_ms": {mode: statistics.mean(v) / 1000 for mode, v in overhead.items()},
+    }, sys.stdout)
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Parent: throttle and collect
+# ─────────────────────────────────────────────────────────────────────────────
+
+def cpu_share(memory_mb):
+    """vCPU share Lambda gives a function of this size (single-threaded work caps at 1)."""
+    return min(1.0, memory_mb / FULL_VCPU_MB)
+
+
+def pin_to_one_cpu():
+    """preexec_fn: taskset-style pinning so a multi-core host can't exceed one vCPU."""
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {min(os.sched_getaffinity(0))})
+
+
+def cgroup_available():
+    root = "/sys/fs/cgroup"
+    try:
+        with open(os.path.join(root, "cgroup.controllers")) as f:
+            return "cpu" in f.read().split() and os.access(root, os.W_OK)
+    except OSError:
+        return False
+
+
+def cgroup_limit(pid, share):
+    """Move pid into a new cgroup v2 group limited to `share` of a CPU. Returns its path."""
+    path = os.path.join("/sys/fs/cgroup", f"memory-sweep-{pid}")
+    os.mkdir(path)
+    with open(os.path.join(path, "cpu.max"), "w") as f:
+        f.write(f"{max(1000, int(share * CGROUP_PERIOD_US))} {CGROUP_PERIOD_US}")
+    with open(os.path.join(path, "cgroup.procs"), "w") as f:
+        f.write(str(pid))
+    return path
+
+
+def duty_cycle(proc, share):
+    """SIGCONT/SIGSTOP the child so it runs `share` of every period, until it exits."""
+    run_s, stop_s = share * DUTY_PERIOD_S, (1 - share) * DUTY_PERIOD_S
+    try:
+        while proc.poll() is None:
+            time.sleep(run_s)
+            os.kill(proc.pid, signal.SIGSTOP)
+            time.sleep(stop_s)
+            os.kill(proc.pid, signal.SIGCONT)
+    except ProcessLookupError:
+        pass
+
+
+def run_tier(memory_mb, iterations, throttle):
+    share = cpu_share(memory_mb)
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--worker", str(iterations)],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+                            preexec_fn=pin_to_one_cpu)
+    cgroup = cgroup_limit(proc.pid, share) if throttle == "cgroup" and share < 1 else None
+    proc.stdin.write("go\n")
+    proc.stdin.flush()
+    try:
+        if throttle == "signal" and share < 1:
+            duty_cycle(proc, share)
+        out, _ = proc.communicate()
+    finally:
+        if cgroup:
+            os.rmdir(cgroup)
+    if proc.returncode != 0:
+        raise RuntimeError(f"{memory_mb} MB worker failed (exit {proc.returncode})")
+    return dict(json.loads(out), memory_mb=memory_mb, cpu_share=share)
+
+
+def model_latencies(traffic_path):
+    """Per-mode model latency (s): p50 from a recorded traffic log, else MODEL_LATENCY_S."""
+    latencies = dict(MODEL_LATENCY_S)
+    if traffic_path:
+        sys.path.insert(0, LAMBDA_DIR)
+        os.environ.setdefault("AWS_DEFAULT_REGION", "us-west-2")
+        from traffic_replay import load_traffic_log, summarize
+        for row in summarize(load_traffic_log(traffic_path)):
+            mode = "send_report_email" if row["kind"] == "ses" else row["mode"]
+            latencies[mode] = row["p50_ms"] / 1000
+    return latencies
+
+
+def price(tier, mix, latencies, cold_rate):
+    """Mix-weighted expected in-Lambda latency (ms, incl. amortized init) and cost per 1000 requests."""
+    total = sum(mix.values())
+    overhead_ms = sum(w * tier["overhead_ms"].get(m, 0.0) for m, w in mix.items()) / total
+    expected_ms = overhead_ms + cold_rate * tier["init_ms"]
+    model_s = sum(w * latencies.get(m, 0.0) for m, w in mix.items()) / total
+    billed_s = model_s + expected_ms / 1000
+    cost = (billed_s * tier["memory_mb"] / 1024 * PRICE_GB_S + PRICE_REQUEST) * 1000
+    return expected_ms, cost
+
+
+def recommend(tiers, max_added_ms, max_init_ms):
+    """Cheapest tier with RSS headroom, expected latency near the fastest tier's and bounded init."""
+    fastest = min(t["expected_ms"] for t in tiers)
+    for t in tiers:
+        t["fits"] = t["peak_rss_mb"] <= t["memory_mb"] * RSS_HEADROOM
+        t["ok"] = (t["fits"] and t["expected_ms"] - fastest <= max_added_ms
+                   and t["init_ms"] <= max_init_ms)
+    candidates = [t for t in tiers if t["ok"]]
+    return min(candidates, key=lambda t: t["cost_per_1k"]) if candidates else None
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Report
+# ─────────────────────────────────────────────────────────────────────────────
+
+def print_report(tiers, modes, best, throttle, max_init_ms):
+    W = 30 + 10 * len(modes) + 26
+    print("\n" + "=" * W)
+    print(f"  MEMORY SWEEP — throttle: {throttle}; per mode: mean in-Lambda ms (stubbed model)")
+    print("=" * W)
+    print(f"  {'Memory':>7} {'CPU':>5} {'Init ms':>8} {'RSS MB':>7}" + "".join(f" {m[:9]:>9}" for m in modes)
+          + f" {'Exp ms':>8} {'$/1k req':>9}  ")
+    print("-" * W)
+    for t in tiers:
+        note = ("◀ recommended" if t is best else "RSS too close" if not t["fits"]
+                else "slow init" if t["init_ms"] > max_init_ms else "")
+        if t["memory_mb"] == CURRENT_TIER:
+            note = f"{note} (current)".strip()
+        print(f"  {t['memory_mb']:>5}MB {t['cpu_share']:>5.2f} {t['init_ms']:>8.0f} {t['peak_rss_mb']:>7.0f}"
+              + "".join(f" {t['overhead_ms'].get(m, 0):>9.2f}" for m in modes)
+              + f" {t['expected_ms']:>8.1f} {t['cost_per_1k']:>9.4f}  {note}")
+    print("=" * W)
+    if best:
+        print(f"  Recommended: --memory-size {best['memory_mb']}  "
+              f"(${best['cost_per_1k']:.4f}/1k requests, init {best['init_ms']:.0f} ms, "
+              f"expected in-Lambda {best['expected_ms']:.1f} ms/request)")
+    else:
+        print("  No tier met the constraints; raise --max-added-ms / --max-init-ms or add larger tiers.")
+    print("  Exp ms = mix-weighted overhead + cold-start rate × init. Cost is dominated by time spent")
+    print("  waiting on the model, which memory does not shorten.\n")
+
+
+def parse_mix(text):
+    mix = {}
+    for part in filter(None, text.split(",")):
+        mode, _, weight = part.partition("=")
+        mix[mode.strip()] = float(weight or 1)
+    return mix
+
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == "--worker":
+        worker(int(sys.argv[2]))
+        return
+
+    parser = argparse.ArgumentParser(description="Lambda memory-size vs latency/cost sweep")
+    parser.add_argument("--tiers", default=",".join(map(str, DEFAULT_TIERS)), help="Memory sizes in MB")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS, help="Runs per regression case")
+    parser.add_argument("--mix", default="", help="Request mix, e.g. per_problem=4,synthesis=1 (default: equal)")
+    parser.add_argument("--traffic", metavar="LOG", help="Take per-mode model latency from a recorded traffic log")
+    parser.add_argument("--cold-rate", type=float, default=DEFAULT_COLD_RATE,
+                        help="Share of requests that pay init (cold starts)")
+    parser.add_argument("--throttle", choices=["auto", "cgroup", "signal"], default="auto")
+    parser.add_argument("--max-added-ms", type=float, default=DEFAULT_MAX_ADDED_MS,
+                        help="Expected latency allowed above the fastest tier")
+    parser.add_argument("--max-init-ms", type=float, default=DEFAULT_MAX_INIT_MS, help="Max acceptable init time")
+    parser.add_argument("--json", metavar="PATH", help="Also write raw results as JSON")
+    args = parser.parse_args()
+
+    throttle = args.throttle
+    if throttle == "auto":
+        throttle = "cgroup" if cgroup_available() else "signal"
+    tiers_mb = sorted(int(t) for t in args.tiers.split(","))
+    latencies = model_latencies(args.traffic)
+
+    print(f"\nMemory sweep config:")
+    print(f"  Tiers:      {', '.join(f'{t} MB' for t in tiers_mb)}")
+    print(f"  Throttle:   {throttle} (pinned to one CPU)")
+    print(f"  Iterations: {args.iterations} per case")
+    print(f"  Model:      {'p50 from ' + args.traffic if args.traffic else 'typical latencies (MODEL_LATENCY_S)'}")
+    print(f"  Cold rate:  {args.cold_rate:.0%} of requests")
+
+    tiers = []
+    for memory_mb in tiers_mb:
+        print(f"\rMeasuring {memory_mb} MB (CPU share {cpu_share(memory_mb):.2f})...", end="", flush=True)
+        tiers.append(run_tier(memory_mb, args.iterations, throttle))
+    print()
+
+    modes = sorted({m for t in tiers for m in t["overhead_ms"]})
+    mix = parse_mix(args.mix) or {m: 1.0 for m in modes}
+    for t in tiers:
+        t["expected_ms"], t["cost_per_1k"] = price(t, mix, latencies, args.cold_rate)
+    best = recommend(tiers, args.max_added_ms, args.max_init_ms)
+    print_report(tiers, modes, best, throttle, args.max_init_ms)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"throttle": throttle, "mix": mix, "model_latency_s": latencies, "cold_rate": args.cold_rate,
+                       "recommended_mb": best["memory_mb"] if best else None, "tiers": tiers}, f, indent=2)
+        print(f"  Raw results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the Python-side hot paths of lambda_function.
+
+Each suite compares the current implementation against a reference copy of the
+previous one, per analysis mode, reporting time per operation, throughput of
+the produced bytes, and peak memory allocated per operation (tracemalloc).
+
+Suites:
+    serialization   Bedrock response body → validated model JSON → response envelope
+                    (legacy: decode + re-encode the summary; current: splice the
+                    validated model text, orjson when available)
+    prompt          prompt assembly for a large session: every model call of one
+                    analysis (per_problem × N + synthesis, full, knowledge_check,
+                    general, training_summary) (legacy: per-handler f-strings;
+                    current: compiled templates + PromptContext, inline content
+                    and content refs on a warm container)
+
+Usage:
+    python3 microbench.py                     # all suites
+    python3 microbench.py serialization       # one suite
+    python3 microbench.py prompt --scale 40   # prompt suite with a 40x transcript
+    python3 microbench.py --repeat 2000       # more iterations per measurement
+    python3 microbench.py --stdlib            # force the stdlib json fallback
+"""
+
+import argparse
+import gc
+import hashlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+LAMBDA_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, LAMBDA_DIR)
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+
+import lambda_function as lf  # noqa: E402
+from bedrock_stub import load_recorded_responses  # noqa: E402
+from benchmark import DPP, PROBLEMS, TRANSCRIPT  # noqa: E402
+from regression import FINAL_CODE, build_cases  # noqa: E402
+
+DEFAULT_REPEAT = 1000
+DEFAULT_SCALE = 20          # prompt suite: transcript = benchmark TRANSCRIPT × scale
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Measurement helpers
+# ─────────────────────────────────────────────────────────────────────────────
+
+def time_per_op(fn, repeat):
+    """Best-of-5 mean seconds per call of fn()."""
+    best = float("inf")
+    for _ in range(5):
+        gc.collect()
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        best = min(best, (time.perf_counter() - t0) / repeat)
+    return best
+
+
+def peak_alloc_per_op(fn):
+    """Peak bytes allocated by one call of fn() (tracemalloc)."""
+    fn()
+    gc.collect()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base, _ = tracemalloc.get_traced_memory()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak - base
+
+
+def measure(fn, out_bytes, repeat):
+    seconds = time_per_op(fn, repeat)
+    return {"us": seconds * 1e6, "mb_s": out_bytes / seconds / 1e6, "peak_kb": peak_alloc_per_op(fn) / 1024}
+
+
+def print_table(title, rows):
+    W = 96
+    print("\n" + "=" * W)
+    print(f"  {title}")
+    print("=" * W)
+    print(f"  {'Case':<26} {'Bytes':>8} │ {'legacy µs':>9} {'MB/s':>7} {'peak KB':>8} │ "
+          f"{'current µs':>10} {'MB/s':>7} {'peak KB':>8} │ {'speedup':>7}")
+    print("-" * W)
+    for r in rows:
+        old, new = r["legacy"], r["current"]
+        print(f"  {r['name']:<26} {r['bytes']:>8} │ {old['us']:>9.1f} {old['mb_s']:>7.1f} {old['peak_kb']:>8.1f} │ "
+              f"{new['us']:>10.1f} {new['mb_s']:>7.1f} {new['peak_kb']:>8.1f} │ {old['us'] / new['us']:>6.2f}x")
+    print("=" * W)
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Suite: serialization
+# ─────────────────────────────────────────────────────────────────────────────
+
+def bedrock_body(recorded):
+    """Raw Bedrock response bytes for a recorded response (same shape as the stub)."""
+    return json.dumps({
+        "id": "msg_bench", "type": "message", "role": "assistant",
+        "content": [{"type": "text", "text": json.dumps(recorded["content"], indent=2)}],
+        "stop_reason": "end_turn", "usage": recorded["usage"],
+    }).encode()
+
+
+def legacy_serialize(raw, final_code=None):
+    """Reference copy of the pre-splice path: decode twice, re-encode the summary."""
+    response_body = json.loads(raw)
+    content = response_body.get("content", [{}])[0].get("text", "{}").strip()
+    summary = json.loads(content)
+    usage = {"input_tokens": response_body.get("usage", {}).get("input_tokens", 0),
+             "output_tokens": response_body.get("usage", {}).get("output_tokens", 0)}
+    if final_code and "final_code" not in summary:
+        summary["final_code"] = final_code
+    return json.dumps({"success": True, "summary": summary, "usage": usage})
+
+
+def current_serialize(raw, final_code=None):
+    summary, usage, content = lf.parse_bedrock_response(raw)
+    if final_code and "final_code" not in summary:
+        summary["final_code"] = final_code
+        content = lf.splice_field(content, "final_code", final_code)
+    return lf.success_response(summary, usage, content)["body"]
+
+
+def serialization_cases():
+    recorded = load_recorded_responses()
+    cases = [("per_problem", recorded["per_problem"]["two-sum"], None)]
+    for mode in ("synthesis", "knowledge_check", "general", "training_summary", "full"):
+        cases.append((mode, recorded[mode], None))
+    cases.append(("full+final_code", recorded["full"], FINAL_CODE * 20))
+
+    large = json.loads(json.dumps(recorded["full"]))
+    large["content"]["key_answers"] = large["content"]["key_answers"] * 40
+    large["content"]["gaps"] = large["content"]["gaps"] * 40
+    cases.append(("full (large summary)", large, None))
+    return cases
+
+
+def run_serialization(repeat):
+    rows = []
+    for name, recorded, final_code in serialization_cases():
+        raw = bedrock_body(recorded)
+        legacy_out = legacy_serialize(raw, final_code)
+        current_out = current_serialize(raw, final_code)
+        assert json.loads(legacy_out) == json.loads(current_out), f"{name}: outputs differ"
+        rows.append({
+            "name": name,
+            "bytes": len(current_out.encode()),
+            "legacy": measure(lambda: legacy_serialize(raw, final_code), len(legacy_out.encode()), repeat),
+            "current": measure(lambda: current_serialize(raw, final_code), len(current_out.encode()), repeat),
+        })
+    encoder = "orjson" if lf.orjson else "stdlib json"
+    print_table(f"SERIALIZATION — Bedrock body → response envelope (current encoder: {encoder})", rows)
+    return rows
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Suite: prompt
+# ─────────────────────────────────────────────────────────────────────────────
+
+def legacy_format_transcript(transcript):
+    lines = []
+    for i, turn in enumerate(transcript, 1):
+        role = turn.get("role", "unknown")
+        content = turn.get("content", "")
+        speaker = "AI" if role == "assistant" else "Candidate"
+        lines.append(f"[{i}] {speaker}: {content}")
+    return "\n".join(lines)
+
+
+def legacy_prompt(mode, body):
+    """Reference copy of the per-handler prompt f-strings before PromptContext."""
+    transcript = body.get("transcript", [])
+    dpp = body.get("dpp", {})
+    if mode == "per_problem":
+        problem = body["problem_focus"]
+        return (
+            f"Analyze ONLY the problem \"{problem.get('title', problem['id'])}\" "
+            f"(id: {problem['id']}, difficulty: {problem.get('difficulty', '?')}).\n\n"
+            f"## Session Context\n"
+            f"Language: {dpp.get('live_code', dpp.get('session', {})).get('language', 'python') if isinstance(dpp.get('live_code'), dict) else 'python'}\n"
+            f"Session problems: {json.dumps(dpp.get('all_problems_in_session', []), separators=(',', ':'))}\n\n"
+            f"## Transcript\n{legacy_format_transcript(transcript)}\n\n"
+            f"Output the JSON for this ONE problem only."
+        )
+    if mode == "synthesis":
+        problem_results = body["problem_results"]
+        candidate = dpp.get("candidate", {})
+        name = candidate.get("full_name", candidate.get("first_name", "Candidate"))
+        elapsed = dpp.get("session", {}).get("elapsed_minutes", "?")
+        total_problems = dpp.get("session", {}).get("total_problems", len(problem_results))
+        return (
+            f"Candidate: {name}\n"
+            f"Session: {elapsed} minutes, {len(problem_results)} of {total_problems} problems attempted.\n"
+            f"Hints given: {dpp.get('session', {}).get('hints_given', 0)}\n\n"
+            f"## Per-Problem Results\n"
+            f"```json\n{json.dumps(problem_results, separators=(',', ':'))}\n```\n\n"
+            f"Synthesize these results into one overall assessment JSON."
+        )
+    if mode == "knowledge_check":
+        questions = body.get("questions", [])
+        q_block = "\n".join(f"{i+1}. {q}" for i, q in enumerate(questions)) if questions else "Not provided"
+        return (
+            f"Product assessed: {body.get('product', 'AT&T Product')}\n\n"
+            f"Questions asked during the session:\n{q_block}\n\n"
+            f"## Transcript\n{legacy_format_transcript(transcript)}\n\n"
+            f"Analyze this knowledge check and output the JSON report."
+        )
+    if mode == "training_summary":
+        return (
+            f"## Transcript\n{legacy_format_transcript(transcript)}\n\n"
+            f"Write the call summary and output the JSON."
+        )
+    if mode == "general":
+        context = body.get("context", "")
+        return (
+            (f"Session context: {context}\n\n" if context else "") +
+            f"## Transcript\n{legacy_format_transcript(transcript)}\n\n"
+            f"Analyze this sales training session and output the JSON report."
+        )
+    turn_count = len([t for t in transcript if t.get("role") == "user"])
+    dpp_clean = {k: v for k, v in dpp.items() if k != "summary_prompt"}
+    parts = [
+        "Analyze this session and produce a JSON summary.\n",
+        f"## Session Mode\n{dpp_clean.get('mode', 'interview')}\n",
+        f"## Turn Count\n{turn_count} user turns\n",
+        f"## DPP\n```json\n{json.dumps(dpp_clean, separators=(',', ':'))}\n```\n",
+        f"## Transcript\n{legacy_format_transcript(transcript)}\n",
+    ]
+    if body.get("schema"):
+        parts.append(f"## Schema\n```json\n{json.dumps(body['schema'], separators=(',', ':'))}\n```\n")
+    parts.append("\n## Instructions\nFollow the system prompt schema exactly.\n"
+                 "Output ONLY the JSON object, no other text.")
+    return "\n".join(parts)
+
+
+def current_prompt(mode, body):
+    return lf.render_prompt(mode, lf.PromptContext(body))[1]
+
+
+def content_ref(value):
+    return "sha256:" + hashlib.sha256(lf.json_dumps(value).encode("utf-8")).hexdigest()
+
+
+def prompt_sessions(scale):
+    """(name, [(mode, body), ...]) — the prompts one analysis builds, on a scaled-up session."""
+    transcript = TRANSCRIPT * scale
+    dpp = dict(DPP, all_problems_in_session=PROBLEMS * max(1, scale // 4),
+               live_code={"language": "python", "current_code": FINAL_CODE * scale})
+    recorded = load_recorded_responses()
+    pipeline = [("per_problem", {"transcript": transcript, "dpp": dpp, "problem_focus": p}) for p in PROBLEMS]
+    pipeline.append(("synthesis", {"dpp": dpp, "problem_results": [
+        recorded["per_problem"][p["id"]]["content"] for p in PROBLEMS]}))
+    single = [
+        ("full", {"transcript": transcript, "dpp": dpp}),
+        ("knowledge_check", {"transcript": transcript, "product": "AT&T Fiber",
+                             "questions": ["What speeds are offered?", "Is there a contract?"]}),
+        ("general", {"transcript": transcript, "context": "Open coaching session"}),
+        ("training_summary", {"transcript": transcript}),
+    ]
+    refs = {"transcript_ref": content_ref(transcript), "dpp_ref": content_ref(dpp)}
+    with_refs = lambda calls: [(mode, dict(body, **{k: v for k, v in refs.items() if k[:-4] in body}))
+                               for mode, body in calls]
+    sessions = [("per_problem×4 + synthesis", pipeline),
+                ("  … refs (warm)", with_refs(pipeline))]
+    for mode, body in single:
+        sessions.append((mode, [(mode, body)]))
+    sessions.append(("  … full, refs (warm)", with_refs(single[:1])))
+    return sessions
+
+
+def check_prompt_equivalence():
+    """Current templates must reproduce the legacy prompts byte for byte (regression cases)."""
+    for case in build_cases():
+        mode = case["mode"]
+        if mode in lf.PROMPT_TEMPLATES:
+            body = case["payload"]
+            assert legacy_prompt(mode, body) == current_prompt(mode, body), f"{case['name']}: prompts differ"
+
+
+def run_prompt(repeat, scale=DEFAULT_SCALE):
+    check_prompt_equivalence()
+    repeat = max(1, repeat // scale)
+    rows = []
+    for name, calls in prompt_sessions(scale):
+        legacy = lambda: [legacy_prompt(mode, body) for mode, body in calls]
+        current = lambda: [current_prompt(mode, body) for mode, body in calls]
+        legacy_out, current_out = legacy(), current()
+        assert legacy_out == current_out, f"{name}: prompts differ"
+        out_bytes = sum(len(p.encode()) for p in current_out)
+        rows.append({
+            "name": name,
+            "bytes": out_bytes,
+            "legacy": measure(legacy, out_bytes, repeat),
+            "current": measure(current, out_bytes, repeat),
+        })
+    print_table(f"PROMPT ASSEMBLY — all prompts of one analysis (transcript {len(TRANSCRIPT) * scale} turns)", rows)
+    return rows
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Main
+# ─────────────────────────────────────────────────────────────────────────────
+
+SUITES = {
+    "serialization": run_serialization,
+    "prompt": run_prompt,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for lambda_function hot paths")
+    parser.add_argument("suite", nargs="*", help=f"Suites to run: {', '.join(SUITES)} (default: all)")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Iterations per timing sample")
+    parser.add_argument("--stdlib", action="store_true", help="Disable orjson even if installed")
+    parser.add_argument("--scale", type=int, default=DEFAULT_SCALE,
+                        help="prompt suite: transcript size as a multiple of the benchmark transcript")
+    args = parser.parse_args()
+    unknown = set(args.suite) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suite(s): {', '.join(sorted(unknown))}")
+
+    if args.stdlib:
+        lf.orjson = None
+    for name in args.suite or SUITES:
+        if name == "prompt":
+            run_prompt(args.repeat, args.scale)
+        else:
+            SUITES[name](args.repeat)
+    print()
+
+
+if __name__ == "__main__":
+    main()
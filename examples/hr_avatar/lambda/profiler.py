@@ -0,0 +1,276 @@
+"""
+Per-mode profiling for in-process lambda_handler runs (regression.py / benchmark.py --profile).
+
+Each profiling pass runs separately from the timed iterations, so it never
+skews the timings it explains. Results are grouped by analysis mode:
+
+    cpu      cProfile per call, merged per mode   → <dir>/<mode>.pstats
+             top-N functions by self time
+    stacks   sampling profiler: a background thread records the Python
+             stacks of all threads inside a profiled call every interval
+                                                    → <dir>/<mode>.collapsed
+             one "frame;frame;frame count" line per stack, ready for
+             flamegraph.pl, speedscope or inferno
+    memory   tracemalloc: peak bytes per call, plus the live allocation
+             sites at the model boundary (when the Bedrock/SES client is
+             entered: formatted transcript, prompt and request JSON are all
+             alive)                                → <dir>/<mode>.alloc.txt
+
+Usage:
+    profiler = ModeProfiler('profiles')
+    for pass_name in PASSES:
+        with profiler.session(pass_name, lf):
+            profiler.call(mode, lf.lambda_handler, event, None)
+    profiler.write()
+    profiler.print_report()
+
+Memory peaks are exact for sequential calls; concurrent calls (benchmark.py's
+parallel per-problem requests) share one tracemalloc peak.
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import statistics
+import sys
+import threading
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+PASSES = ("cpu", "stacks", "memory")
+DEFAULT_TOP = 12
+DEFAULT_INTERVAL_S = 0.0005
+SAMPLER_SWITCH_INTERVAL_S = 0.00002
+MAX_BOUNDARY_SNAPSHOTS = 3      # per mode; each snapshot costs milliseconds
+
+
+class _BoundaryProbe:
+    """Client wrapper that calls `on_enter` before invoke_model / send_email."""
+
+    def __init__(self, client, on_enter):
+        self._client = client
+        self._on_enter = on_enter
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def invoke_model(self, **kwargs):
+        self._on_enter()
+        return self._client.invoke_model(**kwargs)
+
+    def send_email(self, **kwargs):
+        self._on_enter()
+        return self._client.send_email(**kwargs)
+
+
+class ModeProfiler:
+    """Collects cProfile stats, sampled stacks and tracemalloc data per analysis mode."""
+
+    def __init__(self, out_dir, top=DEFAULT_TOP, interval_s=DEFAULT_INTERVAL_S):
+        self.out_dir = out_dir
+        self.top = top
+        self.interval_s = interval_s
+        self.pass_name = None
+        self.stats = {}                         # mode -> pstats.Stats
+        self.calls = Counter()                  # (pass, mode) -> calls profiled
+        self.stacks = defaultdict(Counter)      # mode -> collapsed stack -> samples
+        self.peaks = defaultdict(list)          # mode -> peak bytes per call
+        self.snapshots = defaultdict(list)      # mode -> boundary snapshots
+        self._active = {}                       # thread id -> mode of the call it is running
+        self._lock = threading.Lock()
+        self._sampler = None
+        self._stop = threading.Event()
+
+    # ── Passes ───────────────────────────────────────────────────────────────
+
+    @contextmanager
+    def session(self, pass_name, lf=None):
+        """Run one pass; `lf` (lambda_function) enables boundary snapshots in the memory pass."""
+        if pass_name not in PASSES:
+            raise ValueError(f"Unknown profiling pass: {pass_name}")
+        self.pass_name = pass_name
+        saved_clients = None
+        saved_interval = sys.getswitchinterval()
+        if pass_name == "stacks":
+            # The sampler needs the GIL to read stacks. Forcing a hand-over within a few µs
+            # makes it land at arbitrary points instead of only where the handler blocks.
+            sys.setswitchinterval(SAMPLER_SWITCH_INTERVAL_S)
+            self._stop.clear()
+            self._sampler = threading.Thread(target=self._sample_loop, name="profiler-sampler", daemon=True)
+            self._sampler.start()
+        elif pass_name == "memory":
+            tracemalloc.start(25)
+            if lf is not None:
+                saved_clients = lf.bedrock, lf.ses
+                lf.bedrock = _BoundaryProbe(lf.bedrock, self._boundary_snapshot)
+                lf.ses = _BoundaryProbe(lf.ses, self._boundary_snapshot)
+        try:
+            yield self
+        finally:
+            if pass_name == "stacks":
+                self._stop.set()
+                self._sampler.join()
+                sys.setswitchinterval(saved_interval)
+            elif pass_name == "memory":
+                tracemalloc.stop()
+                if saved_clients:
+                    lf.bedrock, lf.ses = saved_clients
+            self.pass_name = None
+
+    def call(self, mode, fn, *args):
+        """Run fn(*args) attributed to `mode` under the current pass."""
+        ident = threading.get_ident()
+        with self._lock:
+            self._active[ident] = mode
+            self.calls[(self.pass_name, mode)] += 1
+        try:
+            if self.pass_name == "cpu":
+                return self._call_cpu(mode, fn, args)
+            if self.pass_name == "memory":
+                tracemalloc.reset_peak()
+                base, _ = tracemalloc.get_traced_memory()
+                result = fn(*args)
+                _, peak = tracemalloc.get_traced_memory()
+                with self._lock:
+                    self.peaks[mode].append(peak - base)
+                return result
+            return fn(*args)
+        finally:
+            with self._lock:
+                del self._active[ident]
+
+    def _call_cpu(self, mode, fn, args):
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return fn(*args)
+        finally:
+            profile.disable()
+            with self._lock:
+                if mode in self.stats:
+                    self.stats[mode].add(profile)
+                else:
+                    self.stats[mode] = pstats.Stats(profile)
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.interval_s):
+            with self._lock:
+                active = dict(self._active)
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for ident, mode in active.items():
+                frame = frames.get(ident)
+                stack = self._collapse(frame) if frame is not None else None
+                if stack:
+                    self.stacks[mode][stack] += 1
+
+    def _collapse(self, frame):
+        """Root-first "func (file:line);..." for the frames below ModeProfiler.call."""
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            if code is ModeProfiler.call.__code__:
+                return ";".join(reversed(names))
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return None
+
+    def _boundary_snapshot(self):
+        mode = self._active.get(threading.get_ident())
+        if mode is None or len(self.snapshots[mode]) >= MAX_BOUNDARY_SNAPSHOTS:
+            return
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ])
+        with self._lock:
+            self.snapshots[mode].append(snapshot)
+
+    # ── Output ───────────────────────────────────────────────────────────────
+
+    def modes(self):
+        return sorted(set(self.stats) | set(self.stacks) | set(self.peaks))
+
+    def _allocation_sites(self, mode, limit):
+        """Largest boundary snapshot's top allocation sites by live size."""
+        if not self.snapshots[mode]:
+            return []
+        snapshot = max(self.snapshots[mode], key=lambda s: sum(t.size for t in s.traces))
+        return snapshot.statistics("lineno")[:limit]
+
+    def write(self):
+        """Write <mode>.pstats, <mode>.collapsed and <mode>.alloc.txt; returns the paths."""
+        os.makedirs(self.out_dir, exist_ok=True)
+        paths = []
+        for mode in self.modes():
+            if mode in self.stats:
+                path = os.path.join(self.out_dir, f"{mode}.pstats")
+                self.stats[mode].dump_stats(path)
+                paths.append(path)
+            if self.stacks[mode]:
+                path = os.path.join(self.out_dir, f"{mode}.collapsed")
+                with open(path, "w") as f:
+                    for stack, count in sorted(self.stacks[mode].items()):
+                        f.write(f"{stack} {count}\n")
+                paths.append(path)
+            if self.snapshots[mode]:
+                path = os.path.join(self.out_dir, f"{mode}.alloc.txt")
+                with open(path, "w") as f:
+                    for stat in self._allocation_sites(mode, 50):
+                        f.write(f"{stat.size:>10} B {stat.count:>6} blocks  {stat.traceback}\n")
+                paths.append(path)
+        return paths
+
+    def print_report(self):
+        W = 100
+        print("\n" + "=" * W)
+        print(f"  PROFILE — per mode (top {self.top}; files in {self.out_dir})")
+        print("=" * W)
+        for mode in self.modes():
+            cpu_calls = self.calls[("cpu", mode)]
+            samples = sum(self.stacks[mode].values())
+            print(f"\n  ── {mode}  (cpu: {cpu_calls} calls, stacks: {samples} samples, "
+                  f"memory: {len(self.peaks[mode])} calls)")
+
+            if mode in self.stats and cpu_calls:
+                print(f"\n    {'self µs/call':>12} {'cum µs/call':>12} {'ncalls':>8}  function")
+                rows = sorted(self.stats[mode].stats.items(), key=lambda kv: kv[1][2], reverse=True)
+                for (filename, line, func), (_, ncalls, tottime, cumtime, _) in rows[:self.top]:
+                    where = f"{os.path.basename(filename)}:{line}" if line else filename
+                    print(f"    {tottime / cpu_calls * 1e6:>12.1f} {cumtime / cpu_calls * 1e6:>12.1f} "
+                          f"{ncalls / cpu_calls:>8.1f}  {func} ({where})")
+
+            if samples:
+                leaves = Counter()
+                for stack, count in self.stacks[mode].items():
+                    leaves[stack.rsplit(";", 1)[-1]] += count
+                print(f"\n    {'samples':>12} {'share':>12}           leaf frame")
+                for leaf, count in leaves.most_common(min(self.top, 5)):
+                    print(f"    {count:>12} {count / samples:>11.0%}            {leaf}")
+
+            if self.peaks[mode]:
+                print(f"\n    peak traced memory per call: median {statistics.median(self.peaks[mode]) / 1024:.1f} KB, "
+                      f"max {max(self.peaks[mode]) / 1024:.1f} KB")
+                for stat in self._allocation_sites(mode, min(self.top, 5)):
+                    frame = stat.traceback[0]
+                    print(f"    {stat.size / 1024:>9.1f} KB live at model call  "
+                          f"{os.path.basename(frame.filename)}:{frame.lineno}")
+        print("\n" + "=" * W)
+
+
+def profile_text(stats, sort="tottime", limit=30):
+    """Plain pstats listing (for ad-hoc use on a loaded .pstats file)."""
+    out = io.StringIO()
+    pstats.Stats(stats, stream=out).sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python3 profiler.py <mode>.pstats")
+        sys.exit(2)
+    print(profile_text(sys.argv[1]))
@@ -0,0 +1,666 @@
+#!/usr/bin/env python3
+"""
+Regression Suite: Golden Transcripts + In-Lambda Overhead (every analysis mode)
+
+Runs lambda_handler in-process against the recorded-response Bedrock/SES stubs
+(bedrock_stub.py) using the bundled samples: the benchmark TRANSCRIPT fixture,
+the HR dynamic_page_prompt_samples with call_summary.schema.json, and the AT&T
+Seller Hub knowledge-check samples.  For every case it checks the response
+against the stored golden output and measures the time spent inside the
+Lambda around the model call:
+
+    pre   — request parse + prompt build (handler start → model/SES call)
+    post  — response parse + serialize    (model/SES return → handler return)
+    total — pre + post (everything except the stubbed model call itself)
+
+Timings are compared as min-of-N: each run of MIN_OF_N consecutive iterations
+contributes its fastest, so a burst of load on the machine inflates a few
+samples instead of the statistic.  A case regresses when those minima are
+slower than the baseline's by a one-sided Mann-Whitney U test (p < alpha), by
+more than the tolerance on their median, and by at least the absolute floor
+(MIN_DELTA_US) — a few µs on a 40µs case is scheduler noise, not code.  Baseline samples are rescaled
+by a calibration workload interleaved with each case's iterations (both when
+the baseline is recorded and when it is checked), so a uniformly slower or
+busier machine does not read as a regression.
+
+Usage:
+    python3 regression.py                      # check golden + compare to baseline
+    python3 regression.py --save-baseline      # record timing baseline on this machine
+    python3 regression.py --update-golden      # accept current responses as golden
+    python3 regression.py --mode full          # only run one mode (repeatable)
+    python3 regression.py --iterations 500     # more samples per case
+    python3 regression.py --profile            # + cProfile / sampled stacks / tracemalloc per mode
+    python3 regression.py --profile out/ --mode knowledge_check --profile-iterations 100
+
+--profile runs extra passes per case after the timed iterations (see
+profiler.py), so timings and verdicts are unaffected; it writes
+<mode>.pstats, <mode>.collapsed (flame graphs) and <mode>.alloc.txt.
+"""
+
+import argparse
+import contextlib
+import gc
+import glob
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+LAMBDA_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, LAMBDA_DIR)
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+
+import lambda_function as lf  # noqa: E402
+from benchmark import TRANSCRIPT, PROBLEMS, DPP  # noqa: E402
+from bedrock_stub import load_recorded_responses, stub_clients, installed  # noqa: E402
+from profiler import PASSES, ModeProfiler  # noqa: E402
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Config
+# ─────────────────────────────────────────────────────────────────────────────
+
+HR_DIR = os.path.dirname(LAMBDA_DIR)
+HR_SAMPLES_DIR = os.path.join(HR_DIR, "dynamic_page_prompt_samples")
+HR_SCHEMA_PATH = os.path.join(HR_DIR, "call_summary.schema.json")
+ATT_SAMPLES_DIR = os.path.join(HR_DIR, "..", "att_lily", "dynamic_page_prompt_samples")
+
+GOLDEN_PATH = os.path.join(LAMBDA_DIR, "regression_golden.json")
+DEFAULT_BASELINE_PATH = os.path.join(LAMBDA_DIR, "regression_baseline.json")
+
+DEFAULT_ITERATIONS = 200
+DEFAULT_TOLERANCE = 0.25     # median may grow by 25% before it counts as a regression
+DEFAULT_ALPHA = 0.01         # significance level for the Mann-Whitney test
+MIN_DELTA_US = 20.0          # ignore shifts under 20µs (scheduler/timer noise on short cases)
+MIN_OF_N = 10                # iterations per block; each block is gated on its fastest run
+MAX_BASELINE_SAMPLES = 500
+DEFAULT_PROFILE_DIR = "profiles"
+DEFAULT_PROFILE_ITERATIONS = 30
+STACKS_PASS_MIN_S = 0.25     # sampled stacks need wall time, not just iterations (~1 sample/ms)
+
+MODES = ["per_problem", "multi_problem", "synthesis", "knowledge_check", "general",
+         "training_summary", "send_report_email", "full"]
+
+KNOWLEDGE_CHECK_ANSWERS = [
+    "I'd start by asking how they use the service today, then match them to the tier that fits.",
+    "The gateway is included and I'd check the current install offer before quoting anything.",
+    "It means uploads are as fast as downloads, which matters for video calls and backups.",
+    "I'm not completely sure, I think there's a one-year agreement but I'd confirm that.",
+    "I'd tie it to their calls: symmetrical speeds and low latency keep video from freezing.",
+]
+
+# Editor contents the Code Interview client sends as dpp.final_code (legacy full path)
+FINAL_CODE = """def two_sum(nums, target):
+    seen = {}
+    for i, n in enumerate(nums):
+        if target - n in seen:
+            return [seen[target - n], i]
+        seen[n] = i
+
+def is_palindrome(s):
+    left, right = 0, len(s) - 1
+    while left < right:
+        if not s[left].isalnum():
+            left += 1
+            continue
+        if not s[right].isalnum():
+            right -= 1
+            continue
+        if s[left].lower() != s[right].lower():
+            return False
+        left, right = left + 1, right - 1
+    return True
+"""
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Cases
+# ─────────────────────────────────────────────────────────────────────────────
+
+def knowledge_check_transcript(questions):
+    """Build a question/answer transcript from a knowledge-check sample's questions."""
+    transcript = [{"role": "assistant", "content": "Hi! Let's run a quick knowledge check."},
+                  {"role": "user", "content": "Ready."}]
+    for i, question in enumerate(questions):
+        transcript.append({"role": "assistant", "content": question})
+        transcript.append({"role": "user", "content": KNOWLEDGE_CHECK_ANSWERS[i % len(KNOWLEDGE_CHECK_ANSWERS)]})
+    return transcript
+
+
+def build_cases():
+    """Return the ordered list of regression cases: {name, mode, payload}."""
+    recorded = load_recorded_responses()
+    cases = []
+
+    for problem in PROBLEMS:
+        cases.append({"name": f"per_problem:{problem['id']}", "mode": "per_problem", "payload": {
+            "analysis_mode": "per_problem", "transcript": TRANSCRIPT, "problem_focus": problem, "dpp": DPP}})
+
+    for strategy in ("combined", "parallel", "auto"):
+        cases.append({"name": f"multi_problem:{strategy}", "mode": "multi_problem", "payload": {
+            "analysis_mode": "multi_problem", "strategy": strategy, "transcript": TRANSCRIPT, "dpp": DPP}})
+
+    for engine in ("llm", "hybrid", "local"):
+        name = "synthesis:benchmark" if engine == "llm" else f"synthesis:{engine}"
+        cases.append({"name": name, "mode": "synthesis", "payload": {
+            "analysis_mode": "synthesis", "synthesis_engine": engine,
+            "problem_results": [recorded["per_problem"][p["id"]]["content"] for p in PROBLEMS],
+            "dpp": DPP}})
+
+    for path in sorted(glob.glob(os.path.join(ATT_SAMPLES_DIR, "*.json"))):
+        with open(path) as f:
+            sample = json.load(f)
+        questions = sample.get("mtg", {}).get("q_add", [])
+        cases.append({"name": f"knowledge_check:{os.path.basename(path)[:-5]}", "mode": "knowledge_check", "payload": {
+            "analysis_mode": "knowledge_check", "transcript": knowledge_check_transcript(questions),
+            "product": sample.get("product", "AT&T Product"), "questions": questions}})
+
+    cases.append({"name": "general:benchmark", "mode": "general", "payload": {
+        "analysis_mode": "general", "transcript": TRANSCRIPT,
+        "context": "AT&T Seller Hub — open coaching session with Lily"}})
+
+    cases.append({"name": "training_summary:benchmark", "mode": "training_summary", "payload": {
+        "analysis_mode": "training_summary", "transcript": TRANSCRIPT}})
+
+    for report_mode, title in (("knowledge_check", "AT&T Fiber Internet Plans"), ("general", "Coaching Session")):
+        cases.append({"name": f"send_report_email:{report_mode}", "mode": "send_report_email", "payload": {
+            "analysis_mode": "send_report_email", "to_email": "seller@example.com",
+            "report": recorded[report_mode]["content"], "title": title}})
+
+    with open(HR_SCHEMA_PATH) as f:
+        schema = json.load(f)
+    for path in sorted(glob.glob(os.path.join(HR_SAMPLES_DIR, "*.json"))):
+        with open(path) as f:
+            dpp = json.load(f)
+        cases.append({"name": f"full:{os.path.basename(path)[:-5]}", "mode": "full", "payload": {
+            "transcript": TRANSCRIPT, "dpp": dpp, "schema": schema}})
+
+    cases.append({"name": "full:code_interview_final_code", "mode": "full", "payload": {
+        "transcript": TRANSCRIPT, "dpp": dict(DPP, final_code=FINAL_CODE)}})
+
+    return cases
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Measurement
+# ─────────────────────────────────────────────────────────────────────────────
+
+def invoke(event, bedrock, ses):
+    """Run lambda_handler once. Returns (response, timing dict in µs)."""
+    bedrock.reset()
+    ses.reset()
+    t_start = time.perf_counter()
+    response = lf.lambda_handler(event, None)
+    t_end = time.perf_counter()
+
+    calls = sorted(bedrock.calls + ses.calls, key=lambda c: c["t_enter"])
+    if calls:
+        external = sum(c["t_exit"] - c["t_enter"] for c in calls)
+        pre = calls[0]["t_enter"] - t_start
+        post = t_end - calls[-1]["t_exit"]
+    else:
+        external, pre, post = 0.0, t_end - t_start, 0.0
+
+    return response, {
+        "total_us": (t_end - t_start - external) * 1e6,
+        "pre_us": pre * 1e6,
+        "post_us": post * 1e6,
+    }
+
+
+def calibrate(rounds=7):
+    """Fastest µs of a fixed JSON + string-formatting workload (machine speed reference)."""
+    blob = json.dumps(TRANSCRIPT)
+    timings = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        for _ in range(50):
+            data = json.loads(blob)
+            "\n".join(f"[{i}] {t['role']}: {t['content']}" for i, t in enumerate(data, 1))
+            json.dumps(data, separators=(",", ":"))
+        timings.append((time.perf_counter() - t0) * 1e6 / 50)
+    return min(timings)
+
+
+def normalize_response(response):
+    """Golden form of a Lambda response: status code + decoded JSON body."""
+    return {"statusCode": response["statusCode"], "body": json.loads(response["body"])}
+
+
+def run_case(case, iterations, bedrock, ses):
+    """Returns (golden form, samples, calibration µs).
+
+    The calibration workload runs between every MIN_OF_N block, and the case
+    keeps the median, so a slowdown that lasts through the case moves both.
+    """
+    event = {"body": json.dumps(case["payload"])}
+    response, _ = invoke(event, bedrock, ses)           # warm-up + golden capture
+    samples = {"total_us": [], "pre_us": [], "post_us": []}
+
+    gc.collect()
+    calibrations = [calibrate()]
+    for i in range(iterations):
+        _, timing = invoke(event, bedrock, ses)
+        for key, value in timing.items():
+            samples[key].append(value)
+        if (i + 1) % MIN_OF_N == 0:
+            calibrations.append(calibrate(rounds=2))
+
+    return normalize_response(response), samples, statistics.median(calibrations)
+
+
+def profile_case(case, iterations, profiler):
+    """Untimed profiling passes for one case (cpu, sampled stacks, memory)."""
+    event = {"body": json.dumps(case["payload"])}
+    for pass_name in PASSES:
+        with profiler.session(pass_name, lf):
+            deadline = time.perf_counter() + (STACKS_PASS_MIN_S if pass_name == "stacks" else 0)
+            runs = 0
+            while runs < iterations or time.perf_counter() < deadline:
+                profiler.call(case["mode"], lf.lambda_handler, event, None)
+                runs += 1
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Behavior checks (stateful paths a single golden response cannot cover)
+# ─────────────────────────────────────────────────────────────────────────────
+
+@contextlib.contextmanager
+def patched(module, **values):
+    """Temporarily replace module globals (config read at import time)."""
+    saved = {name: getattr(module, name) for name in values}
+    for name, value in values.items():
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(module, name, value)
+
+
+def tenant_event(payload, tenant):
+    """An API Gateway event whose Lambda authorizer vouches for `tenant`."""
+    return {"body": json.dumps(payload),
+            "requestContext": {"http": {"method": "POST"}, "authorizer": {"lambda": {"tenant": tenant}}}}
+
+
+def check_admission_throttling(cases, bedrock, ses):
+    """A 1 rpm tenant bucket admits one call, then answers 429 with Retry-After; the body's tenant is ignored."""
+    payload = next(c["payload"] for c in cases if c["mode"] == "knowledge_check")
+    problems = []
+    with patched(lf, ADMISSION_STORE="local", _admission_store=None, _last_throttled_at=None,
+                 ADMISSION_LIMITS={"tenant:acme": {"rpm": 1}}):
+        steps = [("acme first call", tenant_event(payload, "acme"), 200),
+                 ("acme second call", tenant_event(payload, "acme"), 429),
+                 ("acme naming another tenant in the body", tenant_event(dict(payload, tenant="beta"), "acme"), 429),
+                 ("beta call", tenant_event(payload, "beta"), 200)]
+        for label, event, expected in steps:
+            response, _ = invoke(event, bedrock, ses)
+            if response["statusCode"] != expected:
+                problems.append(f"{label}: status {response['statusCode']}, expected {expected}")
+            elif expected == 429:
+                body = json.loads(response["body"])
+                if body.get("code") != "THROTTLING" or not body.get("retry_after"):
+                    problems.append(f"{label}: body {body}")
+                if int(response["headers"].get("Retry-After", 0)) < 1:
+                    problems.append(f"{label}: Retry-After header {response['headers'].get('Retry-After')!r}")
+                if bedrock.calls:
+                    problems.append(f"{label}: a shed request still reached Bedrock")
+    return problems
+
+
+class FakeDynamo:
+    """Just enough of the DynamoDB client for DynamoOutputStatsStore: canned Query items, logged UpdateItems."""
+
+    def __init__(self, items):
+        self.items = items
+        self.updates = []
+
+    def query(self, **kwargs):
+        return {"Items": self.items}
+
+    def update_item(self, **kwargs):
+        self.updates.append(kwargs)
+
+
+def check_budget_retry(cases, bedrock, ses):
+    """A predicted budget below the answer's length is cut off, retried once at the ceiling, and billed for both."""
+    payload = next(c["payload"] for c in cases if c["mode"] == "knowledge_check")
+    ceiling = lf.MODE_MAX_TOKENS["knowledge_check"]
+    # 20 answers of ~100 tokens predict ~154; the recorded knowledge_check answer is 702
+    short = {"pk": {"S": "output_length"}, "sk": {"S": "knowledge_check|p0"}, "bin#3": {"N": "20"}}
+    store = lf.DynamoOutputStatsStore("output-stats")
+    store.ddb = FakeDynamo([short])
+    problems = []
+    with patched(lf, OUTPUT_STATS_STORE="dynamodb://output-stats", _output_stats_store=store):
+        response, _ = invoke({"body": json.dumps(payload)}, bedrock, ses)
+        calls = list(bedrock.calls)
+        lf.flush_background()
+    if response["statusCode"] != 200:
+        return [f"status {response['statusCode']}, expected 200"]
+    budgets = [(c["max_tokens"], c["stop_reason"]) for c in calls]
+    if len(calls) != 2 or not calls[0]["max_tokens"] < ceiling or calls[0]["stop_reason"] != "max_tokens" \
+            or calls[1]["max_tokens"] != ceiling or calls[1]["stop_reason"] != "end_turn":
+        problems.append(f"model calls (max_tokens, stop_reason) {budgets}, expected a cut-off call then one at {ceiling}")
+    usage = json.loads(response["body"]).get("usage", {})
+    if len(calls) == 2 and usage.get("output_tokens") != calls[0]["max_tokens"] + 702:
+        problems.append(f"usage {usage} does not include the cut-off call's {calls[0]['max_tokens']} tokens")
+    written = sorted(u["Key"]["sk"]["S"] for u in store.ddb.updates)
+    if len(written) != len(set(written)) or "knowledge_check|p0" not in written:
+        problems.append(f"output stats writes {written}, expected one per histogram")
+    return problems
+
+
+def check_progressive_refine(cases, bedrock, ses):
+    """Draft, then a pending poll, then one refine to complete; a duplicate delivery neither refines nor notifies."""
+    payload = dict(next(c["payload"] for c in cases if c["mode"] == "full"),
+                   progressive=True, notify_url="https://hooks.example.com/done")
+    queued, notified = [], []
+    problems = []
+    with tempfile.TemporaryDirectory() as root, \
+            patched(lf, RESULT_STORE=f"local:{root}", _result_store=None, NOTIFY_URL_HOSTS={"hooks.example.com"},
+                    refine_async=lambda result_id, ctx: queued.append(result_id) or "queued",
+                    notify_result=notified.append):
+        draft, _ = invoke({"body": json.dumps(payload)}, bedrock, ses)
+        result_id = json.loads(draft["body"]).get("result_id")
+        if draft["statusCode"] != 200 or not result_id or queued != [result_id]:
+            return [f"draft: status {draft['statusCode']}, result_id {result_id!r}, queued {queued}"]
+
+        def poll():
+            response, _ = invoke({"body": json.dumps({"analysis_mode": "result", "result_id": result_id})},
+                                 bedrock, ses)
+            return json.loads(response["body"])
+
+        record = poll()
+        if record.get("status") != "pending" or "request" in record or "notify_url" in record:
+            problems.append(f"first poll: status {record.get('status')!r}, fields {sorted(record)}")
+        run_full, during = lf.run_full, []
+
+        def run_full_redelivered(request, ctx):
+            # At-least-once delivery: the same invoke arrives again while the first is still refining
+            during.append((lf.refine_result(result_id), lf.get_result_store().get(result_id)))
+            return run_full(request, ctx)
+
+        bedrock.reset()
+        with patched(lf, run_full=run_full_redelivered):
+            statuses = [lf.refine_result(result_id)]
+        model_calls = len(bedrock.calls)
+        bedrock.reset()
+        statuses.append(lf.refine_result(result_id))  # ... and once more after it finished
+        if [status for status, _ in during] != ["refining"] or "request" in during[0][1]:
+            problems.append(f"delivery during the refine: {[(s, sorted(r)) for s, r in during]}")
+        if statuses != ["complete", "complete"] or bedrock.calls:
+            problems.append(f"refine statuses {statuses}, late delivery made {len(bedrock.calls)} model calls")
+        if model_calls != 1:
+            problems.append(f"refine made {model_calls} model calls, expected 1")
+        if len(notified) != 1:
+            problems.append(f"notify_url posted {len(notified)} times, expected once")
+        record = poll()
+        if record.get("status") != "complete" or not record.get("summary"):
+            problems.append(f"final poll: status {record.get('status')!r}, fields {sorted(record)}")
+        if "request" in lf.get_result_store().get(result_id):
+            problems.append("stored record still holds the request (transcript) after the refine")
+    return problems
+
+
+def check_warmup_admission(cases, bedrock, ses):
+    """Warmup model calls are admitted at background priority: shed before they touch the reserve."""
+    payload = next(c["payload"] for c in cases if c["mode"] == "per_problem")
+    warmup = {"source": "aws.events", "detail": {"model_call": True}}
+    problems = []
+    # 4 rpm with 40% kept free: two warmups fit, the third would leave less than 1.6 (standard: 0.6)
+    with patched(lf, ADMISSION_STORE="local", _admission_store=None, _last_throttled_at=None,
+                 BEDROCK_RPM=4, ADMISSION_LIMITS={}):
+        for expected in ("ok", "ok", "shed"):
+            response, _ = invoke(warmup, bedrock, ses)
+            status = json.loads(response["body"])["warmup"]["steps"]["model_call"]["status"]
+            if status != expected or len(bedrock.calls) != (expected == "ok"):
+                problems.append(f"warmup model_call {status!r} with {len(bedrock.calls)} model calls, "
+                                f"expected {expected!r}")
+        response, _ = invoke({"body": json.dumps(payload)}, bedrock, ses)
+        if response["statusCode"] != 200:
+            problems.append(f"per_problem after the warmups: status {response['statusCode']}, expected 200")
+    return problems
+
+
+CHECKS = [check_admission_throttling, check_budget_retry, check_progressive_refine, check_warmup_admission]
+
+
+def run_checks(cases, bedrock, ses):
+    """Run every behavior check; returns [(name, problems)]."""
+    return [(check.__name__[len("check_"):], check(cases, bedrock, ses)) for check in CHECKS]
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Statistics
+# ─────────────────────────────────────────────────────────────────────────────
+
+def mann_whitney_greater(current, baseline):
+    """One-sided Mann-Whitney U p-value for "current tends to be larger than baseline".
+
+    Uses the normal approximation with tie correction and continuity correction,
+    which is accurate for the sample sizes used here (tens to hundreds).
+    """
+    n1, n2 = len(current), len(baseline)
+    if n1 == 0 or n2 == 0:
+        return 1.0
+    combined = sorted([(v, 0) for v in current] + [(v, 1) for v in baseline])
+    n = n1 + n2
+
+    rank_sum_current = 0.0
+    tie_term = 0.0
+    i = 0
+    while i < n:
+        j = i
+        while j + 1 < n and combined[j + 1][0] == combined[i][0]:
+            j += 1
+        avg_rank = (i + j) / 2 + 1
+        ties = j - i + 1
+        tie_term += ties ** 3 - ties
+        rank_sum_current += avg_rank * sum(1 for k in range(i, j + 1) if combined[k][1] == 0)
+        i = j + 1
+
+    u = rank_sum_current - n1 * (n1 + 1) / 2
+    mu = n1 * n2 / 2
+    sigma = math.sqrt(n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1))))
+    if sigma == 0:
+        return 1.0
+    z = (u - mu - 0.5) / sigma
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def p95(values):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+def block_minima(samples, n=MIN_OF_N):
+    """Fastest sample of each run of n consecutive iterations (one block if there are fewer)."""
+    n = max(1, min(n, len(samples)))
+    return [min(samples[i:i + n]) for i in range(0, len(samples) - n + 1, n)]
+
+
+def compare(samples, baseline_samples, tolerance, alpha, min_delta=MIN_DELTA_US):
+    """Return (verdict, ratio, p_value) for one case's total overhead, on min-of-N blocks."""
+    if not baseline_samples:
+        return "NEW", None, None
+    current, baseline = block_minima(samples), block_minima(baseline_samples)
+    cur_med = statistics.median(current)
+    base_med = statistics.median(baseline)
+    ratio = cur_med / base_med if base_med else None
+    p_value = mann_whitney_greater(current, baseline)
+    slower = ratio is not None and ratio > 1 + tolerance and cur_med - base_med > min_delta
+    return ("REGRESSED" if slower and p_value < alpha else "OK"), ratio, p_value
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Golden + baseline files
+# ─────────────────────────────────────────────────────────────────────────────
+
+def load_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_json(path, data):
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def golden_diff(expected, actual, path=""):
+    """Return a list of human-readable differences between two JSON values."""
+    if type(expected) is not type(actual):
+        return [f"{path or '<root>'}: {type(expected).__name__} → {type(actual).__name__}"]
+    if isinstance(expected, dict):
+        diffs = []
+        for key in sorted(set(expected) | set(actual)):
+            sub = f"{path}.{key}" if path else key
+            if key not in actual:
+                diffs.append(f"{sub}: missing")
+            elif key not in expected:
+                diffs.append(f"{sub}: unexpected")
+            else:
+                diffs.extend(golden_diff(expected[key], actual[key], sub))
+        return diffs
+    if isinstance(expected, list) and len(expected) != len(actual):
+        return [f"{path}: length {len(expected)} → {len(actual)}"]
+    if isinstance(expected, list):
+        return [d for i, (e, a) in enumerate(zip(expected, actual)) for d in golden_diff(e, a, f"{path}[{i}]")]
+    return [] if expected == actual else [f"{path}: {expected!r} → {actual!r}"]
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Report
+# ─────────────────────────────────────────────────────────────────────────────
+
+def print_report(results, has_baseline, checks=()):
+    W = 100
+    print("\n" + "=" * W)
+    print("  REGRESSION REPORT — In-Lambda overhead per case (µs, stubbed Bedrock/SES)")
+    print("=" * W)
+    print(f"\n  {'Case':<52} {'pre':>8} {'post':>8} {'total':>8} {'p95':>8} {'vs base':>8} {'p':>7}  Verdict")
+    print("-" * W)
+    for r in results:
+        ratio = f"{r['ratio']:.2f}x" if r["ratio"] else "—"
+        p_value = f"{r['p_value']:.3f}" if r["p_value"] is not None else "—"
+        verdict = r["verdict"] if r["golden_ok"] else f"{r['verdict']}+GOLDEN"
+        print(f"  {r['name'][:52]:<52} {statistics.median(r['samples']['pre_us']):>8.1f} "
+              f"{statistics.median(r['samples']['post_us']):>8.1f} {statistics.median(r['samples']['total_us']):>8.1f} "
+              f"{p95(r['samples']['total_us']):>8.1f} {ratio:>8} {p_value:>7}  {verdict}")
+
+    print(f"\n{'─' * W}")
+    print("  PER-MODE MEDIAN OVERHEAD")
+    print(f"{'─' * W}")
+    for mode in MODES:
+        mode_results = [r for r in results if r["mode"] == mode]
+        if not mode_results:
+            continue
+        totals = [v for r in mode_results for v in r["samples"]["total_us"]]
+        print(f"  {mode:<20} cases={len(mode_results):<3} med={statistics.median(totals):>8.1f}µs  p95={p95(totals):>8.1f}µs")
+
+    golden_failures = [r for r in results if not r["golden_ok"]]
+    regressions = [r for r in results if r["verdict"] == "REGRESSED"]
+    print(f"\n{'=' * W}")
+    if golden_failures:
+        print(f"  GOLDEN MISMATCHES: {len(golden_failures)}")
+        for r in golden_failures:
+            for line in r["golden_diff"][:5]:
+                print(f"    {r['name']}: {line}")
+    if not has_baseline:
+        print("  No timing baseline found — run with --save-baseline to record one.")
+    check_failures = [(name, problems) for name, problems in checks if problems]
+    for name, problems in checks:
+        print(f"  CHECK {name:<40} {'FAIL' if problems else 'OK'}")
+        for line in problems:
+            print(f"    {line}")
+    passed = not golden_failures and not regressions and not check_failures
+    color = "\033[92m" if passed else "\033[91m"
+    print(f"  RESULT: {color}{'PASS' if passed else 'FAIL'}\033[0m  —  "
+          f"{len(results)} cases, {len(regressions)} timing regressions, {len(golden_failures)} golden mismatches, "
+          f"{len(check_failures)}/{len(checks)} checks failed")
+    print("=" * W + "\n")
+    return passed
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Main
+# ─────────────────────────────────────────────────────────────────────────────
+
+def main():
+    parser = argparse.ArgumentParser(description="Golden-transcript regression and overhead suite")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS, help="Timed runs per case")
+    parser.add_argument("--mode", action="append", choices=MODES, help="Only run this mode (repeatable)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH, help="Timing baseline file")
+    parser.add_argument("--save-baseline", action="store_true", help="Write current timings as the baseline")
+    parser.add_argument("--update-golden", action="store_true", help="Accept current responses as golden")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Allowed median slowdown (fraction)")
+    parser.add_argument("--alpha", type=float, default=DEFAULT_ALPHA, help="Significance level")
+    parser.add_argument("--min-delta", type=float, default=MIN_DELTA_US,
+                        help="Median slowdowns below this many µs never count as regressions")
+    parser.add_argument("--profile", nargs="?", const=DEFAULT_PROFILE_DIR, metavar="DIR",
+                        help=f"Profile every mode after timing, write files to DIR (default: {DEFAULT_PROFILE_DIR})")
+    parser.add_argument("--profile-iterations", type=int, default=DEFAULT_PROFILE_ITERATIONS,
+                        help="Runs per case in each profiling pass")
+    parser.add_argument("--top", type=int, default=12, help="Functions / allocation sites shown per mode")
+    args = parser.parse_args()
+
+    cases = [c for c in build_cases() if not args.mode or c["mode"] in args.mode]
+    golden = load_json(GOLDEN_PATH, {})
+    baseline_file = load_json(args.baseline, {})
+    baseline = baseline_file.get("cases", {})
+
+    print(f"\nRegression config:")
+    print(f"  Cases:      {len(cases)} across {len({c['mode'] for c in cases})} modes")
+    print(f"  Iterations: {args.iterations} per case")
+    print(f"  Baseline:   {args.baseline if baseline else '(none)'}")
+    print(f"  Python:     {platform.python_version()} ({platform.machine()})")
+    if args.profile:
+        print(f"  Profile:    {args.profile_iterations} runs/case/pass → {args.profile}")
+
+    bedrock, ses = stub_clients(lf)
+    results = []
+    with installed(lf, bedrock, ses):
+        for i, case in enumerate(cases, 1):
+            print(f"\rCase {i}/{len(cases)}: {case['name'][:60]:<60}", end="", flush=True)
+            actual, samples, calibration = run_case(case, args.iterations, bedrock, ses)
+            diffs = [] if args.update_golden or case["name"] not in golden else golden_diff(golden[case["name"]], actual)
+            base = baseline.get(case["name"], {})
+            scale = calibration / base["calibration_us"] if base.get("calibration_us") else 1.0
+            verdict, ratio, p_value = compare(samples["total_us"], [v * scale for v in base.get("total_us", [])],
+                                              args.tolerance, args.alpha, args.min_delta)
+            results.append({"name": case["name"], "mode": case["mode"], "samples": samples, "actual": actual,
+                            "calibration_us": calibration,
+                            "golden_ok": not diffs, "golden_diff": diffs,
+                            "verdict": verdict, "ratio": ratio, "p_value": p_value})
+        print()
+        checks = run_checks(build_cases(), bedrock, ses)
+
+        profiler = ModeProfiler(args.profile, top=args.top) if args.profile else None
+        if profiler:
+            for i, case in enumerate(cases, 1):
+                print(f"\rProfiling {i}/{len(cases)}: {case['name'][:60]:<60}", end="", flush=True)
+                profile_case(case, args.profile_iterations, profiler)
+            print()
+
+    passed = print_report(results, bool(baseline), checks)
+    if profiler:
+        profiler.print_report()
+        print(f"  Profiles written: {len(profiler.write())} files in {args.profile}")
+
+    if args.update_golden:
+        golden.update({r["name"]: r["actual"] for r in results})
+        write_json(GOLDEN_PATH, golden)
+        print(f"  Golden responses written to {GOLDEN_PATH}")
+    if args.save_baseline:
+        stored = load_json(args.baseline, {}).get("cases", {})
+        stored.update({r["name"]: {"mode": r["mode"], "calibration_us": round(r["calibration_us"], 2),
+                                   "total_us": [round(v, 1) for v in r["samples"]["total_us"][:MAX_BASELINE_SAMPLES]]}
+                       for r in results})
+        write_json(args.baseline, {"created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                                   "python": platform.python_version(), "cases": stored})
+        print(f"  Timing baseline written to {args.baseline}")
+
+    sys.exit(0 if passed or args.update_golden or args.save_baseline else 1)
+
+
+if __name__ == "__main__":
+    main()
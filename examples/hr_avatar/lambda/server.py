@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Self-hosted HTTP server for the analysis handlers (ASGI).
+
+Runs lambda_handler in one long-lived process behind your own load balancer
+instead of API Gateway + Lambda: no cold starts, no per-invocation setup, and
+one Bedrock client - one warm connection pool - shared by every request.
+
+Each HTTP request becomes the API Gateway HTTP API (v2) event lambda_handler
+already understands and runs on a bounded worker thread pool (the handlers
+block on Bedrock); the event loop only reads and writes HTTP.
+
+    POST <any path>   analysis request: same body, headers and responses as the API endpoint
+    OPTIONS           CORS preflight (answered by lambda_handler)
+    GET /health       200 while serving, 503 once draining (load balancer health check)
+
+Backpressure: at most --workers requests run and --queue more wait; beyond
+that the server answers 503 OVERLOADED with Retry-After at once instead of
+queueing without bound (clients already retry 503/429).
+
+Graceful shutdown (SIGTERM/SIGINT): new requests get 503 and /health turns
+503, in-flight requests finish (up to --drain-timeout), and background work
+started off the request path (report delivery, progressive refines) gets the
+rest of that time.
+
+Usage (needs uvicorn: pip install uvicorn):
+    python3 server.py --port 8080 --workers 32
+    python3 server.py --stub --model-latency        # recorded responses, no AWS
+    uvicorn server:app --port 8080                   # SERVER_WORKERS / SERVER_QUEUE / SERVER_DRAIN_TIMEOUT_S
+"""
+
+import argparse
+import asyncio
+import base64
+import contextvars
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+
+import boto3  # noqa: E402
+from botocore.config import Config  # noqa: E402
+
+import lambda_function as lf  # noqa: E402
+
+DEFAULT_WORKERS = int(os.environ.get('SERVER_WORKERS', '32'))
+DEFAULT_QUEUE = int(os.environ.get('SERVER_QUEUE', '64'))
+DEFAULT_DRAIN_TIMEOUT_S = float(os.environ.get('SERVER_DRAIN_TIMEOUT_S', '30'))
+RETRY_AFTER_S = 1.0
+BACKGROUND_THREADS = ('report-delivery', 'refine-result')  # lambda_function's off-request-path threads
+
+
+class AnalysisServer:
+    """ASGI app: lambda_handler on a bounded worker pool, with load shedding and draining."""
+
+    def __init__(self, workers=DEFAULT_WORKERS, queue=DEFAULT_QUEUE, drain_timeout_s=DEFAULT_DRAIN_TIMEOUT_S):
+        self.workers = workers
+        self.capacity = workers + queue
+        self.drain_timeout_s = drain_timeout_s
+        self.pool = None
+        self.in_flight = 0  # touched only on the event loop, so no lock
+        self.served = 0
+        self.rejected = 0
+        self.draining = False
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.start()
+                await asyncio.get_running_loop().run_in_executor(self.pool, warm)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.drain()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def start(self):
+        if self.pool is None:
+            share_bedrock_pool(self.workers + lf.PARALLEL_MAX_WORKERS)
+            self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='analysis')
+
+    async def http(self, scope, receive, send):
+        method = scope['method']
+        if method == 'GET' and scope['path'] == '/health':
+            await send_response(send, {
+                'statusCode': 503 if self.draining else 200,
+                'headers': {'Content-Type': 'application/json'},
+                'body': lf.json_dumps({'status': 'draining' if self.draining else 'ok', 'in_flight': self.in_flight,
+                                       'workers': self.workers, 'served': self.served, 'rejected': self.rejected}),
+            })
+            return
+        if method not in ('POST', 'OPTIONS'):
+            await send_response(send, lf.error_response(f'Method {method} not allowed', 'METHOD_NOT_ALLOWED', 405))
+            return
+        if self.draining:
+            await send_response(send, lf.error_response('Server shutting down, please retry', 'SHUTTING_DOWN', 503,
+                                                         retry_after=RETRY_AFTER_S))
+            return
+        if self.in_flight >= self.capacity:
+            self.rejected += 1
+            await send_response(send, lf.error_response('Server busy, please retry', 'OVERLOADED', 503,
+                                                         retry_after=RETRY_AFTER_S))
+            return
+
+        self.start()
+        self.in_flight += 1
+        try:
+            body = await read_body(receive, lf.MAX_REQUEST_BYTES)
+            if body is None:
+                response = lf.error_response(f'Request body exceeds {lf.MAX_REQUEST_BYTES} bytes',
+                                             'PAYLOAD_TOO_LARGE', 413)
+            else:
+                # A fresh context per request: lambda_handler's context vars must not leak between requests
+                response = await asyncio.get_running_loop().run_in_executor(
+                    self.pool, contextvars.Context().run, lf.lambda_handler, lambda_event(scope, body), None)
+                self.served += 1
+        finally:
+            self.in_flight -= 1
+        await send_response(send, response)
+
+    async def drain(self):
+        """Refuse new work, then wait for in-flight requests and background threads."""
+        self.draining = True
+        deadline = time.monotonic() + self.drain_timeout_s
+        while self.in_flight and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self.pool:
+            self.pool.shutdown(wait=not self.in_flight, cancel_futures=True)
+        background = [t for t in threading.enumerate() if t.name in BACKGROUND_THREADS]
+        for thread in background:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        unfinished = self.in_flight + sum(t.is_alive() for t in background)
+        print(f'Drained: {self.served} served, {self.rejected} rejected, {unfinished} unfinished')
+
+
+def share_bedrock_pool(connections):
+    """Give the shared Bedrock client a pool big enough for every worker (botocore's default is 10)."""
+    if hasattr(lf.bedrock, 'meta'):  # a real botocore client, not a stub
+        lf.bedrock = boto3.client('bedrock-runtime',
+                                  config=lf.bedrock_config.merge(Config(max_pool_connections=connections)))
+
+
+def warm():
+    """Prime clients, connections and templates before the first request (the Lambda warmup mode)."""
+    lf.lambda_handler({'body': lf.json_dumps({'analysis_mode': 'warmup'})}, None)
+
+
+async def read_body(receive, limit):
+    """Read the whole request body; None once it exceeds `limit` bytes."""
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > limit:
+            return None
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+
+def lambda_event(scope, body):
+    """The API Gateway HTTP API (v2) event for this request, as lambda_handler receives it behind API Gateway."""
+    headers = {}
+    for name, value in scope['headers']:
+        name, value = name.decode('latin-1').lower(), value.decode('latin-1')
+        headers[name] = f'{headers[name]},{value}' if name in headers else value
+
+    is_base64 = bool(headers.get('content-encoding'))
+    if not is_base64:
+        try:
+            text = body.decode('utf-8')
+        except UnicodeDecodeError:
+            is_base64 = True
+    if is_base64:
+        text = base64.b64encode(body).decode('ascii')
+
+    client = scope.get('client') or ('', 0)
+    return {
+        'version': '2.0',
+        'rawPath': scope['path'],
+        'rawQueryString': scope.get('query_string', b'').decode('latin-1'),
+        'headers': headers,
+        'body': text,
+        'isBase64Encoded': is_base64,
+        'requestContext': {'http': {'method': scope['method'], 'path': scope['path'], 'sourceIp': client[0]}},
+    }
+
+
+async def send_response(send, response):
+    body = response.get('body') or ''
+    body = body.encode('utf-8') if isinstance(body, str) else body
+    headers = [(name.lower().encode('latin-1'), str(value).encode('latin-1'))
+               for name, value in (response.get('headers') or {}).items()]
+    headers.append((b'content-length', str(len(body)).encode('ascii')))
+    await send({'type': 'http.response.start', 'status': response['statusCode'], 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def install_stub(model_latency=False, max_concurrency=None):
+    """Serve recorded responses (bedrock_stub.py), optionally with benchmark.py's model latency."""
+    from benchmark import STUB_FIRST_TOKEN_S, STUB_TOKEN_S
+    from bedrock_stub import stub_clients
+    if model_latency:
+        lf.bedrock, lf.ses = stub_clients(lf, latency_s=STUB_FIRST_TOKEN_S, token_latency_s=STUB_TOKEN_S,
+                                          max_concurrency=max_concurrency)
+    else:
+        lf.bedrock, lf.ses = stub_clients(lf, max_concurrency=max_concurrency)
+
+
+# `uvicorn server:app`
+app = AnalysisServer()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the analysis handlers over HTTP (ASGI, uvicorn)')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Requests handled at once')
+    parser.add_argument('--queue', type=int, default=DEFAULT_QUEUE, help='Requests waiting for a worker before 503')
+    parser.add_argument('--drain-timeout', type=float, default=DEFAULT_DRAIN_TIMEOUT_S,
+                        help='Seconds to finish in-flight and background work on shutdown')
+    parser.add_argument('--stub', action='store_true', help='Serve recorded responses (no AWS)')
+    parser.add_argument('--model-latency', action='store_true', help='With --stub: add modeled model latency')
+    parser.add_argument('--stub-concurrency', type=int, metavar='N',
+                        help='With --stub: throttle model calls beyond N in flight')
+    parser.add_argument('--log-level', default='warning')
+    args = parser.parse_args()
+
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit('server.py needs uvicorn: pip install uvicorn')
+
+    if args.stub:
+        install_stub(args.model_latency, args.stub_concurrency)
+    server = AnalysisServer(args.workers, args.queue, args.drain_timeout)
+    uvicorn.run(server, host=args.host, port=args.port, lifespan='on', log_level=args.log_level,
+                access_log=False, timeout_graceful_shutdown=args.drain_timeout)
+
+
+if __name__ == '__main__':
+    main()
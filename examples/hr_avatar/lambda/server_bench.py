@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark: server.py over HTTP vs. lambda_handler called in-process.
+
+Both paths serve the regression suite's request mix (every mode, round-robin)
+from the recorded Bedrock/SES stub, so the numbers isolate what the runtime
+adds. The in-process path calls lambda_handler from N client threads - the
+floor, with no transport at all (what a warm Lambda spends inside the
+handler). The server path starts server.py --stub in a child process and
+sends the same requests over keep-alive HTTP connections (one per client
+thread, as a load balancer would).
+
+Reported per path and concurrency: requests/sec, latency p50/p95/p99, and
+non-200 responses. With --overload, a last run sends far more concurrent
+requests than --workers + --queue to show load shedding: excess requests
+get 503 at once and the accepted ones keep a bounded latency.
+
+Usage (the server path needs uvicorn: pip install uvicorn):
+    python3 server_bench.py                                 # concurrency 1,8,32; no model latency
+    python3 server_bench.py --model-latency --requests 200  # add modeled time-to-first-token + per-token delay
+    python3 server_bench.py --concurrency 16 --workers 8 --queue 8 --overload
+"""
+
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+
+import lambda_function as lf  # noqa: E402
+from regression import build_cases  # noqa: E402
+from server import install_stub  # noqa: E402
+
+DEFAULT_REQUESTS = 400
+DEFAULT_CONCURRENCY = '1,8,32'
+DEFAULT_PORT = 8765
+SERVER_START_TIMEOUT_S = 30
+
+
+def request_bodies():
+    """The regression request mix, encoded once."""
+    return [json.dumps(case['payload']).encode('utf-8') for case in build_cases()]
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def run_load(send_one, bodies, requests, concurrency):
+    """Send `requests` bodies from `concurrency` threads; returns req/s, latency percentiles and statuses."""
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def worker(state):
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            t0 = time.perf_counter()
+            status = send_one(state, bodies[i % len(bodies)])
+            elapsed = time.perf_counter() - t0
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] = statuses.get(status, 0) + 1
+
+    t_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker, {})
+    wall = time.perf_counter() - t_start
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'rps': requests / wall,
+        # Every request is timed, rejected ones included
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'statuses': statuses,
+    }
+
+
+def in_process_send(state, body):
+    event = {'body': body.decode('utf-8'), 'headers': {'content-type': 'application/json'},
+             'requestContext': {'http': {'method': 'POST'}}}
+    return lf.lambda_handler(event, None)['statusCode']
+
+
+def http_sender(port):
+    def send(state, body):
+        conn = state.get('conn')
+        if conn is None:
+            conn = state['conn'] = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+        try:
+            conn.request('POST', '/', body=body, headers={'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            state['conn'] = None
+            return 'error'
+    return send
+
+
+def start_server(port, workers, queue, model_latency):
+    cmd = [sys.executable, os.path.join(HERE, 'server.py'), '--stub', '--port', str(port), '--host', '127.0.0.1',
+           '--workers', str(workers), '--queue', str(queue)]
+    if model_latency:
+        cmd.append('--model-latency')
+    log = tempfile.TemporaryFile(mode='w+')  # not a pipe: a chatty server must never block on it
+    proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, text=True)
+    proc.log = log
+    deadline = time.monotonic() + SERVER_START_TIMEOUT_S
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            sys.exit(f'server.py exited: {server_output(proc)}')
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/health')
+            if conn.getresponse().status == 200:
+                return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    sys.exit(f'server.py did not become healthy within {SERVER_START_TIMEOUT_S}s')
+
+
+def server_output(proc):
+    proc.log.seek(0)
+    return proc.log.read().strip()
+
+
+def stop_server(proc):
+    """SIGTERM the server and return its drain summary line."""
+    proc.terminate()
+    try:
+        proc.wait(timeout=SERVER_START_TIMEOUT_S)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+    lines = [line for line in server_output(proc).splitlines() if line.startswith('Drained:')]
+    return lines[-1] if lines else 'no drain summary'
+
+
+def print_rows(rows):
+    print(f"\n  {'Path':<12} {'Conc':>5} {'Req/s':>9} {'p50':>9} {'p95':>9} {'p99':>9}  Non-200")
+    print(f"  {'─' * 12} {'─' * 5} {'─' * 9} {'─' * 9} {'─' * 9} {'─' * 9}  {'─' * 20}")
+    for row in rows:
+        other = {str(k): v for k, v in row['statuses'].items() if k != 200}
+        print(f"  {row['path']:<12} {row['concurrency']:>5} {row['rps']:>9.1f} {row['p50_ms']:>7.1f}ms "
+              f"{row['p95_ms']:>7.1f}ms {row['p99_ms']:>7.1f}ms  {other or '-'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark server.py against in-process lambda_handler calls')
+    parser.add_argument('--requests', type=int, default=DEFAULT_REQUESTS, help='Requests per run')
+    parser.add_argument('--concurrency', default=DEFAULT_CONCURRENCY, help='Comma-separated client thread counts')
+    parser.add_argument('--workers', type=int, default=32, help='server.py --workers')
+    parser.add_argument('--queue', type=int, default=64, help='server.py --queue')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--model-latency', action='store_true', help='Stub adds modeled model latency')
+    parser.add_argument('--overload', action='store_true',
+                        help='Also run the server at 4x (workers + queue) concurrent requests')
+    parser.add_argument('--json', metavar='PATH', help='Also write the rows to PATH')
+    args = parser.parse_args()
+
+    levels = [int(c) for c in args.concurrency.split(',')]
+    bodies = request_bodies()
+    install_stub(args.model_latency)
+    lf.lambda_handler({'body': '{"analysis_mode":"warmup"}'}, None)
+
+    print('=' * 78)
+    print(f"  server.py vs in-process — {len(bodies)}-request mix, {args.requests} requests per run, "
+          f"{'model latency' if args.model_latency else 'no model latency'}")
+    print('=' * 78)
+
+    rows = []
+    for concurrency in levels:
+        rows.append({'path': 'in-process', **run_load(in_process_send, bodies, args.requests, concurrency)})
+
+    proc = start_server(args.port, args.workers, args.queue, args.model_latency)
+    try:
+        send = http_sender(args.port)
+        for concurrency in levels:
+            rows.append({'path': 'server', **run_load(send, bodies, args.requests, concurrency)})
+        if args.overload:
+            concurrency = 4 * (args.workers + args.queue)
+            rows.append({'path': 'server (over)', **run_load(send, bodies, max(args.requests, 2 * concurrency),
+                                                             concurrency)})
+    finally:
+        drained = stop_server(proc)
+
+    print_rows(rows)
+    print(f'\n  server.py shutdown: {drained}')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=2, default=str)
+        print(f'  Rows written to {args.json}')
+
+
+if __name__ == '__main__':
+    main()
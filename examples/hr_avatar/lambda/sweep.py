@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+Parameter sweep: model, max_tokens and temperature per analysis mode.
+
+Every model call the Lambda makes (one per prompt template: per_problem,
+multi_problem, synthesis, synthesis_prose, knowledge_check, training_summary,
+general, full, full_draft) is rendered from the regression suite's requests
+exactly as the handlers render it, then sent with each configuration in the
+grid MODEL_ID x max_tokens x TEMPERATURE. Per mode and configuration it records
+
+    latency      p50 / p95 of the model call (what max_tokens and the model change)
+    out tokens   mean output tokens
+    truncated    share of calls that stopped at max_tokens
+    parse fail   share whose output is not valid JSON (truncation included)
+    complete     mean share of the reference schema present (fields of the recorded
+                 response for the mode, nested objects and list items included)
+
+and picks, per mode, the fastest configuration whose every sample parsed, was
+not truncated, met --min-completeness and left --min-headroom of max_tokens
+unused (ties within 10% of the best p50 go to the smaller max_tokens, then the
+lower temperature). Output length varies between samples, so use --samples 10
+or more before changing a budget.
+
+max_tokens is swept as a multiple of each mode's current budget (MODE_MAX_TOKENS,
+MAX_TOKENS for full, COMBINED_TOKENS_PER_PROBLEM x problems for multi_problem).
+
+Backends:
+    --stub          (default) recorded responses with benchmark.py's latency model;
+                    other models scale latency/verbosity per STUB_MODEL_PROFILES,
+                    temperature spreads output length, and max_tokens truncates
+    --replay LOG    recorded traffic (traffic_replay.py): recordings of the same
+                    model are preferred and cut at max_tokens
+    --live          real Bedrock calls (costs tokens); add --record LOG to keep
+                    them for later --replay runs
+
+Usage:
+    python3 sweep.py                                        # default grid, every mode, stub
+    python3 sweep.py --modes per_problem,general --samples 5
+    python3 sweep.py --models anthropic.claude-3-haiku-20240307-v1:0 --max-tokens-scale 0.25,0.5,1
+    python3 sweep.py --live --record sweep.jsonl.gz --concurrency 4
+    python3 sweep.py --replay sweep.jsonl.gz --json sweep.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+
+import lambda_function as lf  # noqa: E402
+from bedrock_stub import load_recorded_responses, stub_clients  # noqa: E402
+from benchmark import STUB_FIRST_TOKEN_S, STUB_TOKEN_S  # noqa: E402
+from regression import build_cases  # noqa: E402
+
+SWEEP_MODES = ('per_problem', 'multi_problem', 'synthesis', 'synthesis_prose', 'knowledge_check',
+               'training_summary', 'general', 'full', 'full_draft')
+DEFAULT_MODELS = ('anthropic.claude-3-haiku-20240307-v1:0', 'anthropic.claude-3-5-haiku-20241022-v1:0')
+DEFAULT_MAX_TOKENS_SCALES = (0.25, 0.5, 1.0, 1.5)
+DEFAULT_TEMPERATURES = (0.0, 0.3, 0.7)
+DEFAULT_SAMPLES = 3
+DEFAULT_CONCURRENCY = 16
+DEFAULT_MIN_COMPLETENESS = 0.95
+DEFAULT_MIN_HEADROOM = 0.10  # the longest sampled answer must leave this share of max_tokens unused
+TIE_TOLERANCE = 0.10  # within 10% of the fastest p50 counts as a tie (sampling noise at a few samples)
+
+# Assumed speed/verbosity of other models relative to the recordings (claude-3-haiku).
+# Rough starting points only: calibrate with a --live --record run, then --replay it.
+STUB_MODEL_PROFILES = {
+    'anthropic.claude-3-haiku-20240307-v1:0': {'latency': 1.0, 'verbosity': 1.0},
+    'anthropic.claude-3-5-haiku-20241022-v1:0': {'latency': 1.3, 'verbosity': 1.15},
+    'anthropic.claude-3-5-sonnet-20241022-v2:0': {'latency': 2.2, 'verbosity': 1.25},
+}
+STUB_LENGTH_SPREAD = 0.5  # log-normal sigma of output length at temperature 1.0
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Requests and reference schemas
+# ─────────────────────────────────────────────────────────────────────────────
+
+def mode_bodies():
+    """Request bodies per sweep mode, from the regression cases (several per mode where the suite has them)."""
+    bodies = {mode: [] for mode in SWEEP_MODES}
+    for case in build_cases():
+        payload = case['payload']
+        if case['mode'] == 'multi_problem':
+            if payload.get('strategy') == 'combined':
+                bodies['multi_problem'].append(dict(payload, problems=payload['dpp']['all_problems_in_session']))
+        elif case['mode'] == 'synthesis':
+            if payload.get('synthesis_engine') == 'llm':
+                bodies['synthesis'].append(payload)
+                scores = lf.score_problem_results(payload['problem_results'])
+                bodies['synthesis_prose'].append(dict(payload, assessment=scores['summary']))
+        elif case['mode'] == 'full':
+            bodies['full'].append(payload)
+            bodies['full_draft'].append(payload)
+        elif case['mode'] in bodies:
+            bodies[case['mode']].append(payload)
+    return bodies
+
+
+def current_budget(mode, body):
+    if mode == 'multi_problem':
+        return lf.COMBINED_TOKENS_PER_PROBLEM * len(body['problems'])
+    return lf.MODE_MAX_TOKENS[mode] or lf.MAX_TOKENS
+
+
+def reference_schemas():
+    """Expected field paths per mode: the recorded (known good) response for it."""
+    recorded = load_recorded_responses()
+    per_problem = next(iter(recorded['per_problem'].values()))['content']
+    schemas = {mode: schema_paths(recorded[mode]['content']) for mode in SWEEP_MODES if mode in recorded
+               and mode != 'per_problem'}
+    schemas['per_problem'] = schema_paths(per_problem)
+    schemas['multi_problem'] = schema_paths({'problems': [per_problem]})
+    return schemas
+
+
+def schema_paths(value, prefix=''):
+    """Leaf paths of a JSON value; list items are described by their first element ("a[].b")."""
+    if isinstance(value, dict) and value:
+        return [path for key, item in value.items() for path in schema_paths(item, f'{prefix}.{key}' if prefix else key)]
+    if isinstance(value, list) and value and isinstance(value[0], (dict, list)):
+        return schema_paths(value[0], f'{prefix}[]')
+    return [prefix]
+
+
+def has_path(value, path):
+    """True when `path` is present; a "[]" step needs a non-empty list whose every item has the rest."""
+    if not path:
+        return True
+    head, _, rest = path.partition('.')
+    if head.endswith('[]'):
+        key = head[:-2]
+        items = value.get(key) if key and isinstance(value, dict) else value
+        inner = rest
+        if not isinstance(items, list) or not items:
+            return False
+        return all(has_path(item, inner) for item in items)
+    if not isinstance(value, dict) or head not in value:
+        return False
+    return has_path(value[head], rest)
+
+
+def completeness(summary, paths):
+    return sum(has_path(summary, path) for path in paths) / len(paths) if paths else 1.0
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# One model call
+# ─────────────────────────────────────────────────────────────────────────────
+
+def run_call(mode, body, max_tokens, temperature, paths):
+    """Render the mode's prompt, send one request with this configuration, and score the answer."""
+    system_prompt, user_prompt = lf.render_prompt(mode, lf.PromptContext(body))
+    request_json = json.dumps({
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "system": system_prompt,
+        "messages": [{"role": "user", "content": user_prompt}]
+    })
+    t0 = time.perf_counter()
+    try:
+        raw = lf.invoke_bedrock(request_json, system_prompt)
+    except Exception as e:
+        return {'latency_s': time.perf_counter() - t0, 'error': type(e).__name__}
+    latency_s = time.perf_counter() - t0
+
+    message = json.loads(raw)
+    result = {'latency_s': latency_s, 'output_tokens': message.get('usage', {}).get('output_tokens', 0),
+              'truncated': message.get('stop_reason') == 'max_tokens', 'parsed': False, 'complete': 0.0}
+    try:
+        summary, _, _ = lf.parse_bedrock_response(raw)
+    except ValueError:
+        return result
+    result.update(parsed=True, complete=completeness(summary, paths))
+    return result
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Sweep
+# ─────────────────────────────────────────────────────────────────────────────
+
+def sweep(modes, models, scales, temperatures, samples, concurrency):
+    """Run the grid; returns one row per (mode, model, max_tokens scale, temperature)."""
+    bodies = mode_bodies()
+    schemas = reference_schemas()
+    rows = []
+    for model in models:
+        lf.MODEL_ID = model  # invoke_bedrock sends lf.MODEL_ID; one model at a time keeps that safe
+        jobs = []
+        for mode in modes:
+            for scale in scales:
+                for temperature in temperatures:
+                    for i in range(samples):
+                        body = bodies[mode][i % len(bodies[mode])]
+                        max_tokens = max(1, round(current_budget(mode, body) * scale))
+                        jobs.append(((mode, scale, temperature), (mode, body, max_tokens, temperature, schemas[mode]),
+                                     max_tokens))
+        print(f'  {model}: {len(jobs)} calls ...', file=sys.stderr)
+        # parse_bedrock_response prints every unparseable answer; keep the report readable
+        with ThreadPoolExecutor(max_workers=concurrency) as pool, contextlib.redirect_stdout(io.StringIO()):
+            results = list(pool.map(lambda job: run_call(*job[1]), jobs))
+
+        grouped = {}
+        for (key, _, max_tokens), result in zip(jobs, results):
+            group = grouped.setdefault(key, {'max_tokens': [], 'results': []})
+            group['max_tokens'].append(max_tokens)
+            group['results'].append(result)
+        for (mode, scale, temperature), group in grouped.items():
+            rows.append(summarize(mode, model, scale, temperature, group['max_tokens'], group['results']))
+    return rows
+
+
+def summarize(mode, model, scale, temperature, max_tokens, results):
+    latencies = sorted(r['latency_s'] for r in results)
+    answered = [r for r in results if 'error' not in r]
+    n = len(results)
+    row = {
+        'mode': mode, 'model': model, 'max_tokens_scale': scale, 'temperature': temperature,
+        'max_tokens': round(statistics.mean(max_tokens)),
+        'samples': n,
+        'p50_s': statistics.median(latencies),
+        'p95_s': latencies[min(n - 1, int(n * 0.95))],
+        'output_tokens': statistics.mean(r['output_tokens'] for r in answered) if answered else 0,
+        'headroom': 1 - max((r['output_tokens'] for r in answered), default=0) / statistics.mean(max_tokens),
+        'errors': n - len(answered),
+        'truncated': sum(r['truncated'] for r in answered) / n,
+        'parse_fail': sum(not r['parsed'] for r in answered) / n,
+        'complete': statistics.mean(r['complete'] for r in answered) if answered else 0.0,
+    }
+    return row
+
+
+def is_valid(row, limits):
+    return (row['errors'] == 0 and row['truncated'] == 0 and row['parse_fail'] == 0
+            and row['complete'] >= limits['min_completeness'] and row['headroom'] >= limits['min_headroom'])
+
+
+def best_config(rows, limits):
+    """Fastest valid row; near-ties (TIE_TOLERANCE) go to the smaller max_tokens, then lower temperature."""
+    valid = [row for row in rows if is_valid(row, limits)]
+    if not valid:
+        return None
+    fastest = min(row['p50_s'] for row in valid)
+    near = [row for row in valid if row['p50_s'] <= fastest * (1 + TIE_TOLERANCE)]
+    return min(near, key=lambda row: (row['max_tokens'], row['temperature'], row['p50_s']))
+
+
+def current_row(rows):
+    """The row matching today's settings (MODEL_ID, budgets, TEMPERATURE), if the grid has it."""
+    return next((row for row in rows if row['model'] == CURRENT['model'] and row['max_tokens_scale'] == 1.0
+                 and row['temperature'] == CURRENT['temperature']), None)
+
+
+CURRENT = {'model': lf.MODEL_ID, 'temperature': lf.TEMPERATURE}
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Report
+# ─────────────────────────────────────────────────────────────────────────────
+
+def short_model(model):
+    return model.split('.', 1)[-1].rsplit('-v', 1)[0]
+
+
+def print_report(rows, modes, limits, verbose):
+    print('=' * 110)
+    print(f'  Parameter sweep — fastest configuration with valid, untruncated JSON '
+          f"(completeness >= {limits['min_completeness']:.0%}, headroom >= {limits['min_headroom']:.0%}) per mode")
+    print('=' * 110)
+    print(f"\n  {'Mode':<17} {'Model':<27} {'max_tok':>7} {'temp':>5} {'p50':>8} {'p95':>8} {'out tok':>7}  "
+          f"{'Current p50':>11}  Note")
+    print(f"  {'─' * 17} {'─' * 27} {'─' * 7} {'─' * 5} {'─' * 8} {'─' * 8} {'─' * 7}  {'─' * 11}  {'─' * 20}")
+    best = {}
+    for mode in modes:
+        mode_rows = [row for row in rows if row['mode'] == mode]
+        best[mode] = row = best_config(mode_rows, limits)
+        current = current_row(mode_rows)
+        current_p50 = f"{current['p50_s']:>10.2f}s" if current else f"{'-':>11}"
+        if row is None:
+            print(f"  {mode:<17} {'(no valid configuration)':<27} {'':>7} {'':>5} {'':>8} {'':>8} {'':>7}  {current_p50}")
+            continue
+        note = ''
+        if current and not is_valid(current, limits):
+            note = 'current config fails'
+        elif current and row['max_tokens'] < current['max_tokens']:
+            note = f"max_tokens {current['max_tokens']} -> {row['max_tokens']}"
+        print(f"  {mode:<17} {short_model(row['model']):<27} {row['max_tokens']:>7} {row['temperature']:>5.1f} "
+              f"{row['p50_s']:>7.2f}s {row['p95_s']:>7.2f}s {row['output_tokens']:>7.0f}  {current_p50}  {note}")
+
+    if verbose:
+        print(f"\n  {'Mode':<17} {'Model':<27} {'max_tok':>7} {'temp':>5} {'p50':>8} {'p95':>8} {'out tok':>7} "
+              f"{'trunc':>6} {'parse✗':>6} {'compl':>6}")
+        for row in sorted(rows, key=lambda r: (modes.index(r['mode']), r['model'], r['max_tokens'], r['temperature'])):
+            mark = '★' if row is best.get(row['mode']) else ('✓' if is_valid(row, limits) else ' ')
+            print(f"{mark:>2} {row['mode']:<17} {short_model(row['model']):<27} {row['max_tokens']:>7} "
+                  f"{row['temperature']:>5.1f} {row['p50_s']:>7.2f}s {row['p95_s']:>7.2f}s "
+                  f"{row['output_tokens']:>7.0f} {row['truncated']:>6.0%} {row['parse_fail']:>6.0%} "
+                  f"{row['complete']:>6.0%}")
+    print()
+    return best
+
+
+def parse_floats(text):
+    return [float(v) for v in text.split(',') if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sweep model, max_tokens and temperature per analysis mode')
+    backend = parser.add_mutually_exclusive_group()
+    backend.add_argument('--stub', action='store_true', help='Recorded responses with a latency model (default)')
+    backend.add_argument('--replay', metavar='LOG', help='Replay a recorded traffic log')
+    backend.add_argument('--live', action='store_true', help='Real Bedrock calls')
+    parser.add_argument('--record', metavar='LOG', help='With --live: record traffic to LOG for later --replay')
+    parser.add_argument('--latency-scale', type=float, default=1.0, help='Scale replayed latencies (with --replay)')
+    parser.add_argument('--modes', default=','.join(SWEEP_MODES), help='Comma-separated modes')
+    parser.add_argument('--models', default=','.join(DEFAULT_MODELS), help='Comma-separated Bedrock model ids')
+    parser.add_argument('--max-tokens-scale', default=','.join(map(str, DEFAULT_MAX_TOKENS_SCALES)),
+                        help="Comma-separated multiples of each mode's current max_tokens")
+    parser.add_argument('--temperatures', default=','.join(map(str, DEFAULT_TEMPERATURES)))
+    parser.add_argument('--samples', type=int, default=DEFAULT_SAMPLES, help='Calls per mode and configuration')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help='Model calls in flight')
+    parser.add_argument('--min-completeness', type=float, default=DEFAULT_MIN_COMPLETENESS)
+    parser.add_argument('--min-headroom', type=float, default=DEFAULT_MIN_HEADROOM,
+                        help='Share of max_tokens the longest sampled answer must leave unused')
+    parser.add_argument('--seed', type=int, default=0, help='Stub output-length randomness')
+    parser.add_argument('--verbose', '-v', action='store_true', help='Print every configuration, not just the best')
+    parser.add_argument('--json', metavar='PATH', help='Also write every row and the picks to PATH')
+    args = parser.parse_args()
+
+    modes = [m for m in args.modes.split(',') if m]
+    unknown = [m for m in modes if m not in SWEEP_MODES]
+    if unknown:
+        parser.error(f'unknown modes: {", ".join(unknown)} (choose from {", ".join(SWEEP_MODES)})')
+
+    if args.replay:
+        from traffic_replay import load_traffic_log, replay_clients
+        lf.bedrock, lf.ses = replay_clients(load_traffic_log(args.replay), args.latency_scale)
+    elif args.live:
+        if args.record:
+            lf.TRAFFIC_LOG_PATH = args.record
+    else:
+        lf.bedrock, lf.ses = stub_clients(lf, latency_s=STUB_FIRST_TOKEN_S, token_latency_s=STUB_TOKEN_S,
+                                          model_profiles=STUB_MODEL_PROFILES, length_spread=STUB_LENGTH_SPREAD,
+                                          seed=args.seed)
+
+    t0 = time.perf_counter()
+    rows = sweep(modes, [m for m in args.models.split(',') if m], parse_floats(args.max_tokens_scale),
+                 parse_floats(args.temperatures), args.samples, args.concurrency)
+    print(f'  {sum(r["samples"] for r in rows)} calls in {time.perf_counter() - t0:.0f}s\n', file=sys.stderr)
+    limits = {'min_completeness': args.min_completeness, 'min_headroom': args.min_headroom}
+    best = print_report(rows, modes, limits, args.verbose)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'rows': rows, 'best': best, 'current': CURRENT}, f, indent=2)
+        print(f'  Rows written to {args.json}')
+
+
+if __name__ == '__main__':
+    main()
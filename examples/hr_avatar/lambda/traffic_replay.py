@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Replay clients for Bedrock/SES traffic recorded by lambda_function.
+
+Set TRAFFIC_LOG_PATH on the Lambda (or on an in-process run) to capture every
+Bedrock invoke_model and SES send_email call: request hash, response body,
+token usage and observed latency (see record_traffic in lambda_function.py).
+The clients below serve those responses back with the recorded latency —
+optionally scaled — so benchmarks and local runs reproduce real tail behavior,
+including throttling errors, without AWS.
+
+Lookup order for a Bedrock request:
+    1. exact request hash (same model, prompt and parameters)
+    2. same system prompt (same analysis mode) and model, round-robin over recordings
+    3. same system prompt, any model, round-robin
+    4. any recorded Bedrock response, round-robin (unless strict=True)
+
+A recording with more output tokens than the request's max_tokens is cut off
+with stop_reason "max_tokens", as the model would have been.
+
+Usage:
+    python3 traffic_replay.py traffic.jsonl.gz      # summarize a recorded log
+
+    from traffic_replay import load_traffic_log, replay_clients
+    bedrock, ses = replay_clients(load_traffic_log('traffic.jsonl.gz'), latency_scale=0.5)
+"""
+
+import gzip
+import io
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from collections import defaultdict
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+
+from bedrock_stub import BedrockExceptions, truncate_message  # noqa: E402
+from lambda_function import request_hash  # noqa: E402
+
+
+def load_traffic_log(path):
+    """Read a recorded traffic log (JSON Lines, optionally gzip-compressed)."""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _error_for(entry, exceptions=None):
+    """Rebuild the exception a recorded call raised, preferring the client's modeled class."""
+    name = entry['error']
+    cls = getattr(exceptions, name, None) if exceptions else None
+    if cls is None:
+        cls = type(name, (Exception,), {})
+    return cls(entry.get('message', name))
+
+
+class _RoundRobin:
+    """Thread-safe cycling index over lists of recorded entries."""
+
+    def __init__(self):
+        self._positions = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def pick(self, bucket, entries):
+        with self._lock:
+            i = self._positions[bucket]
+            self._positions[bucket] = i + 1
+        return entries[i % len(entries)]
+
+
+class ReplayBedrock:
+    """Drop-in for boto3's bedrock-runtime client that serves recorded responses."""
+
+    exceptions = BedrockExceptions
+
+    def __init__(self, entries, latency_scale=1.0, strict=False):
+        self.latency_scale = latency_scale
+        self.strict = strict
+        self.by_key = defaultdict(list)
+        self.by_prompt = defaultdict(list)
+        self.by_prompt_model = defaultdict(list)
+        self.all = []
+        for entry in entries:
+            if entry.get('kind') != 'bedrock':
+                continue
+            self.by_key[entry['key']].append(entry)
+            self.by_prompt[entry['prompt_key']].append(entry)
+            self.by_prompt_model[(entry['prompt_key'], entry.get('model'))].append(entry)
+            self.all.append(entry)
+        self.calls = []
+        self._rr = _RoundRobin()
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+
+    def _lookup(self, model_id, body):
+        key = request_hash(model_id, body)
+        if key in self.by_key:
+            return 'exact', self._rr.pick(key, self.by_key[key])
+        prompt_key = request_hash(json.loads(body).get('system', ''))
+        if (prompt_key, model_id) in self.by_prompt_model:
+            return 'mode+model', self._rr.pick((prompt_key, model_id), self.by_prompt_model[(prompt_key, model_id)])
+        if prompt_key in self.by_prompt:
+            return 'mode', self._rr.pick(prompt_key, self.by_prompt[prompt_key])
+        if self.strict or not self.all:
+            raise KeyError(f'No recorded Bedrock response for request {key}')
+        return 'any', self._rr.pick('*', self.all)
+
+    def invoke_model(self, modelId, body, contentType=None, accept=None):
+        t_enter = time.perf_counter()
+        match, entry = self._lookup(modelId, body)
+        time.sleep(entry['latency_ms'] * self.latency_scale / 1000)
+        with self._lock:
+            self.calls.append({'mode': entry.get('mode'), 'match': match,
+                               't_enter': t_enter, 't_exit': time.perf_counter()})
+        if 'error' in entry:
+            raise _error_for(entry, self.exceptions)
+        response = entry['response']
+        max_tokens = json.loads(body).get('max_tokens')
+        if max_tokens and entry.get('output_tokens', 0) > max_tokens:
+            response = json.dumps(truncate_message(json.loads(response), max_tokens))
+        return {'body': io.BytesIO(response.encode('utf-8')), 'contentType': 'application/json'}
+
+
+class ReplaySES:
+    """Drop-in for boto3's SES client that replays recorded send latencies and failures."""
+
+    def __init__(self, entries, latency_scale=1.0):
+        self.latency_scale = latency_scale
+        self.entries = [e for e in entries if e.get('kind') == 'ses']
+        self.calls = []
+        self._rr = _RoundRobin()
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+
+    def send_email(self, **kwargs):
+        t_enter = time.perf_counter()
+        entry = self._rr.pick('*', self.entries) if self.entries else {'latency_ms': 0, 'response': {}}
+        time.sleep(entry['latency_ms'] * self.latency_scale / 1000)
+        with self._lock:
+            self.calls.append({'to': kwargs['Destination']['ToAddresses'],
+                               't_enter': t_enter, 't_exit': time.perf_counter()})
+            n = len(self.calls)
+        if 'error' in entry:
+            raise _error_for(entry)
+        return {'MessageId': entry['response'].get('MessageId') or f'replay-{n}'}
+
+
+def replay_clients(entries, latency_scale=1.0, strict=False):
+    """Build a (bedrock, ses) replay pair from recorded traffic entries."""
+    return ReplayBedrock(entries, latency_scale, strict), ReplaySES(entries, latency_scale)
+
+
+def summarize(entries):
+    """Per kind/mode: call count, error count, latency percentiles, mean tokens."""
+    groups = defaultdict(list)
+    for entry in entries:
+        groups[(entry.get('kind'), entry.get('mode', '-'))].append(entry)
+
+    rows = []
+    for (kind, mode), group in sorted(groups.items()):
+        latencies = sorted(e['latency_ms'] for e in group)
+        ok = [e for e in group if 'error' not in e]
+        rows.append({
+            'kind': kind, 'mode': mode, 'calls': len(group), 'errors': len(group) - len(ok),
+            'p50_ms': statistics.median(latencies),
+            'p95_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+            'max_ms': latencies[-1],
+            'tokens_out': statistics.mean(e.get('output_tokens', 0) for e in ok) if ok else 0,
+        })
+    return rows
+
+
+def main():
+    if len(sys.argv) != 2:
+        print(__doc__)
+        sys.exit(2)
+    rows = summarize(load_traffic_log(sys.argv[1]))
+    print(f"\n  {'Kind':<8} {'Mode':<18} {'Calls':>6} {'Errors':>7} {'p50':>9} {'p95':>9} {'max':>9} {'out tok':>8}")
+    print("  " + "-" * 78)
+    for r in rows:
+        print(f"  {r['kind']:<8} {r['mode']:<18} {r['calls']:>6} {r['errors']:>7} {r['p50_ms']:>7.0f}ms "
+              f"{r['p95_ms']:>7.0f}ms {r['max_ms']:>7.0f}ms {r['tokens_out']:>8.0f}")
+    print()
+
+
+if __name__ == '__main__':
+    main()